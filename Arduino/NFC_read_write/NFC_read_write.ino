@@ -11,16 +11,64 @@
 #define LIBRARY_TEXT_RECORD_PREFIX "\02en"
 #define MIFARE_ULTRALIGHT_RECORD_LIMIT (4)
 
+// Binary framed protocol, see Rpi/lib/nfc_protocol.py
+// Frame: SOF | version | type | seq | length | payload | CRC16-CCITT of version..payload (big endian)
+#define PROTOCOL_VERSION 1
+#define HANDSHAKE_CHAR 0x16 // "\x16RPV<version> <baud>\n" asks for the binary protocol at <baud>
+#define FRAME_SOF 0xA5
+#define FRAME_HEADER_SIZE 5
+#define FRAME_MAX_PAYLOAD 200
+#define FRAME_HELLO 0x01
+#define FRAME_HELLO_ACK 0x81
+#define FRAME_TAG 0x02
+#define FRAME_WRITE_WHEELCHAIR_WEIGHT 0x03
+#define FRAME_WRITE_PATIENT_WEIGHT 0x04
+#define FRAME_WRITE_RESULT 0x84
+#define RESULT_OK 0
+#define RESULT_FAILED 1
+#define LEGACY_BAUD 9600
+#define FALLBACK_MS 2000 // back to the legacy text mode if the Pi does not confirm the new baud rate in time
+#define LINK_TIMEOUT_MS 10000 // back to the legacy text mode if the Pi sends no frame for that long, e.g. after a restart
+#define TAG_PERIOD_MS 1000 // a tag frame every second while a tag is present
+#define TAG_POLL_TIMEOUT_MS 100 // keeps the serial port serviced while waiting for a tag
+
+// Results of writeWheelchairWeight and writePatientWeight
+#define WRITE_NO_TAG (-1)
+#define WRITE_FAILED 0
+#define WRITE_OK 1
+
 PN532_HSU pn532hsu(Serial1);
 //PN532 nfc(pn532hsu);
 NfcAdapter nfc = NfcAdapter(pn532hsu);  // Indicates the Shield you are using
 
+boolean binaryMode = false;
+boolean binaryConfirmed = false; // the Pi has sent a valid frame at the new baud rate
+unsigned long switchedAt = 0;
+unsigned long lastFrameAt = 0; // last valid frame from the Pi, it sends a HELLO every few seconds as keepalive
+unsigned long lastTagFrame = 0;
+
+byte frameBuffer[FRAME_HEADER_SIZE + FRAME_MAX_PAYLOAD + 2];
+int frameLength = 0;
+
 void setup(void) {
   Serial.begin(9600);
   nfc.begin();
 }
 
+void sendWriteResult(int result) {
+  if (result == WRITE_OK) {
+    Serial.println("NFC tag successfully written!"); // if it works you will see this message 
+  } else if (result == WRITE_FAILED) {
+    Serial.println("Write failed"); // If the the rewrite failed you will see this message
+  }
+}
+
 void serialEvent() {
+  if (binaryMode) {
+    receiveFrames();
+    return;
+  }
+
   int incomingByte = 0;
   if (Serial.available()) {
     incomingByte = Serial.read();
@@ -36,87 +84,225 @@ void serialEvent() {
   // REGISTRATION expects input of this format !wheelchair_weight!
   if (receivedChar == REGISTRATION_STATE) {
     receivedStr = Serial.readStringUntil(REGISTRATION_STATE);
+    sendWriteResult(writeWheelchairWeight(receivedStr));
+  } else if (receivedChar == UPDATE_WEIGHT_STATE) { // Expected input @patient_weight@
+    receivedStr = Serial.readStringUntil(UPDATE_WEIGHT_STATE);
+    sendWriteResult(writePatientWeight(receivedStr));
+  } else if (receivedChar == HANDSHAKE_CHAR) { // Expected input \x16RPV<version> <baud>\n
+    receivedStr = Serial.readStringUntil('\n');
+    handleHandshake(receivedStr);
+  }
+
+}
+
+/**
+* Replaces the wheelchair weight record of the tag, keeping the other records
+* Returns WRITE_NO_TAG, WRITE_FAILED or WRITE_OK
+*/
+int writeWheelchairWeight(String receivedStr) {
+  if (!nfc.tagPresent()) {
+    return WRITE_NO_TAG;
+  }
+  NfcTag tag = nfc.read();
+  NdefMessage message = NdefMessage();
+
+  message.addTextRecord(WHEELCHAIR_WEIGHT_PREFIX + receivedStr); // Text Message you want to Record
+
+  // If tag already has a message, extract all the previous records
+  // EXCLUDING the wheelchairWeight record and append them to the new message
+  if (tag.hasNdefMessage()) {
+    NdefMessage originalMessage = tag.getNdefMessage();
 
-    if (nfc.tagPresent()) {
-      NfcTag tag = nfc.read();
-      NdefMessage message = NdefMessage();
-
-      message.addTextRecord(WHEELCHAIR_WEIGHT_PREFIX + receivedStr); // Text Message you want to Record
-
-      // If tag already has a message, extract all the previous records
-      // EXCLUDING the wheelchairWeight record and append them to the new message
-      // TODO: Extract method
-      if (tag.hasNdefMessage()) {
-        NdefMessage originalMessage = tag.getNdefMessage();
-
-        int recordCount = originalMessage.getRecordCount();
-        for (int i = 0; i < recordCount; i++) {
-          NdefRecord record = originalMessage.getRecord(i);
-
-          int payloadLength = record.getPayloadLength();
-          byte payload[payloadLength];
-          record.getPayload(payload);
-
-          boolean isWheelChairWeightRecord = false;
-          String payloadAsString = ""; // Processes the message as a string vs as a HEX value
-          
-          for (int c = 0; c < payloadLength; c++) {
-            payloadAsString += (char)payload[c];
-            // current record contains a wheelchair_weight, so it would not be added to the new message
-            if ((char)payload[c] == WHEELCHAIR_WEIGHT_SYMBOL) {
-              isWheelChairWeightRecord = true;
-              break;
-            }
-          }
-
-          // if current record has been detected ot be a wheelchair record, 
-          // skip the rest of the instructions
-          // and go to the next iterable
-          if (isWheelChairWeightRecord) {
-            continue;
-          }
-
-          // Replace unwanted prefix that is automatically encoded by 
-          // message::addTextRecord
-          payloadAsString.replace(LIBRARY_TEXT_RECORD_PREFIX, "");
-          message.addTextRecord(payloadAsString);
+    int recordCount = originalMessage.getRecordCount();
+    for (int i = 0; i < recordCount; i++) {
+      NdefRecord record = originalMessage.getRecord(i);
+
+      int payloadLength = record.getPayloadLength();
+      byte payload[payloadLength];
+      record.getPayload(payload);
+
+      boolean isWheelChairWeightRecord = false;
+      String payloadAsString = ""; // Processes the message as a string vs as a HEX value
+      
+      for (int c = 0; c < payloadLength; c++) {
+        payloadAsString += (char)payload[c];
+        // current record contains a wheelchair_weight, so it would not be added to the new message
+        if ((char)payload[c] == WHEELCHAIR_WEIGHT_SYMBOL) {
+          isWheelChairWeightRecord = true;
+          break;
         }
-      } 
+      }
 
-      boolean success = nfc.write(message);
-      if (success) {
-        Serial.println("NFC tag successfully written!"); // if it works you will see this message 
-      } else {
-        Serial.println("Write failed"); // If the the rewrite failed you will see this message
+      // if current record has been detected ot be a wheelchair record, 
+      // skip the rest of the instructions
+      // and go to the next iterable
+      if (isWheelChairWeightRecord) {
+        continue;
       }
+
+      // Replace unwanted prefix that is automatically encoded by 
+      // message::addTextRecord
+      payloadAsString.replace(LIBRARY_TEXT_RECORD_PREFIX, "");
+      message.addTextRecord(payloadAsString);
     }
-  } else if (receivedChar == UPDATE_WEIGHT_STATE) { // Expected input @patient_weight@
-    receivedStr = Serial.readStringUntil(UPDATE_WEIGHT_STATE);
-    if (nfc.tagPresent()) {
-      NfcTag tag = nfc.read();
+  } 
 
-      NdefMessage message = NdefMessage();
-      if (tag.hasNdefMessage()) {
-        message = tag.getNdefMessage();
-      } else {
-        message = NdefMessage();
-      }
+  return nfc.write(message) ? WRITE_OK : WRITE_FAILED;
+}
 
-      message.addTextRecord(PATIENT_WEIGHT_PREFIX + receivedStr);
-      
-      // Only attempts to write if NFC tag has less than 2 records
-      // Currently experiencing a problem when the 3rd block is written into
-      // CONFIGURED FOR MIFARE ULTRALIGHT, MIFARE CLASSIC HAS LESS SPACE
-      boolean success = message.getRecordCount() > MIFARE_ULTRALIGHT_RECORD_LIMIT ? false : nfc.write(message);  
-      if (success) {
-        Serial.println("NFC tag successfully written!"); // if it works you will see this message 
-      } else {
-        Serial.println("Write failed"); // If the the rewrite failed you will see this message
-      }
+/**
+* Appends a patient weight record, receivedStr is patient_weight,dd-mm-YYYY
+* Returns WRITE_NO_TAG, WRITE_FAILED or WRITE_OK
+*/
+int writePatientWeight(String receivedStr) {
+  if (!nfc.tagPresent()) {
+    return WRITE_NO_TAG;
+  }
+  NfcTag tag = nfc.read();
+
+  NdefMessage message = NdefMessage();
+  if (tag.hasNdefMessage()) {
+    message = tag.getNdefMessage();
+  } else {
+    message = NdefMessage();
+  }
+
+  message.addTextRecord(PATIENT_WEIGHT_PREFIX + receivedStr);
+  
+  // Only attempts to write if NFC tag has less than 2 records
+  // Currently experiencing a problem when the 3rd block is written into
+  // CONFIGURED FOR MIFARE ULTRALIGHT, MIFARE CLASSIC HAS LESS SPACE
+  boolean success = message.getRecordCount() > MIFARE_ULTRALIGHT_RECORD_LIMIT ? false : nfc.write(message);  
+  return success ? WRITE_OK : WRITE_FAILED;
+}
+
+/**
+* CRC16-CCITT (polynomial 0x1021), the same as crc16 in Rpi/lib/nfc_protocol.py
+* Start with crc 0xFFFF, feed the bytes in one or more calls
+*/
+uint16_t crc16Update(uint16_t crc, const byte *data, int length) {
+  for (int i = 0; i < length; i++) {
+    crc ^= (uint16_t)data[i] << 8;
+    for (int bit = 0; bit < 8; bit++) {
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
     }
   }
+  return crc;
+}
+
+void sendFrame(byte type, byte seq, const byte *payload, int length) {
+  byte header[FRAME_HEADER_SIZE] = {FRAME_SOF, PROTOCOL_VERSION, type, seq, (byte)length};
+  uint16_t crc = crc16Update(0xFFFF, header + 1, FRAME_HEADER_SIZE - 1);
+  crc = crc16Update(crc, payload, length);
+  Serial.write(header, FRAME_HEADER_SIZE);
+  Serial.write(payload, length);
+  Serial.write((byte)(crc >> 8));
+  Serial.write((byte)(crc & 0xFF));
+}
+
+void sendHelloAck(byte seq, uint32_t baud) {
+  byte payload[4] = {(byte)baud, (byte)(baud >> 8), (byte)(baud >> 16), (byte)(baud >> 24)};
+  sendFrame(FRAME_HELLO_ACK, seq, payload, 4);
+}
+
+void switchBaud(uint32_t baud) {
+  Serial.flush(); // waits until the answer has left at the old baud rate
+  Serial.end();
+  Serial.begin(baud);
+}
+
+/**
+* Handshake line RPV<version> <baud>. Answers at the current baud rate, then switches
+* and waits for the Pi to confirm with a HELLO frame.
+*/
+void handleHandshake(String line) {
+  line.trim();
+  String expected = String("RPV") + PROTOCOL_VERSION + " ";
+  if (!line.startsWith(expected)) {
+    return; // another version, stays in the legacy text mode
+  }
+  uint32_t baud = line.substring(expected.length()).toInt();
+  if (baud == 0) {
+    return;
+  }
+  sendHelloAck(0, baud);
+  switchBaud(baud);
+  binaryMode = true;
+  binaryConfirmed = false;
+  switchedAt = millis();
+  lastFrameAt = switchedAt;
+  frameLength = 0;
+}
+
+void fallBackToLegacy() {
+  binaryMode = false;
+  binaryConfirmed = false;
+  switchBaud(LEGACY_BAUD);
+}
+
+void sendWriteResultFrame(byte seq, int result) {
+  if (result == WRITE_NO_TAG) {
+    return; // the Pi times out and retries, like in the legacy text mode
+  }
+  byte status = result == WRITE_OK ? RESULT_OK : RESULT_FAILED;
+  sendFrame(FRAME_WRITE_RESULT, seq, &status, 1);
+}
 
+void handleFrame(byte type, byte seq, const byte *payload, int length) {
+  lastFrameAt = millis();
+  if (type == FRAME_HELLO && length == 4) {
+    binaryConfirmed = true;
+    uint32_t baud = (uint32_t)payload[0] | ((uint32_t)payload[1] << 8)
+                    | ((uint32_t)payload[2] << 16) | ((uint32_t)payload[3] << 24);
+    sendHelloAck(seq, baud);
+  } else if (type == FRAME_WRITE_WHEELCHAIR_WEIGHT && length == 4) {
+    long weight = (long)((uint32_t)payload[0] | ((uint32_t)payload[1] << 8)
+                         | ((uint32_t)payload[2] << 16) | ((uint32_t)payload[3] << 24));
+    sendWriteResultFrame(seq, writeWheelchairWeight(String(weight)));
+  } else if (type == FRAME_WRITE_PATIENT_WEIGHT && length == 8) {
+    long weight = (long)((uint32_t)payload[0] | ((uint32_t)payload[1] << 8)
+                         | ((uint32_t)payload[2] << 16) | ((uint32_t)payload[3] << 24));
+    char date[16];
+    snprintf(date, sizeof(date), "%02d-%02d-%04u", payload[4], payload[5],
+             (unsigned int)(payload[6] | (payload[7] << 8)));
+    sendWriteResultFrame(seq, writePatientWeight(String(weight) + "," + date));
+  }
 }
+
+/**
+* Collects bytes into frameBuffer and handles every complete frame. A bad header or CRC
+* drops the first byte, so the next SOF is searched for.
+*/
+void receiveFrames() {
+  while (Serial.available()) {
+    frameBuffer[frameLength++] = Serial.read();
+    while (frameLength > 0) {
+      if (frameBuffer[0] != FRAME_SOF
+          || (frameLength >= 2 && frameBuffer[1] != PROTOCOL_VERSION)
+          || (frameLength >= FRAME_HEADER_SIZE && frameBuffer[4] > FRAME_MAX_PAYLOAD)) {
+        memmove(frameBuffer, frameBuffer + 1, --frameLength);
+        continue;
+      }
+      if (frameLength < FRAME_HEADER_SIZE) {
+        break;
+      }
+      int payloadLength = frameBuffer[4];
+      int total = FRAME_HEADER_SIZE + payloadLength + 2;
+      if (frameLength < total) {
+        break;
+      }
+      uint16_t crc = ((uint16_t)frameBuffer[total - 2] << 8) | frameBuffer[total - 1];
+      if (crc16Update(0xFFFF, frameBuffer + 1, total - 3) != crc) {
+        memmove(frameBuffer, frameBuffer + 1, --frameLength);
+        continue;
+      }
+      handleFrame(frameBuffer[2], frameBuffer[3], frameBuffer + FRAME_HEADER_SIZE, payloadLength);
+      frameLength -= total;
+      memmove(frameBuffer, frameBuffer + total, frameLength);
+    }
+  }
+}
+
 /**
 * Converts an NdefMessage into its String representation for outputting via serial
 *
@@ -150,8 +336,22 @@ void extractMessage(NdefMessage message, String &target) {
 
 void loop(void) {
 
-  if (nfc.tagPresent())
+  if (binaryMode && !binaryConfirmed && millis() - switchedAt > FALLBACK_MS) {
+    fallBackToLegacy();
+  }
+  // a Pi that restarted talks the legacy text mode and sends its handshake at LEGACY_BAUD
+  if (binaryMode && binaryConfirmed && millis() - lastFrameAt > LINK_TIMEOUT_MS) {
+    fallBackToLegacy();
+  }
+
+  // serialEvent runs between two loops, so the loop never blocks for long
+  if (millis() - lastTagFrame < TAG_PERIOD_MS) {
+    return;
+  }
+
+  if (nfc.tagPresent(TAG_POLL_TIMEOUT_MS))
   {
+    lastTagFrame = millis();
 
     NfcTag tag = nfc.read();
 
@@ -162,8 +362,12 @@ void loop(void) {
 
       String toPrint;
       extractMessage(message, toPrint);
-      Serial.println(toPrint);
+      if (binaryMode) {
+        int length = min((int)toPrint.length(), FRAME_MAX_PAYLOAD);
+        sendFrame(FRAME_TAG, 0, (const byte *)toPrint.c_str(), length);
+      } else {
+        Serial.println(toPrint);
+      }
     }
   }
-  delay(1000); // Variable delay to tweak and find the Magic Number
 }
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# Micro-benchmark of the per-batch statistics cost in HX711.get_raw_data_mean,
+# comparing the statistics module (before) with lib/fast_stats.py (after).
+# Usage: python3 benchmarks/bench_stats.py [batch_size] [repeats]
+import os
+import random
+import statistics as stat
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lib import fast_stats  # noqa: E402
+
+
+def filtered_mean_statistics(data_list):
+    # the filter as it was implemented in get_raw_data_mean with the statistics module
+    data_pstdev = stat.pstdev(data_list)
+    data_mean = stat.mean(data_list)
+    if data_pstdev <= 100:
+        return data_mean
+    max_num = data_mean + data_pstdev
+    min_num = data_mean - data_pstdev
+    filtered_data = [num for num in data_list if min_num < num < max_num]
+    return stat.mean(filtered_data)
+
+
+def filtered_mean_fast_stats(data_list):
+    return fast_stats.filtered_mean(data_list, max_pstdev=100)[0]
+
+
+def make_batches(batch_size, count, noise, spike_rate=0.1):
+    rng = random.Random(1)
+    batches = []
+    for _ in range(count):
+        base = rng.randint(-400000, 400000)
+        batch = []
+        for _ in range(batch_size):
+            value = base + int(rng.gauss(0, noise))
+            if rng.random() < spike_rate:
+                value += rng.choice((-1, 1)) * rng.randint(2000, 20000)  # vibration spike
+            batch.append(value)
+        batches.append(batch)
+    return batches
+
+
+def bench(function, batches, repeats):
+    def run():
+        for batch in batches:
+            function(batch)
+    best = min(timeit.repeat(run, number=1, repeat=repeats))
+    return best / len(batches)
+
+
+def main():
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 6
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    print('batch size {}, best of {} runs, time per batch'.format(batch_size, repeats))
+    for label, noise in (('quiet (pstdev <= 100)', 30), ('noisy (filtered)', 500)):
+        batches = make_batches(batch_size, 2000, noise)
+        for batch in batches:  # both implementations have to agree
+            assert abs(filtered_mean_statistics(batch) - filtered_mean_fast_stats(batch)) < 1e-6
+        before = bench(filtered_mean_statistics, batches, repeats)
+        after = bench(filtered_mean_fast_stats, batches, repeats)
+        print('{:<24} statistics: {:8.2f} us  fast_stats: {:8.2f} us  speedup: {:5.1f}x'.format(
+            label, before * 1e6, after * 1e6, before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# Parse-throughput benchmark of the tag frame parser (lib/tag_frame.py), compared with the previous
+# SerialNfc._parse (two scans of the token list and strptime per history entry), in parses per second for a
+# parked chair (the same frame repeats, memo hits) and for distinct frames (memo misses).
+# The corpus is lib/tag_frame_corpus.py, the fuzz test of the parser is tests/test_tag_frame.py.
+# Usage: python3 benchmarks/bench_tag_frame.py [repeats]
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lib.tag_frame import parse_tag_frame, parse_date  # noqa: E402
+from lib.tag_frame_corpus import VALID, parse_previous  # noqa: E402
+
+
+def throughput(function, frames, repeats, clear=None):
+    def run():
+        if clear is not None:
+            clear()
+        for frame in frames:
+            function(frame)
+    best = min(timeit.repeat(run, number=1, repeat=repeats))
+    return len(frames) / best
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    parked = [VALID[4][0]] * 5000
+    distinct = [' :{} @{},{:02}-{:02}-2024\r\n'.format(15000 + i, 70000 + i, i % 28 + 1, i % 12 + 1).encode('ascii')
+                for i in range(5000)]
+
+    def clear_caches():
+        parse_tag_frame.cache_clear()
+        parse_date.cache_clear()
+
+    print('throughput, parses per second (best of {} runs)'.format(repeats))
+    for label, frames in (('parked chair, same frame', parked), ('distinct frames', distinct)):
+        before = throughput(parse_previous, frames, repeats)
+        after = throughput(parse_tag_frame, frames, repeats, clear=clear_caches)
+        print('  {:<26} previous {:>10.0f}  tag_frame {:>10.0f}  speedup {:.1f}x'.format(
+            label, before, after, after / before))
+
+
+if __name__ == '__main__':
+    main()
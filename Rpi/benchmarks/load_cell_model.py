@@ -0,0 +1,86 @@
+import math
+import random
+
+GRAVITY = 9.81
+
+
+# LoadCellModel is a mass-spring-damper model of the weighing platform. The load cell reads the spring force,
+# so a wheelchair rolling on makes the reading overshoot, ring and settle like the real platform does.
+class LoadCellModel:
+
+    def __init__(self, platform_mass=15.0, natural_frequency=4.0, damping_ratio=0.15, nominal_mass=100.0,
+                 jitter=0.0, jitter_bandwidth=1.5, seed=1):
+        """
+        :param platform_mass: float, kg of the platform itself (removed by the tare)
+        :param natural_frequency: float, Hz at nominal_mass on the platform
+        :param damping_ratio: float, at nominal_mass on the platform
+        :param nominal_mass: float, kg the frequency and damping ratio are given for
+        :param jitter: float, standard deviation in newtons of the force of a patient moving
+        :param jitter_bandwidth: float, Hz, the jitter force is low pass filtered to this bandwidth
+        """
+        self.platform_mass = platform_mass
+        total = platform_mass + nominal_mass
+        self.stiffness = total * (2 * math.pi * natural_frequency) ** 2
+        self.damping = 2 * damping_ratio * math.sqrt(self.stiffness * total)
+        self.jitter = jitter
+        self.jitter_bandwidth = jitter_bandwidth
+        self._random = random.Random(seed)
+
+    @staticmethod
+    def load_at(events, t):
+        """
+        :param events: [(start, mass, ramp)] the load changes linearly to mass kg over ramp seconds from start
+        :return: float, kg on the platform at time t
+        """
+        mass = 0.0
+        for start, target, ramp in events:
+            if t < start:
+                break
+            if ramp > 0 and t < start + ramp:
+                return mass + (target - mass) * (t - start) / ramp
+            mass = target
+        return mass
+
+    def trace(self, events, duration, sample_rate, dt=0.001):
+        """
+        Integrates the model and samples the load cell reading.
+        :param events: [(start, mass, ramp)], sorted by start
+        :param duration: float, seconds
+        :param sample_rate: float, samples per second
+        :param dt: float, integration step in seconds
+        :return: [float], grams measured at every sample time, the platform is tared out
+        """
+        x = self.platform_mass * GRAVITY / self.stiffness  # start at rest with the empty platform
+        v = 0.0
+        jitter_force = 0.0
+        smoothing = min(1.0, 2 * math.pi * self.jitter_bandwidth * dt)
+        samples = []
+        sample_period = 1.0 / sample_rate
+        next_sample = 0.0
+        t = 0.0
+        while t < duration:
+            load = self.load_at(events, t)
+            mass = self.platform_mass + load
+            if self.jitter and load > 0:
+                jitter_force += smoothing * (self._random.gauss(0, self.jitter / math.sqrt(smoothing)) - jitter_force)
+            else:
+                jitter_force = 0.0
+            force = mass * GRAVITY + jitter_force
+            a = (force - self.damping * v - self.stiffness * x) / mass
+            v += a * dt  # semi-implicit Euler is stable for the stiff spring
+            x += v * dt
+            while t >= next_sample:
+                samples.append((self.stiffness * x / GRAVITY - self.platform_mass) * 1000)
+                next_sample += sample_period
+            t += dt
+        return samples
+
+
+# Scripted platform traffic, times in seconds and masses in kg. Each scenario is
+# (events, duration, jitter, settled_mass), where settled_mass is the load the scale should report.
+SCENARIOS = {
+    'empty': ([], 10.0, 0.0, 0.0),
+    'mount_settle_dismount': ([(1.0, 95.0, 1.2), (12.0, 0.0, 1.5)], 16.0, 0.0, 95.0),
+    'mount_with_jitter': ([(1.0, 82.0, 1.0), (14.0, 0.0, 1.5)], 18.0, 3.0, 82.0),
+    'heavy_bounce': ([(1.0, 140.0, 0.4), (12.0, 0.0, 0.6)], 16.0, 0.0, 140.0),
+}
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# Benchmark suite for the weighing stack, run on the simulated hardware backend.
+#   stages    - latency percentiles and throughput of HX711.get_weight_mean, ScaleObserver.update,
+#               SerialNfc._parse and LcdDisplay.display_weight
+#   scenarios - scripted platform traffic from the load cell model, driven through the RolliePollie decision
+#               logic, reporting time-to-stable-weight in simulated time (the HX711 runs at SAMPLE_RATE)
+# The report is printed (or written with --output) as JSON, so runs can be compared across releases.
+# Usage: python3 benchmarks/run_benchmarks.py [--output report.json] [--scenario NAME] [--iterations N]
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from load_cell_model import LoadCellModel, SCENARIOS  # noqa: E402
+import rollie_pollie  # noqa: E402
+from config import NUMBER_OF_READINGS, SCALE  # noqa: E402
+from lib.scale_observer import ScaleObserver  # noqa: E402
+from lib.sim_devices import SimulatedArduino  # noqa: E402
+
+SAMPLE_RATE = 10  # conversions per second of the modelled HX711
+RAW_OFFSET = 84000  # raw reading of the empty platform
+WHEELCHAIR_WEIGHT = 15000  # grams, stored on the simulated tag
+MAX_FAILED_READS = 20  # failed reads in a row before a scenario is given up
+
+
+def percentiles(latencies):
+    """
+    :param latencies: [float] seconds
+    :return: dict of nearest-rank percentiles in microseconds
+    """
+    ordered = sorted(latencies)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, int(p / 100.0 * len(ordered)))] * 1e6
+
+    return {
+        'calls': len(ordered),
+        'throughput_per_s': len(ordered) / sum(ordered) if sum(ordered) > 0 else None,
+        'p50_us': rank(50),
+        'p90_us': rank(90),
+        'p99_us': rank(99),
+        'max_us': ordered[-1] * 1e6,
+    }
+
+
+def timed(function, calls):
+    latencies = []
+    for i in range(calls):
+        start = time.perf_counter()
+        function(i)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def build_rig():
+    rig = rollie_pollie.select_hardware('sim')
+    rig.hx711.noise = 40
+    rig.hx711.raw_value = RAW_OFFSET
+    rig.hx711.set_sample_rate(None)  # conversions are always ready, the benchmark runs on simulated time
+    rollie_pollie.NFC_WRITE_QUEUE_PATH = None  # the benchmark leaves no queue or calibration file behind
+    rollie_pollie.CALIBRATION_PATH = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        controller = rollie_pollie.RolliePollie()
+    return rig, controller
+
+
+def bench_stages(rig, controller, iterations):
+    trace = LoadCellModel(jitter=8.0).trace(*SCENARIOS['mount_with_jitter'][:2], sample_rate=SAMPLE_RATE)
+    raw_trace = [int(RAW_OFFSET + w * SCALE) for w in trace]
+    stages = {}
+
+    def weight_mean(i):
+        rig.hx711.raw_value = raw_trace[i % len(raw_trace)]
+        controller._scale.get_weight_mean(NUMBER_OF_READINGS)
+    stages['hx711.get_weight_mean'] = percentiles(timed(weight_mean, iterations))
+
+    observer = ScaleObserver()
+    with contextlib.redirect_stdout(io.StringIO()):
+        stages['scale_observer.update'] = percentiles(timed(
+            lambda i: observer.update(trace[i % len(trace)], None, False), iterations * 10))
+
+    arduino = SimulatedArduino()
+    frames = []
+    for n in range(5):
+        arduino.place_tag(WHEELCHAIR_WEIGHT + n * 500)
+        frames.append(arduino.tag_frame())
+    frames.append(b'NFC tag successfully written!\r\n')
+    frames.append(b'\xff\xfe corrupt\r\n')
+    with contextlib.redirect_stdout(io.StringIO()):
+        stages['serial_nfc._parse'] = percentiles(timed(
+            lambda i: controller._ser_nfc._parse(frames[i % len(frames)]), iterations * 10))
+
+    lcd_bytes_before = rig.lcd.bytes_received
+    stages['lcd.display_weight'] = percentiles(timed(
+        lambda i: controller.output_weight_g_to_kg(trace[i % len(trace)]), iterations))
+    stages['lcd.display_weight']['lcd_bytes_per_call'] = \
+        (rig.lcd.bytes_received - lcd_bytes_before) / float(iterations)
+    return stages
+
+
+def run_scenario(rig, controller, name):
+    events, duration, jitter, settled_mass = SCENARIOS[name]
+    trace = LoadCellModel(jitter=jitter).trace(events, duration, sample_rate=SAMPLE_RATE)
+    mount_time = events[0][0] if events else None
+    dismount_time = events[-1][0] if events else None
+
+    # simulated time: conversion n happens at n / SAMPLE_RATE
+    conversion = [0]
+
+    def source():
+        n = min(conversion[0], len(trace) - 1)
+        conversion[0] += 1
+        return RAW_OFFSET + trace[n] * SCALE
+    rig.hx711.source = source
+
+    def now():
+        return conversion[0] / float(SAMPLE_RATE)
+    arduino = rig.arduino
+    arduino.clock = now
+    arduino.remove_tag()
+    controller._memoized_tag_data = None
+    controller._observer = ScaleObserver()
+    controller._observer.on_scale_dismount(controller.flush_tag_data_callback)
+
+    weighings = []
+    controller._observer.on_successful_weighing(
+        lambda total_weight, wheelchair_weight: weighings.append((now(), total_weight)), lifetime=1000000)
+
+    stage_latencies = {'acquire': [], 'nfc': [], 'observer': [], 'display': []}
+    first_within_tolerance = None
+    displayed = []
+    tag_placed = False
+    failed_reads = 0
+    failed_in_a_row = 0
+    error = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        while conversion[0] < len(trace):
+            on_platform = mount_time is not None and mount_time <= now() < dismount_time
+            if on_platform and not tag_placed:
+                arduino.place_tag(WHEELCHAIR_WEIGHT)
+                tag_placed = True
+            elif not on_platform and tag_placed:
+                arduino.remove_tag()
+                tag_placed = False
+
+            start = time.perf_counter()
+            total_weight = controller._scale.get_weight_mean(NUMBER_OF_READINGS)
+            acquired = time.perf_counter()
+            tag_data = controller._ser_nfc.get_weight()
+            read = time.perf_counter()
+            if total_weight is False:
+                failed_reads += 1
+                failed_in_a_row += 1
+                if failed_in_a_row >= MAX_FAILED_READS:
+                    error = '{} failed reads in a row at {:.1f}s'.format(failed_in_a_row, now())
+                    break
+                conversion[0] += 1  # simulated time goes on, a wedged chip cannot hold the scenario
+                controller._scale.power_down()  # and starts over on channel A, gain 128
+                controller._scale.power_up()
+                continue
+            failed_in_a_row = 0
+            weight_in_grams = controller.process_reading(total_weight, tag_data)
+            observed = time.perf_counter()
+            controller.output_weight_g_to_kg(weight_in_grams)
+            shown = time.perf_counter()
+
+            stage_latencies['acquire'].append(acquired - start)
+            stage_latencies['nfc'].append(read - acquired)
+            stage_latencies['observer'].append(observed - read)
+            stage_latencies['display'].append(shown - observed)
+            displayed.append((now(), total_weight))
+            if on_platform and first_within_tolerance is None and abs(total_weight - settled_mass * 1000) <= 100:
+                first_within_tolerance = now()
+
+    result = {
+        'duration_s': duration,
+        'loop_iterations': len(displayed),
+        'weighings': len(weighings),
+        'failed_reads': failed_reads,
+        'stages': {stage: percentiles(latencies) for stage, latencies in stage_latencies.items() if latencies},
+    }
+    if mount_time is not None:
+        result['time_to_within_100g_s'] = None if first_within_tolerance is None \
+            else first_within_tolerance - mount_time
+        result['time_to_stable_weight_s'] = weighings[0][0] - mount_time if weighings else None
+        result['stable_weight_error_g'] = weighings[0][1] - settled_mass * 1000 if weighings else None
+    if error is not None:
+        result['error'] = error
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the weighing stack on simulated hardware')
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='scenario to run, may be repeated. Default: all')
+    parser.add_argument('--iterations', type=int, default=200, help='calls per stage benchmark')
+    args = parser.parse_args()
+
+    rig, controller = build_rig()
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'sample_rate': SAMPLE_RATE,
+        'number_of_readings': NUMBER_OF_READINGS,
+        'stages': bench_stages(rig, controller, args.iterations),
+        'scenarios': {name: run_scenario(rig, controller, name) for name in (args.scenario or sorted(SCENARIOS))},
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
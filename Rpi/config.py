@@ -1,11 +1,118 @@
+# HARDWARE BACKEND
+# 'rpi' drives the real GPIO pins and serial port, 'sim' runs everything against simulated devices
+HARDWARE_BACKEND = 'rpi'
+
 # WEIGHING SCALE CONSTANTS
+HX711_TRANSPORT = 'gpio'  # 'gpio' bit-bangs the pins with RPi.GPIO, 'gpiod' uses the GPIO character device
+HX711_GPIO_CHIP = '/dev/gpiochip0'  # character device of the pins with 'gpiod', line offsets are the BCM numbers
 NUMBER_OF_READINGS = 6
 CHANNEL = 'A'
 GAIN = 128
 SCALE = -21.053
+SAMPLE_BUFFER_SIZE = 64  # samples kept by the background sampler
+SAMPLE_MAX_AGE = 1.0  # seconds before a buffered sample is considered stale
+
+# HX711 FILTERS
+# With HX711_FILTERS set, every sample of CHANNEL and GAIN goes through a chain of incremental filters (lib/filters.py)
+# before it is buffered, e.g. (('hampel', 7, 3.0), ('median', 5)) replaces outliers, then takes the median of the
+# last 5. Each entry is a filter name of filters.FILTERS followed by its arguments. None keeps the raw samples
+HX711_FILTERS = None
+
+# LOAD CELL ARRAY
+# With HX711_ARRAY_DATA_PINS set, e.g. (5, 12, 16, 20), the platform is read through one HX711 per load cell, all
+# clocked by CLOCK_PIN (lib/hx711_array.py), instead of a single HX711 on DATA_PIN. The array reads channel A,
+# gain 128. Weighing events then wait for the centre of mass to be within ALL_WHEELS_ON_RADIUS of the centre
+HX711_ARRAY_DATA_PINS = None
+HX711_ARRAY_SCALES = None  # scale ratio of each cell, None uses SCALE for every cell
+HX711_ARRAY_POSITIONS = ((-400, -400), (400, -400), (400, 400), (-400, 400))  # mm of each cell from the centre
+ALL_WHEELS_ON_RADIUS = 150  # mm
+
+# SEQUENTIAL SAMPLING
+# With SAMPLE_PRECISION set (grams, e.g. 20.0), a weight is the mean of as many samples as it takes for its standard
+# error to fall below it, instead of NUMBER_OF_READINGS samples (lib/sequential_mean.py). The reset and zeroing at
+# start up read the same way. None keeps the fixed number of samples
+SAMPLE_PRECISION = None
+SAMPLE_MIN_READINGS = 2
+SAMPLE_MAX_READINGS = 20
+SAMPLE_DEADLINE = 1.0  # seconds, a weight is shown by then however precise it is
+
+# WEIGHT ESTIMATOR
+# 'mean' shows the mean of every NUMBER_OF_READINGS samples, 'kalman' shows the estimate of
+# lib/kalman_estimator.py, updated on every sample, and uses its settled flag as the stability of a weighing
+WEIGHT_ESTIMATOR = 'mean'
+KALMAN_MEASUREMENT_NOISE = 20.0  # grams, standard deviation of a single sample
+KALMAN_PROCESS_NOISE = 1000.0  # grams²/s³, how quickly the weight on the scale may drift
+KALMAN_SETTLED_DEVIATION = 50.0  # grams, largest standard deviation of a settled weight
+KALMAN_SETTLED_RATE = 500.0  # grams per second, largest change of a settled weight
+
+# SETTLING PREDICTION
+# True writes the weight the platform is predicted to settle at (lib/settling_predictor.py) to the tag, instead of
+# waiting until the weight is stable
+SETTLING_PREDICTION = False
+PREDICTION_BLOCK_SIZE = 3  # samples averaged per block of the fit
+PREDICTION_TOLERANCE = 100.0  # grams, largest spread of the agreeing predictions
+PREDICTION_AGREEMENT = 3  # consecutive predictions that have to agree
 
 # NFC READER CONSTANTS
 NFC_PORT = '/dev/ttyACM0'
+NFC_PROTOCOL = 'auto'  # 'auto' negotiates the binary protocol (lib/nfc_protocol.py), 'legacy' keeps the text mode
+NFC_BAUDRATE = 115200  # baud rate asked for with the binary protocol
+TAG_MAX_AGE = 2.0  # seconds a tag frame stays valid, and a tag counts as present on the reader
+NFC_WRITE_QUEUE_PATH = 'nfc_write_queue.json'  # tag writes not yet acknowledged by the Arduino, None to not persist
+NFC_ACK_TIMEOUT = 3.0  # seconds to wait for the Arduino to answer a tag write before retrying
+
+# ZERO TRACKING
+# While the platform is empty and stable, the drift of its weight within ZERO_TRACKING_BAND is taken off the zero
+# in steps of ZERO_TRACKING_STEP or more (lib/zero_tracker.py), up to ZERO_TRACKING_LIMIT in total between tares.
+# A tare while the weight is stable uses the samples buffered within TARE_MAX_AGE and completes at once
+ZERO_TRACKING = True
+ZERO_TRACKING_BAND = 200.0  # grams
+ZERO_TRACKING_STEP = 20.0  # grams
+ZERO_TRACKING_LIMIT = 2000.0  # grams
+TARE_READINGS = 10
+TARE_MAX_AGE = 2.0  # seconds
+
+# FAST BOOT
+# The calibration (offsets and scale ratios, last tare) is kept in CALIBRATION_PATH (lib/calibration_store.py). At
+# start up it is restored and checked with CALIBRATION_CHECK_READINGS readings of the empty platform instead of
+# zeroing the scale again. None zeroes on every start up
+CALIBRATION_PATH = 'calibration.json'
+CALIBRATION_MAX_DRIFT = 200.0  # grams the empty platform may read off the restored calibration
+CALIBRATION_CHECK_READINGS = 3
+STARTUP_DEADLINE = 10.0  # seconds the reset and zeroing are retried for at start up
+
+# LOGGING
+# Log records are kept in a ring buffer in memory (lib/ring_log.py) and written out in batches every
+# LOG_FLUSH_INTERVAL seconds, to LOG_PATH or stdout if None. kill -USR1 writes every record still in memory to
+# LOG_DUMP_PATH, as does a crash of the controller
+LOG_LEVEL = 'info'  # 'debug', 'info', 'warning' or 'error'
+LOG_LEVELS = {}  # level per subsystem, e.g. {'observer': 'debug', 'hx711': 'debug', 'nfc': 'info'}
+LOG_PATH = None
+LOG_FLUSH_INTERVAL = 0.5  # seconds
+LOG_DUMP_PATH = 'rollie_pollie.dump.log'
+
+# METRICS
+# Counters, gauges and latency quantiles of the scale, NFC reader, display and controller loop (lib/metrics.py),
+# served in the Prometheus text format on http://METRICS_HOST:METRICS_PORT/metrics. None disables the endpoint
+METRICS_PORT = 9105
+METRICS_HOST = '127.0.0.1'  # local to the Pi, '0.0.0.0' lets a Prometheus server elsewhere scrape it
+LOOP_BUDGET = 0.1  # seconds, handling a weight takes longer than one HX711 conversion at 10 SPS is an overrun
+
+# TRACING
+# Spans of the loop stages and of the HX711, NFC, observer and LCD methods are kept in a ring buffer
+# (lib/tracing.py). kill -USR2 profiles every thread for PROFILE_SECONDS (lib/sampling_profiler.py) and writes the
+# stacks to PROFILE_PATH and the spans to TRACE_PATH, for chrome://tracing or https://ui.perfetto.dev. The metrics
+# endpoint serves the same on /trace and /profile?seconds=N
+TRACING = True
+TRACE_PATH = 'rollie_pollie.trace.json'
+PROFILE_SECONDS = 10
+PROFILE_INTERVAL = 0.005  # seconds between two samples of the stacks
+PROFILE_PATH = 'rollie_pollie.profile.txt'  # collapsed stacks, for flamegraph.pl or https://www.speedscope.app
+PROFILE_MAX_SECONDS = 60  # longest profile /profile runs
+
+# CAPTURE
+# File every raw HX711 sample and serial line is recorded to, for replay.py. None disables capturing
+CAPTURE_PATH = None
 
 # PINS (BCM numbering)
 CLOCK_PIN = 6
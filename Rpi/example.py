@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 from lib.hx711 import HX711		# import the class HX711
-import RPi.GPIO as GPIO		# import GPIO
+from lib.hal import GPIO		# import GPIO (RPi.GPIO unless the simulated backend is selected)
 
 try:
 	# Create an object hx which represents your real hx711 chip
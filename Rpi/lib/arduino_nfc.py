@@ -1,115 +1,409 @@
 #!/usr/bin/env python3
-import serial
-from .tag_data import TagData
-from datetime import date, datetime
+import queue
+import threading
+import time
+from . import hal
+from . import metrics
+from . import nfc_protocol
+from .ring_log import get_logger
+from .tracing import traced
+from .tag_frame import parse_tag_frame, parse_date
+from datetime import date
+
+_log = get_logger('nfc')
+_tags = metrics.counter('nfc_tags_total', 'Tag frames decoded')
+_undecodable = metrics.counter('nfc_frames_undecodable_total',
+                               'Frames from the Arduino that were neither a tag nor a write result')
+_dropped = metrics.counter('nfc_frames_dropped_total', 'Decoded tags thrown away because nobody polled them in time')
+_write_ok = metrics.counter('nfc_write_results_total', 'Answers of the Arduino to a tag write', {'result': 'ok'})
+_write_failed = metrics.counter('nfc_write_results_total', 'Answers of the Arduino to a tag write',
+                                {'result': 'failed'})
+_write_errors = metrics.counter('nfc_write_errors_total', 'Tag writes that could not be sent over the serial port')
 
 
 class SerialNfc:
     UPDATE_PATIENT_WEIGHT_DELIMITER = '@'
     DATE_FORMAT = "%d-%m-%Y"
+    WRITE_SUCCEEDED = b'NFC tag successfully written!'
+    WRITE_FAILED = b'Write failed'
+    READ_TIMEOUT = 0.1  # seconds the reader thread blocks on the port before checking whether it has to stop
+    KEEPALIVE_INTERVAL = 2.0  # seconds between two HELLO frames in the binary protocol, the sketch falls back
+    # to the legacy text mode after LINK_TIMEOUT_MS without a frame
+    MAX_FRAME_SIZE = 512  # bytes, a longer run of bytes without a line ending is discarded
+    LEGACY = 'legacy'  # protocols, see negotiate
+    BINARY = 'binary'
+
+    def __init__(self, port, baudrate=9600, ser=None):
+        """
+        :param ser: serial-like object to use instead of opening port, e.g. for replaying a capture
+        """
+        self._ser = hal.open_serial(port, baudrate=baudrate) if ser is None else ser
+        self._capture = None
+        self._write_result_callbacks = []
+        self.protocol = SerialNfc.LEGACY
+        self._decoder = None  # nfc_protocol.FrameDecoder in the binary protocol
+        self._seq = 0
+        self._write_seq = None  # seq of the last write, its result is the only one expected
+        self._write_lock = threading.Lock()  # keeps the frames of the keepalive and the writes apart
+        self._keepalive = None  # thread sending a HELLO every KEEPALIVE_INTERVAL in the binary protocol
+        self._keepalive_stop = threading.Event()
+
+        # reader thread, see start_reader
+        self._rx = bytearray()  # received bytes not yet split into frames, reused for every chunk
+        self._tags = None  # queue.Queue of TagData
+        self._reader = None
+        self._reading = False
+        self.disconnected = False  # the port went away under the reader thread, e.g. the Arduino was unplugged
+        self.frames_dropped = 0  # decoded tags thrown away because nobody polled them in time
+        self.frames_undecodable = 0  # frames that were neither a tag nor a write result
+
+    def on_write_result(self, callback):
+        """
+        Binds a callback to the answers of the Arduino to a tag write. The answers are read with the tag frames.
+        :param callback: lambda success: void
+        """
+        self._write_result_callbacks.append(callback)
+
+    def set_capture(self, writer):
+        """
+        Records every raw line read from the Arduino, see lib/capture.py
+        :param writer: CaptureWriter or None to stop recording
+        """
+        self._capture = writer
 
-    def __init__(self, port, baudrate=9600):
-        self._ser = serial.Serial(port=port, baudrate=baudrate)
+    @property
+    def port(self):
+        """
+        :return: the serial port of the Arduino, e.g. for an event loop to watch it
+        """
+        return self._ser
+
+    def feed(self, chunk):
+        """
+        Decodes bytes read from the port by somebody else, e.g. AsyncSerialNfc, in whichever protocol was negotiated.
+        Write results go to the write result callbacks.
+        :param chunk: bytes
+        :return: [TagData] tags completed by chunk
+        """
+        return self._receive(chunk)
 
     def close(self):
+        self.stop_reader()
+        self._stop_keepalive()
         self._ser.close()
 
-    def _read_raw(self):
+    # Protocol ###
+    @traced(category='nfc')
+    def negotiate(self, baudrate=115200, timeout=1.0):
         """
-        :return: None or Byte String
+        Switches to the binary protocol at baudrate if the sketch supports it (see lib/nfc_protocol.py).
+        Has to be called before start_reader.
+        :param baudrate: int, baud rate asked for
+        :param timeout: float, seconds to wait for each answer of the sketch
+        :return: True if the binary protocol is in use, False if the link stays in the legacy text mode
         """
-        if self._ser.in_waiting > 0:
-            return self._ser.readline()
-        else:
+        decoder = nfc_protocol.FrameDecoder()
+        previous_timeout = self._ser.timeout
+        self._ser.timeout = SerialNfc.READ_TIMEOUT
+        try:
+            self._ser.write(nfc_protocol.handshake_line(baudrate))
+            ack = self._await_frame(decoder, None, timeout)
+            if ack is None:
+                return False  # the legacy sketch does not answer the handshake
+            accepted = nfc_protocol.decode_baudrate(ack.payload)
+            self._ser.baudrate = accepted
+            self._ser.reset_input_buffer()  # bytes received while switching are garbage
+            decoder.reset()
+            for attempt in range(3):  # the sketch may still be switching its baud rate
+                seq = self._next_seq()
+                self._ser.write(nfc_protocol.encode_hello(seq, accepted))
+                if self._await_frame(decoder, seq, timeout / 3.0) is not None:
+                    self.protocol = SerialNfc.BINARY
+                    self._decoder = decoder
+                    _log.info("NFC link switched to the binary protocol at {} baud", accepted)
+                    self._start_keepalive()
+                    return True
+            self._ser.baudrate = nfc_protocol.LEGACY_BAUDRATE  # the sketch falls back as well
+            return False
+        except OSError:
+            return False
+        finally:
+            self._ser.timeout = previous_timeout
+
+    def _await_frame(self, decoder, seq, timeout):
+        """
+        :param seq: int, seq the HELLO_ACK has to carry, None for any
+        :return: nfc_protocol.Frame or None on timeout
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            for frame in decoder.feed(self._ser.read(max(self._ser.in_waiting, 1))):
+                if frame.type == nfc_protocol.HELLO_ACK and (seq is None or frame.seq == seq):
+                    return frame
+        return None
+
+    def _start_keepalive(self):
+        self._keepalive_stop.clear()
+        self._keepalive = threading.Thread(target=self._send_keepalives, name='SerialNfcKeepalive', daemon=True)
+        self._keepalive.start()
+
+    def _stop_keepalive(self, timeout=1.0):
+        self._keepalive_stop.set()
+        if self._keepalive is not None:
+            self._keepalive.join(timeout)
+            self._keepalive = None
+
+    def _send_keepalives(self):
+        # the HELLO_ACK answers are ignored by the reader, the HELLO only tells the sketch the Pi is still there
+        while not self._keepalive_stop.wait(SerialNfc.KEEPALIVE_INTERVAL):
+            try:
+                with self._write_lock:
+                    self._ser.write(nfc_protocol.encode_hello(self._next_seq(), self._ser.baudrate))
+            except OSError:
+                _log.debug("NFC keepalive not sent")
+
+    def _next_seq(self):
+        self._seq = (self._seq + 1) & 0xff
+        return self._seq
+
+    # Reader thread ###
+    def start_reader(self, max_pending_tags=8):
+        """
+        Starts a thread that reads the port in bulk and decodes the frames as they arrive. From this point on
+        tags are taken with poll_tag (or get_weight), which never block on the port.
+        :param max_pending_tags: int, decoded tags kept when nobody polls them. The oldest are dropped first
+        :return: void
+        """
+        if self._reading:
+            return
+        self._tags = queue.Queue(maxsize=max_pending_tags)
+        self._ser.timeout = SerialNfc.READ_TIMEOUT
+        self._reading = True
+        self._reader = threading.Thread(target=self._read_frames, name='SerialNfcReader', daemon=True)
+        self._reader.start()
+
+    def stop_reader(self, timeout=1.0):
+        """
+        :param timeout: float, seconds
+        :return: void
+        """
+        self._reading = False
+        if self._reader is not None:
+            self._reader.join(timeout)
+            self._reader = None
+
+    @traced(category='nfc')
+    def poll_tag(self):
+        """
+        Non-blocking. Needs the reader thread, see start_reader.
+        :return: None or TagData, the oldest tag not polled yet
+        """
+        try:
+            return self._tags.get_nowait()
+        except queue.Empty:
             return None
 
-    def _is_prefixed_by(self, string, prefix):
+    def _read_frames(self):
+        while self._reading:
+            try:
+                chunk = self._ser.read(max(self._ser.in_waiting, 1))  # waits READ_TIMEOUT at most
+            except OSError:  # serial.SerialException is an OSError, the port is gone
+                _log.warning("NFC serial port disconnected")
+                self.disconnected = True
+                self._reading = False
+                self._keepalive_stop.set()
+                return
+            if chunk:
+                for tag_data in self._receive(chunk):
+                    self._put_tag(tag_data)
+
+    @traced(category='nfc')
+    def _receive(self, chunk):
+        """
+        Decodes received bytes of either protocol. Write results go to the write result callbacks.
+        :param chunk: bytes
+        :return: [TagData] tags completed by chunk
+        """
+        if self.protocol == SerialNfc.BINARY:
+            crc_errors = self._decoder.crc_errors
+            tags = [self._handle_binary_frame(frame) for frame in self._decoder.feed(chunk)]
+            self._count_undecodable(self._decoder.crc_errors - crc_errors)
+            return [tag_data for tag_data in tags if tag_data is not None]
+        self._rx.extend(chunk)
+        return self._split_frames()
+
+    def _split_frames(self):
+        """
+        Decodes every complete line in the receive buffer. The frames are sliced out of the buffer without
+        copying it, and the consumed bytes are released once at the end.
+        :return: [TagData]
+        """
+        rx = self._rx
+        tags = []
+        start = 0
+        with memoryview(rx) as view:
+            while True:
+                end = rx.find(b'\n', start)
+                if end < 0:
+                    break
+                while start < end and view[start] == 0x02:  # \x02, start of text control character
+                    start += 1
+                tag_data = self._handle_frame(view[start:end + 1].tobytes())
+                if tag_data is not None:
+                    tags.append(tag_data)
+                start = end + 1
+        del rx[:start]
+        if len(rx) > SerialNfc.MAX_FRAME_SIZE:  # noise on the line, no line ending is coming
+            del rx[:]
+            self._count_undecodable()
+        return tags
+
+    def _handle_frame(self, line):
         """
-        :param string: Formatted string (not a byte string)
-        :param prefix: Can be a one character, or multiple characters (in a String)
-        :return: True if string is prefixed by given prefix
+        :param line: Byte String, one legacy text line
+        :return: TagData or None
         """
-        return isinstance(string, str) and len(string) > 0 and isinstance(prefix, str) and string[0] == prefix
+        if self._capture is not None:
+            self._capture.record_serial_line(line)
+        return self._parse(line)  # hands a write result to the write result callbacks
 
-    def _is_wheelchair_weight(self, string):
+    def _handle_binary_frame(self, frame):
         """
-        :param string: Formatted string (not a byte string)
-        :return: True if string represents wheelchair weight (prefixed by :), else False
+        :param frame: nfc_protocol.Frame
+        :return: TagData or None
         """
-        return self._is_prefixed_by(string, ':')
+        if frame.type == nfc_protocol.TAG:
+            # captured as the equivalent text line, so replay.py reads both protocols
+            return self._handle_frame(frame.payload + b'\r\n')
+        if frame.type == nfc_protocol.WRITE_RESULT and len(frame.payload) == 1:
+            if frame.seq != self._write_seq:
+                return None  # late answer to a write that was given up already
+            self._write_seq = None
+            success = frame.payload[0] == nfc_protocol.RESULT_OK
+            self._handle_frame((SerialNfc.WRITE_SUCCEEDED if success else SerialNfc.WRITE_FAILED) + b'\r\n')
+        elif frame.type != nfc_protocol.HELLO_ACK:
+            self._count_undecodable()
+        return None
+
+    def _count_undecodable(self, frames=1):
+        self.frames_undecodable += frames
+        _undecodable.inc(frames)
+
+    def _put_tag(self, tag_data):
+        while True:
+            try:
+                self._tags.put_nowait(tag_data)
+                return
+            except queue.Full:
+                try:
+                    self._tags.get_nowait()
+                    self.frames_dropped += 1
+                    _dropped.inc()
+                except queue.Empty:
+                    pass
+
+    def _read_raw(self):
+        """
+        :return: None or Byte String
+        """
+        if self._ser.in_waiting > 0:
+            line = self._ser.readline()
+            if self._capture is not None:
+                self._capture.record_serial_line(line)
+            return line
+        else:
+            return None
+
+    def _is_write_result(self, byte_string):
+        answer = byte_string.strip()
+        return answer == SerialNfc.WRITE_SUCCEEDED or answer == SerialNfc.WRITE_FAILED
 
     def get_weight(self):
         """
         :return: None or TagData
         """
+        if self._reading or self.disconnected:
+            return self.poll_tag()  # the tags read before a disconnect are still handed out
+        if self.protocol == SerialNfc.BINARY:
+            waiting = self._ser.in_waiting
+            tags = self._receive(self._ser.read(waiting)) if waiting > 0 else []
+            return tags[-1] if tags else None
         raw = self._read_raw()
 
         return self._parse(raw)
 
-    def update_patient_weight_with_date(self, weight):
+    @traced(category='nfc')
+    def update_patient_weight_with_date(self, weight, date_str=None):
+        """
+        :param date_str: String in DATE_FORMAT, defaults to today
+        """
         if not (isinstance(weight, int) or isinstance(weight, float)):
             return False
-        todays_date_str = date.today().strftime(SerialNfc.DATE_FORMAT)
+        if date_str is None:
+            date_str = date.today().strftime(SerialNfc.DATE_FORMAT)
+        if self.protocol == SerialNfc.BINARY:
+            return self._write_frame(lambda seq: nfc_protocol.encode_patient_weight(seq, weight, parse_date(date_str)))
         to_write = SerialNfc.UPDATE_PATIENT_WEIGHT_DELIMITER + str(round(weight)) \
-                   + "," + todays_date_str + SerialNfc.UPDATE_PATIENT_WEIGHT_DELIMITER
-        print(to_write)
+                   + "," + date_str + SerialNfc.UPDATE_PATIENT_WEIGHT_DELIMITER
+        _log.info("tag write {}", to_write)
         try:
             self._ser.write(to_write.encode('utf-8'))
             return True
-        except (SerialTimeoutException):
+        except OSError:  # serial.SerialTimeoutException is an OSError
+            _write_errors.inc()
             return False
 
+    @traced(category='nfc')
     def write_wheelchair_weight(self, value):
         if not (isinstance(value, int) or isinstance(value, float)):
             return False
+        if self.protocol == SerialNfc.BINARY:
+            return self._write_frame(lambda seq: nfc_protocol.encode_wheelchair_weight(seq, value))
         to_write = '!' + str(round(value)) + '!'
         try:
             self._ser.write(to_write.encode('utf-8'))
             return True
-        except (SerialTimeoutException):
+        except OSError:  # serial.SerialTimeoutException is an OSError
+            _write_errors.inc()
             return False
 
+    def _write_frame(self, encode):
+        """
+        :param encode: lambda seq: bytes, the frame of a write command
+        :return: True if sent
+        """
+        try:
+            with self._write_lock:
+                seq = self._next_seq()
+                self._write_seq = seq
+                self._ser.write(encode(seq))
+            return True
+        except OSError:  # serial.SerialTimeoutException is an OSError
+            _write_errors.inc()
+            return False
+
+    @traced(category='nfc')
     def _parse(self, byte_string):
         """
         :param byte_string: byte
-        :return: TagData
+        :return: TagData, shared with every other frame of the same bytes (see lib/tag_frame.py)
         """
-
-        def parse_weight_history(raw):
-            """
-            :param raw: String
-            :return: (float, datetime.date)
-            """
-            weight_history_pair = raw.replace('^', '').split(',')
-            weight = float(weight_history_pair[0])
-            history = datetime.strptime(SerialNfc.DATE_FORMAT, weight_history_pair[1]).date()
-            return weight, history
-
         # Return none if an invalid byte_string is passed
         if byte_string is None or not isinstance(byte_string, bytes):
             return None
 
-        try:
-            # \x02, start of line control character is replaced
-            string_arr = byte_string.decode("utf-8").replace("\x02", "").split()  # May have decode errors
-        except UnicodeDecodeError:
-            print("Unicode Decode Error")
-            return None
-
-        print(string_arr)
-        # There should only be one wheelchair_weight (TODO: needs assertion)
-        wheelchair_weight = ([float(w.replace(':', ''))
-                              for w in string_arr
-                              if self._is_wheelchair_weight(w)]
-                             + [None])[0]
-        # order is preserved
-        weight_history = [parse_weight_history(w)
-                          for w in string_arr
-                          if self._is_prefixed_by(w, '^')]
-
-        # Return none if byte_string does not represent a valid tag
-        if wheelchair_weight is None:
+        # Answers to a tag write are handed to the write result callbacks
+        if self._is_write_result(byte_string):
+            success = byte_string.strip() == SerialNfc.WRITE_SUCCEEDED
+            (_write_ok if success else _write_failed).inc()
+            for callback in self._write_result_callbacks:
+                callback(success)
             return None
 
-        # {wheelchair_weight is not None, weight_history can be []}
-        return TagData(wheelchair_weight, weight_history)
+        # {wheelchair_weight is not None, weight_history can be []} or None if it does not represent a valid tag
+        tag_data = parse_tag_frame(byte_string)
+        if tag_data is not None:
+            _tags.inc()
+        elif byte_string.strip():  # an empty line is no frame
+            self._count_undecodable()
+        return tag_data
@@ -0,0 +1,93 @@
+import asyncio
+from .ring_log import get_logger
+
+_log = get_logger('nfc')
+
+
+# AsyncSerialNfc reads tags from a SerialNfc without blocking the event loop. When the port exposes a file
+# descriptor, bytes are read as they arrive through loop.add_reader. Otherwise the reads run in an executor.
+# The bytes are decoded by the SerialNfc, in whichever protocol it negotiated. Once the port is gone, e.g. the
+# Arduino was unplugged, read_tag raises ConnectionError.
+class AsyncSerialNfc:
+
+    def __init__(self, ser_nfc, loop, max_pending_tags=8):
+        """
+        :param ser_nfc: SerialNfc
+        :param loop: asyncio event loop
+        :param max_pending_tags: int, tags kept when nobody is reading them. The oldest are dropped first
+        """
+        self._ser_nfc = ser_nfc
+        self._loop = loop
+        self._tags = asyncio.Queue(maxsize=max_pending_tags)
+        self._fd = None
+        self.dropped_tags = 0
+        self.disconnected = False
+
+    def start(self):
+        ser = self._ser_nfc.port
+        try:
+            self._fd = ser.fileno()
+        except (AttributeError, OSError, ValueError):
+            self._fd = None
+        if self._fd is not None:
+            ser.timeout = 0  # non-blocking reads, the event loop tells us when bytes are waiting
+            self._loop.add_reader(self._fd, self._on_readable)
+        else:
+            ser.timeout = self._ser_nfc.READ_TIMEOUT
+
+    def close(self):
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            self._fd = None
+
+    def _read_chunk(self):
+        """
+        :return: bytes, None once the port is gone
+        """
+        ser = self._ser_nfc.port
+        try:
+            return ser.read(max(ser.in_waiting, 1))
+        except OSError:  # serial.SerialException is an OSError
+            return None
+
+    def _on_readable(self):
+        chunk = self._read_chunk()
+        if not chunk:  # readable without a byte to read is the end of the file, e.g. the device was unplugged
+            self._disconnect()
+            return
+        self._push_tags(chunk)
+
+    def _disconnect(self):
+        _log.warning("NFC serial port disconnected")
+        self.close()
+        self.disconnected = True
+        if self._tags.full():
+            self._tags.get_nowait()
+            self.dropped_tags += 1
+        self._tags.put_nowait(None)  # wakes a waiting read_tag
+
+    def _push_tags(self, chunk):
+        for tag_data in self._ser_nfc.feed(chunk):
+            if self._tags.full():
+                self._tags.get_nowait()
+                self.dropped_tags += 1
+            self._tags.put_nowait(tag_data)
+
+    async def read_tag(self):
+        """
+        Waits until a tag frame arrives.
+        :return: TagData
+        :raise ConnectionError: the port is gone
+        """
+        while self._fd is None and self._tags.empty() and not self.disconnected:
+            chunk = await self._loop.run_in_executor(None, self._read_chunk)
+            if chunk is None:
+                self._disconnect()
+            else:
+                self._push_tags(chunk)
+        if self.disconnected and self._tags.empty():
+            raise ConnectionError('NFC serial port disconnected')
+        tag_data = await self._tags.get()
+        if tag_data is None:
+            raise ConnectionError('NFC serial port disconnected')
+        return tag_data
@@ -0,0 +1,23 @@
+import json
+import os
+
+
+def write_json(path, data):
+    """
+    Replaces the file at path with data as JSON. The new file is written next to it, flushed to the disk and
+    renamed over it, and the rename is flushed as well, so a power cut leaves either the old or the new file.
+    :param path: String
+    :param data: anything json.dump takes
+    :return: void
+    """
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)  # the rename is an entry of the directory
+    finally:
+        os.close(directory)
@@ -0,0 +1,36 @@
+import time
+
+
+# BootTimer splits the start up into phases, each ending with a lap, and reports where the time went
+class BootTimer:
+
+    def __init__(self, clock=time.monotonic):
+        """
+        :param clock: lambda: float, seconds
+        """
+        self._clock = clock
+        self._started = clock()
+        self._last = self._started
+        self.phases = []  # (name, seconds)
+
+    def lap(self, phase):
+        """
+        Ends a phase, it started with the previous lap
+        :param phase: String, name of the phase
+        :return: float, seconds the phase took
+        """
+        now = self._clock()
+        elapsed = now - self._last
+        self._last = now
+        self.phases.append((phase, elapsed))
+        return elapsed
+
+    def total(self):
+        return self._last - self._started
+
+    def report(self):
+        """
+        :return: String, e.g. 'Boot 0.84s: hx711 0.21s, nfc 0.12s, reset 0.20s, calibration 0.31s'
+        """
+        return 'Boot {:.2f}s: {}'.format(self.total(), ', '.join(
+            '{} {:.2f}s'.format(phase, elapsed) for phase, elapsed in self.phases))
@@ -0,0 +1,79 @@
+import json
+import os
+import time
+from . import atomic_file
+from .ring_log import get_logger
+
+MODES = [('A', 128), ('A', 64), ('B', 32)]
+VERSION = 1
+_log = get_logger('calibration')
+
+
+# CalibrationStore keeps the calibration of the scale on disk, so a power cycle does not need a full re-zero.
+# It holds the offset and scale ratio of each channel and gain, the offset of each cell of a load cell array,
+# the configured scale ratio they were made with and when the scale was last tared. The file is replaced
+# atomically, a power cut while saving leaves the previous calibration.
+class CalibrationStore:
+
+    def __init__(self, path, clock=time.time):
+        """
+        :param path: String, JSON file the calibration is kept in
+        :param clock: lambda: float, wall clock seconds of the tare timestamps
+        """
+        self._path = path
+        self._clock = clock
+
+    def load(self, config_scale=None):
+        """
+        :param config_scale: float, scale ratio configured now. A calibration made with another one is stale
+        :return: dict as saved, or None if there is no usable calibration
+        """
+        if not os.path.exists(self._path):
+            return None
+        try:
+            with open(self._path) as f:
+                calibration = json.load(f)
+        except (OSError, ValueError):
+            _log.warning("Calibration file unreadable, zeroing the scale")
+            return None
+        if not isinstance(calibration, dict) or calibration.get('version') != VERSION:
+            return None
+        if config_scale is not None and calibration.get('config_scale') != config_scale:
+            _log.info("SCALE changed since the last calibration, zeroing the scale")
+            return None
+        return calibration
+
+    def save(self, scale, config_scale=None, tared=True):
+        """
+        :param scale: HX711 or HX711Array
+        :param config_scale: float, scale ratio configured now
+        :param tared: bool, the offset is a new tare, else the time of the last one is kept
+        :return: dict, the calibration saved
+        """
+        previous = self.load() if not tared else None
+        calibration = {
+            'version': VERSION,
+            'config_scale': config_scale,
+            'channels': [[channel, gain, scale.get_current_offset(channel, gain),
+                          scale.get_current_scale_ratio(channel, gain)] for channel, gain in MODES],
+            'tared_at': self._clock() if previous is None else previous.get('tared_at'),
+        }
+        if hasattr(scale, 'get_cell_offsets'):
+            calibration['cell_offsets'] = scale.get_cell_offsets()
+        atomic_file.write_json(self._path, calibration)  # a power cut leaves either the old or the new file
+        return calibration
+
+    @staticmethod
+    def apply(scale, calibration):
+        """
+        Restores the offsets and scale ratios of a loaded calibration
+        :param scale: HX711 or HX711Array
+        :param calibration: dict from load
+        :return: void
+        """
+        if 'cell_offsets' in calibration and hasattr(scale, 'set_cell_offsets'):
+            scale.set_cell_offsets(calibration['cell_offsets'])
+        for channel, gain, offset, scale_ratio in calibration['channels']:
+            scale.set_offset(int(round(offset)), channel, gain)
+            if hasattr(scale, 'set_scale_ratio'):  # the cells of an array have their own ratios
+                scale.set_scale_ratio(channel, gain, scale_ratio)
@@ -0,0 +1,174 @@
+import struct
+import threading
+import time
+from collections import namedtuple
+
+# Compact binary capture of raw HX711 samples and raw serial lines, for reproducing weighings offline.
+#
+# File layout: MAGIC, then records. Every record starts with a type byte and the time since the previous
+# record as an unsigned varint in microseconds.
+#   sample      - type 0x80 | valid << 2 | mode, zigzag varint delta of the raw 24 bit word from the previous sample
+#   serial line - type 0x01, varint length, bytes
+#   calibration - type 0x02, mode byte, offset and scale ratio as little endian doubles
+# mode is 0 for channel A gain 128, 1 for channel A gain 64, 2 for channel B and 3 when not known yet.
+
+MAGIC = b'RPCAP\x01'
+
+SAMPLE = 0x80
+SERIAL_LINE = 0x01
+CALIBRATION = 0x02
+
+MODES = [('A', 128), ('A', 64), ('B', 32), ('', 0)]
+
+Sample = namedtuple('Sample', 'timestamp raw channel gain valid')
+SerialLine = namedtuple('SerialLine', 'timestamp line')
+Calibration = namedtuple('Calibration', 'timestamp channel gain offset scale_ratio')
+
+
+def _mode(channel, gain):
+    if channel == 'A':
+        return 0 if gain == 128 else 1
+    if channel == 'B':
+        return 2
+    return 3
+
+
+def _write_varint(buffer, value):
+    while value > 0x7f:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value):
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+class CaptureWriter:
+
+    def __init__(self, path, clock=time.monotonic, flush_size=4096):
+        """
+        :param path: String, file the capture is written to (overwritten)
+        :param clock: lambda: float, seconds
+        :param flush_size: int, bytes buffered before they are written to the file
+        """
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._clock = clock
+        self._flush_size = flush_size
+        self._lock = threading.Lock()  # the sampler thread and the control loop both record
+        self._buffer = bytearray()
+        self._last_time = None
+        self._last_raw = 0
+
+    def _begin(self, record_type, timestamp):
+        # called with the lock held
+        micros = int(round((self._clock() if timestamp is None else timestamp) * 1e6))
+        delta = 0 if self._last_time is None else max(0, micros - self._last_time)
+        self._last_time = micros if self._last_time is None else self._last_time + delta
+        self._buffer.append(record_type)
+        _write_varint(self._buffer, delta)
+
+    def _end(self):
+        if len(self._buffer) >= self._flush_size:
+            self._file.write(self._buffer)
+            del self._buffer[:]
+
+    def record_sample(self, raw, channel, gain, valid, timestamp=None):
+        """
+        :param raw: int, 24 bit word as it came from the hx711 (not yet converted from two's complement)
+        :param channel: 'A' | 'B' | ''
+        :param gain: int
+        :param valid: bool
+        """
+        with self._lock:
+            self._begin(SAMPLE | (bool(valid) << 2) | _mode(channel, gain), timestamp)
+            _write_varint(self._buffer, _zigzag(raw - self._last_raw))
+            self._last_raw = raw
+            self._end()
+
+    def record_serial_line(self, line, timestamp=None):
+        """
+        :param line: Byte String
+        """
+        with self._lock:
+            self._begin(SERIAL_LINE, timestamp)
+            _write_varint(self._buffer, len(line))
+            self._buffer.extend(line)
+            self._end()
+
+    def record_calibration(self, channel, gain, offset, scale_ratio, timestamp=None):
+        with self._lock:
+            self._begin(CALIBRATION, timestamp)
+            self._buffer.append(_mode(channel, gain))
+            self._buffer.extend(struct.pack('<dd', offset, scale_ratio))
+            self._end()
+
+    def flush(self):
+        with self._lock:
+            self._file.write(self._buffer)
+            del self._buffer[:]
+            self._file.flush()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+class CaptureReader:
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._data = f.read()
+        if not self._data.startswith(MAGIC):
+            raise ValueError('not a capture file: ' + str(path))
+
+    def __iter__(self):
+        """
+        Timestamps are in seconds since the first record.
+        :return: iterator of Sample | SerialLine | Calibration
+        """
+        data = self._data
+        position = len(MAGIC)
+        micros = 0
+        last_raw = 0
+
+        def varint():
+            nonlocal position
+            value = 0
+            shift = 0
+            while True:
+                byte = data[position]
+                position += 1
+                value |= (byte & 0x7f) << shift
+                if not byte & 0x80:
+                    return value
+                shift += 7
+
+        while position < len(data):
+            try:
+                record_type = data[position]
+                position += 1
+                micros += varint()
+                timestamp = micros / 1e6
+                if record_type & SAMPLE:
+                    channel, gain = MODES[record_type & 0x03]
+                    last_raw += _unzigzag(varint())
+                    yield Sample(timestamp, last_raw, channel, gain, bool(record_type & 0x04))
+                elif record_type == SERIAL_LINE:
+                    length = varint()
+                    yield SerialLine(timestamp, bytes(data[position:position + length]))
+                    position += length
+                elif record_type == CALIBRATION:
+                    channel, gain = MODES[data[position]]
+                    offset, scale_ratio = struct.unpack_from('<dd', data, position + 1)
+                    position += 17
+                    yield Calibration(timestamp, channel, gain, offset, scale_ratio)
+                else:
+                    raise ValueError('corrupt capture, unknown record type ' + hex(record_type))
+            except (IndexError, struct.error):
+                return  # the last record was cut short, e.g. by a power cut
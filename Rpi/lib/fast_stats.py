@@ -0,0 +1,71 @@
+import math
+
+
+# Integer statistics kernel for HX711 readings. Readings are small 24 bit integers, so sums and sums of squares
+# are computed exactly with plain ints and divided only once at the end. This avoids the Fraction arithmetic
+# of the statistics module, which costs far more than the values it processes.
+
+
+def sums(data):
+    """
+    :param data: [int]
+    :return: (count, sum, sum of squares)
+    """
+    total = 0
+    total_sq = 0
+    for x in data:
+        total += x
+        total_sq += x * x
+    return len(data), total, total_sq
+
+
+def mean(data):
+    """
+    :param data: [int], not empty
+    :return: float
+    """
+    return sum(data) / len(data)
+
+
+def pvariance(data):
+    """
+    Population variance, n * sum_sq - sum^2 is computed exactly before dividing.
+    :param data: [int], not empty
+    :return: float
+    """
+    n, total, total_sq = sums(data)
+    return (n * total_sq - total * total) / (n * n)
+
+
+def pstdev(data):
+    """
+    :param data: [int], not empty
+    :return: float
+    """
+    return math.sqrt(pvariance(data))
+
+
+def filtered_mean(data, max_pstdev=100):
+    """
+    Mean of the readings lying strictly within one population standard deviation of the mean.
+    If the standard deviation is max_pstdev or less, the plain mean is returned.
+    Comparisons are done on scaled integers: |x - mean| < pstdev  <=>  (n * x - sum)^2 < n * sum_sq - sum^2
+    :param data: [int], not empty
+    :param max_pstdev: float
+    :return: (float, bool) mean and whether the data was filtered
+    """
+    n, total, total_sq = sums(data)
+    scaled_variance = n * total_sq - total * total  # n^2 * pvariance
+    if scaled_variance <= (max_pstdev * n) ** 2:
+        return total / n, False
+
+    kept_total = 0
+    kept = 0
+    for x in data:
+        deviation = n * x - total
+        if deviation * deviation < scaled_variance:
+            kept_total += x
+            kept += 1
+    if kept == 0:
+        return total / n, False
+    return kept_total / kept, True
@@ -0,0 +1,226 @@
+from bisect import bisect_left, insort
+from collections import deque
+
+
+# Incremental filters for HX711 readings. Every filter takes one sample at a time through update() and returns
+# the current filtered value, so a value is available after every conversion. Filters can be chained with
+# FilterChain, e.g. FilterChain(HampelFilter(7), MedianFilter(5), EmaFilter(0.3)).
+
+
+class MovingAverageFilter:
+
+    def __init__(self, size=6):
+        """
+        :param size: int, number of samples averaged
+        """
+        if size < 1:
+            raise ValueError('size has to be at least 1. I have got: ' + str(size))
+        self._size = size
+        self.reset()
+
+    def reset(self):
+        self._window = deque()
+        self._sum = 0.0
+        self.value = None
+
+    def update(self, sample):
+        self._window.append(sample)
+        self._sum += sample
+        if len(self._window) > self._size:
+            self._sum -= self._window.popleft()
+        self.value = self._sum / len(self._window)
+        return self.value
+
+
+class EmaFilter:
+
+    def __init__(self, alpha=0.3):
+        """
+        :param alpha: float (0..1], weight of the newest sample
+        """
+        if not 0 < alpha <= 1:
+            raise ValueError('alpha has to be in range (0, 1]. I have got: ' + str(alpha))
+        self._alpha = alpha
+        self.reset()
+
+    def reset(self):
+        self.value = None
+
+    def update(self, sample):
+        if self.value is None:
+            self.value = float(sample)
+        else:
+            self.value += self._alpha * (sample - self.value)
+        return self.value
+
+
+# Keeps the window both in arrival order and sorted, so order statistics are available without re-sorting
+class _SortedWindow:
+
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError('size has to be at least 1. I have got: ' + str(size))
+        self.size = size
+        self.arrival = deque()
+        self.ordered = []
+
+    def clear(self):
+        self.arrival.clear()
+        self.ordered = []
+
+    def add(self, sample):
+        self.arrival.append(sample)
+        insort(self.ordered, sample)
+        if len(self.arrival) > self.size:
+            del self.ordered[bisect_left(self.ordered, self.arrival.popleft())]
+
+    def median(self):
+        ordered = self.ordered
+        middle = len(ordered) // 2
+        if len(ordered) % 2:
+            return ordered[middle]
+        return (ordered[middle - 1] + ordered[middle]) / 2
+
+    def median_absolute_deviation(self, median):
+        """
+        The deviations from median, read outwards from it through the sorted window, come in ascending order,
+        so their median is found after half of them, without sorting or a list of deviations.
+        :param median: float, median of the window
+        :return: float
+        """
+        ordered = self.ordered
+        n = len(ordered)
+        middle = n // 2
+        below = bisect_left(ordered, median) - 1  # next sample below the median, walking down
+        above = below + 1  # next sample at or above the median, walking up
+        previous = 0
+        for i in range(middle + 1):
+            if below >= 0 and (above >= n or median - ordered[below] <= ordered[above] - median):
+                deviation = median - ordered[below]
+                below -= 1
+            else:
+                deviation = ordered[above] - median
+                above += 1
+            if i < middle:
+                previous = deviation
+        return deviation if n % 2 else (previous + deviation) / 2
+
+
+class MedianFilter:
+
+    def __init__(self, size=5):
+        """
+        :param size: int, number of samples the median is taken over
+        """
+        self._window = _SortedWindow(size)
+        self.value = None
+
+    def reset(self):
+        self._window.clear()
+        self.value = None
+
+    def update(self, sample):
+        self._window.add(sample)
+        self.value = self._window.median()
+        return self.value
+
+
+class TrimmedMeanFilter:
+
+    def __init__(self, size=10, trim=0.2):
+        """
+        :param size: int, number of samples in the window
+        :param trim: float [0..0.5), fraction of samples dropped from each end before averaging
+        """
+        if not 0 <= trim < 0.5:
+            raise ValueError('trim has to be in range [0, 0.5). I have got: ' + str(trim))
+        self._window = _SortedWindow(size)
+        self._trim = trim
+        self.value = None
+
+    def reset(self):
+        self._window.clear()
+        self.value = None
+
+    def update(self, sample):
+        self._window.add(sample)
+        ordered = self._window.ordered
+        cut = int(len(ordered) * self._trim)
+        kept = ordered[cut:len(ordered) - cut]
+        self.value = sum(kept) / len(kept)
+        return self.value
+
+
+class HampelFilter:
+    MAD_TO_STDEV = 1.4826  # scales the median absolute deviation to a standard deviation for normal noise
+
+    def __init__(self, size=7, threshold=3.0):
+        """
+        Replaces a sample by the window median when it is further than threshold * stdev (estimated
+        from the median absolute deviation) from that median. Other samples pass through unchanged.
+        :param size: int, number of samples in the window
+        :param threshold: float, number of standard deviations a sample may be away from the median
+        """
+        self._window = _SortedWindow(size)
+        self._threshold = threshold
+        self.rejected = 0  # number of samples replaced so far
+        self.value = None
+
+    def reset(self):
+        self._window.clear()
+        self.rejected = 0
+        self.value = None
+
+    def update(self, sample):
+        self._window.add(sample)
+        median = self._window.median()
+        mad = self._window.median_absolute_deviation(median)
+        if abs(sample - median) > self._threshold * HampelFilter.MAD_TO_STDEV * mad and mad > 0:
+            self.rejected += 1
+            self.value = median
+        else:
+            self.value = sample
+        return self.value
+
+
+class FilterChain:
+
+    def __init__(self, *filters):
+        """
+        :param filters: filters applied in the given order, each one feeding the next
+        """
+        self._filters = list(filters)
+        self.value = None
+
+    def reset(self):
+        for f in self._filters:
+            f.reset()
+        self.value = None
+
+    def update(self, sample):
+        value = sample
+        for f in self._filters:
+            value = f.update(value)
+        self.value = value
+        return value
+
+    def __len__(self):
+        return len(self._filters)
+
+
+FILTERS = {'moving_average': MovingAverageFilter, 'ema': EmaFilter, 'median': MedianFilter,
+           'trimmed_mean': TrimmedMeanFilter, 'hampel': HampelFilter}
+
+
+def make_chain(spec):
+    """
+    :param spec: [(String, ...)] name of each filter in FILTERS followed by its arguments, in the order they are
+    applied, e.g. [('hampel', 7, 3.0), ('median', 5)] as HX711_FILTERS in config.py
+    :return: FilterChain
+    """
+    filters = []
+    for name, *args in spec:
+        if name not in FILTERS:
+            raise ValueError('filter has to be one of ' + str(sorted(FILTERS)) + '. I have got: ' + str(name))
+        filters.append(FILTERS[name](*args))
+    return FilterChain(*filters)
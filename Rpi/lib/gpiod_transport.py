@@ -0,0 +1,127 @@
+import time
+from . import hal
+
+# HX711 transport over the Linux GPIO character device (libgpiod 2, e.g. /dev/gpiochip0), an alternative to the
+# RPi.GPIO bit-banging in HX711._read. Both lines are held by one line request. Data ready is the falling edge
+# of DOUT, which the kernel timestamps and queues, so the read starts as soon as a conversion is ready instead of
+# on the next 10 ms poll. A clock pulse is two set_value calls on the held request, without RPi.GPIO's
+# per-call pin lookups, which keeps it well below the 60 us that power down the chip.
+# Several HX711s can share PD_SCK (see lib/hx711_array.py), their DOUT lines are then read in one get_values call
+# per clock pulse, so every chip is read in the same conversion window.
+
+MAX_PULSE = 0.00006  # seconds, PD_SCK high for 60 us or more powers the HX711 down
+
+
+class GpiodTransport:
+
+    def __init__(self, dout_pin, pd_sck_pin, chip='/dev/gpiochip0', consumer='hx711'):
+        """
+        :param dout_pin: int, line offset of DOUT on the chip, the BCM number on a Raspberry Pi. A tuple of
+        offsets for HX711s sharing the clock, read with read_words
+        :param pd_sck_pin: int, line offset of PD_SCK
+        :param chip: String, GPIO character device
+        :param consumer: String, name the lines are requested under, shown by gpioinfo
+        """
+        gpiod = hal.get_gpiod()
+        line = gpiod.line
+        self._douts = tuple(dout_pin) if isinstance(dout_pin, (tuple, list)) else (dout_pin,)
+        self._dout = self._douts[0]
+        self._pd_sck = pd_sck_pin
+        self._high = line.Value.ACTIVE
+        self._low = line.Value.INACTIVE
+        self._request = gpiod.request_lines(chip, consumer=consumer, config={
+            pd_sck_pin: gpiod.LineSettings(direction=line.Direction.OUTPUT, output_value=line.Value.INACTIVE),
+            self._douts: gpiod.LineSettings(direction=line.Direction.INPUT, edge_detection=line.Edge.FALLING),
+        })
+        self.aborted_reads = 0  # reads lost to a clock pulse of MAX_PULSE or more
+
+    def set_clock(self, level):
+        """
+        :param level: bool, PD_SCK high or low
+        :return: void
+        """
+        self._request.set_value(self._pd_sck, self._high if level else self._low)
+
+    def wait_ready(self, timeout):
+        """
+        Waits for DOUT to fall, i.e. for a conversion to be ready. With several DOUT lines, for all of them.
+        :param timeout: float, seconds
+        :return: True if a conversion is ready
+        """
+        request = self._request
+        # the data bits of the previous read toggled DOUT, those edges are not a new conversion
+        while request.wait_edge_events(0):
+            request.read_edge_events()
+        if self._all_low():
+            return True
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not request.wait_edge_events(remaining):
+                return False
+            request.read_edge_events()
+            if self._all_low():
+                return True
+
+    def _all_low(self):
+        if len(self._douts) == 1:
+            return self._request.get_value(self._dout) == self._low
+        return all(value == self._low for value in self._request.get_values(self._douts))
+
+    def read_word(self, pulses):
+        """
+        Shifts out the 24 bit word of a ready conversion, then sends the pulses that select the channel and gain
+        of the next conversion.
+        :param pulses: int, 1 for channel A gain 128, 2 for channel B, 3 for channel A gain 64
+        :return: int, the 24 bit word as it has come, or None if a clock pulse was too long and the word is lost.
+        The chip is then powered down and up again, so it does not wait half way through the word
+        """
+        set_value = self._request.set_value
+        get_value = self._request.get_value
+        sck, dout, high, low = self._pd_sck, self._dout, self._high, self._low
+        perf_counter = time.perf_counter
+        data_in = 0
+        for i in range(24 + pulses):
+            start = perf_counter()
+            set_value(sck, high)
+            set_value(sck, low)
+            if perf_counter() - start >= MAX_PULSE:
+                self.aborted_reads += 1
+                self._power_cycle()
+                return None
+            if i < 24:
+                data_in = (data_in << 1) | (get_value(dout) == high)
+        return data_in
+
+    def read_words(self, pulses):
+        """
+        read_word for HX711s sharing the clock, every DOUT line is read on each pulse.
+        :param pulses: int, pulses after the word, the same for every chip
+        :return: [int] one 24 bit word per DOUT line, or None if a clock pulse was too long
+        """
+        set_value = self._request.set_value
+        get_values = self._request.get_values
+        sck, douts, high, low = self._pd_sck, self._douts, self._high, self._low
+        perf_counter = time.perf_counter
+        words = [0] * len(douts)
+        for i in range(24 + pulses):
+            start = perf_counter()
+            set_value(sck, high)
+            set_value(sck, low)
+            if perf_counter() - start >= MAX_PULSE:
+                self.aborted_reads += 1
+                self._power_cycle()
+                return None
+            if i < 24:
+                words = [(word << 1) | (value == high) for word, value in zip(words, get_values(douts))]
+        return words
+
+    def _power_cycle(self):
+        # the pulse may still have been short enough for the chip, which would then wait for the rest of the
+        # word with DOUT high. Holding PD_SCK high powers it down, it restarts on channel A, gain 128
+        self._request.set_value(self._pd_sck, self._high)
+        time.sleep(MAX_PULSE * 2)
+        self._request.set_value(self._pd_sck, self._low)
+
+    def close(self):
+        self._request.release()
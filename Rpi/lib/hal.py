@@ -0,0 +1,101 @@
+# Hardware abstraction layer. The GPIO pins and the serial link to the Arduino go through a selectable backend:
+#   'rpi' - RPi.GPIO and pyserial, the real hardware
+#   'sim' - in-process simulation (see lib/sim_gpio.py and lib/sim_devices.py), runs on any Linux box
+# The GPIO character device (libgpiod, see lib/gpiod_transport.py) is reached through get_gpiod() the same way.
+# Hardware modules are only imported once the backend is first used, so everything can be imported off a Pi.
+
+BACKENDS = ('rpi', 'sim')
+
+_backend = 'rpi'
+_gpio = None
+_gpiod = None
+_simulated_serials = {}
+
+
+def select_backend(name):
+    """
+    Selects the backend. Has to be called before the first GPIO or serial access.
+    :param name: 'rpi' | 'sim'
+    :return: void
+    """
+    global _backend, _gpio, _gpiod
+    if name not in BACKENDS:
+        raise ValueError('backend has to be one of ' + str(BACKENDS) + '. I have got: ' + str(name))
+    _backend = name
+    _gpio = None
+    _gpiod = None
+    _simulated_serials.clear()
+    GPIO.__dict__.clear()  # drops the cached attributes of the previous backend
+
+
+def get_backend():
+    return _backend
+
+
+def get_gpio():
+    """
+    :return: RPi.GPIO module or SimulatedGpio
+    """
+    global _gpio
+    if _gpio is None:
+        if _backend == 'sim':
+            from .sim_gpio import SimulatedGpio
+            _gpio = SimulatedGpio()
+        else:
+            import RPi.GPIO
+            _gpio = RPi.GPIO
+    return _gpio
+
+
+def get_gpiod():
+    """
+    :return: gpiod module (the libgpiod 2 python bindings) or SimulatedGpiod, whose lines are the pins of
+    the simulated GPIO
+    """
+    global _gpiod
+    if _gpiod is None:
+        if _backend == 'sim':
+            from .sim_gpio import SimulatedGpiod
+            _gpiod = SimulatedGpiod(get_gpio())
+        else:
+            import gpiod
+            _gpiod = gpiod
+    return _gpiod
+
+
+# Stands in for the RPi.GPIO module. Attributes are looked up on the selected backend on first use and then
+# cached on the proxy, so GPIO.output costs the same as calling the backend directly.
+class _GpioProxy:
+
+    def __getattr__(self, name):
+        value = getattr(get_gpio(), name)
+        self.__dict__[name] = value
+        return value
+
+
+GPIO = _GpioProxy()
+
+
+def register_serial(port, device):
+    """
+    Binds a simulated serial device (e.g. SimulatedArduino) to a port name for the 'sim' backend.
+    :return: void
+    """
+    _simulated_serials[port] = device
+
+
+def open_serial(port, baudrate=9600, **kwargs):
+    """
+    :return: serial.Serial or a simulated serial device with the same interface
+    """
+    if _backend == 'sim':
+        device = _simulated_serials.get(port)
+        if device is None:
+            from .sim_devices import SimulatedArduino
+            device = SimulatedArduino()
+            _simulated_serials[port] = device
+        device.baudrate = baudrate
+        device.open()
+        return device
+    import serial
+    return serial.Serial(port=port, baudrate=baudrate, **kwargs)
@@ -1,9 +1,24 @@
 #!/usr/bin/env python3
-import RPi.GPIO as GPIO
+from .hal import GPIO
 import time
-import statistics as stat
+from collections import deque
+from . import fast_stats
+from . import metrics
+from . import ring_log
+from .sequential_mean import SequentialMean
+from .tracing import traced
+_log = ring_log.get_logger('hx711')	# debug mode output goes to the ring log, see lib/ring_log.py
+# read failures and words by reason, exported on the metrics endpoint, see lib/metrics.py
+_FAILURES = 'hx711_read_failures_total'
+_FAILURES_HELP = 'HX711 reads that returned False'
+_not_ready = metrics.counter(_FAILURES, _FAILURES_HELP, {'reason': 'not_ready'})
+_timing = metrics.counter(_FAILURES, _FAILURES_HELP, {'reason': 'timing'})	# a clock pulse of 60 us or more
+_invalid = metrics.counter(_FAILURES, _FAILURES_HELP, {'reason': 'invalid'})	# 0x7fffff or 0x800000
+_words = metrics.counter('hx711_words_total', 'Words shifted out of the HX711, valid or not')
+_gain_timing = metrics.counter('hx711_gain_pulse_timing_total',
+	'Channel and gain pulses of 60 us or more, the HX711 powered down and was read again')
 class HX711:
-	def __init__(self, dout_pin, pd_sck_pin, gain_channel_A=128, select_channel='A'):
+	def __init__(self, dout_pin, pd_sck_pin, gain_channel_A=128, select_channel='A', transport=None):
 		if (isinstance(dout_pin, int) and 
 			isinstance(pd_sck_pin, int)): 	# just chack of it is integer
 			self._pd_sck = pd_sck_pin 	# init pd_sck pin number
@@ -14,6 +29,7 @@ class HX711:
 					' and pd_sck_pin: ' + str(pd_sck_pin) + '\n')
 		
 		self._gain_channel_A = 0 	# init to 0	
+		self._wanted_gain_A = 0		# gain for channel A set by the next read
 		self._offset_A_128 = 0		# init offset for channel A and gain 128
 		self._offset_A_64 = 0		# init offset for channel A and gain 64
 		self._offset_B = 0 		# init offset for channel B
@@ -27,12 +43,25 @@ class HX711:
 		self._scale_ratio_B = 1		# init to 1
 		self._debug_mode = False	# init debug mode to False
 		self._pstdev_filter = True	# pstdev filter is by default ON
+		self._filter_A_128 = None	# no incremental filter chain for channel A and gain 128
+		self._filter_A_64 = None	# no incremental filter chain for channel A and gain 64
+		self._filter_B = None		# no incremental filter chain for channel B
+		self._capture = None		# no capture writer, raw samples are not recorded
+		self._precision = None		# no sequential sampling, means are of a fixed number of readings
+		self._sequential = None
+		self._transport = transport	# e.g. GpiodTransport, None bit-bangs the pins with RPi.GPIO
+		self._words_read = 0		# words shifted out of hx 711, valid or not
+		self._schedule = None		# no interleaved reads, see set_schedule
+		self._schedule_next = 0
+		self._settling = False
+		self._streams = {}
 		
-		GPIO.setmode(GPIO.BCM) 			# set GPIO pin mode to BCM numbering
-		GPIO.setup(self._pd_sck, GPIO.OUT)	# pin _pd_sck is output only
-		GPIO.setup(self._dout, GPIO.IN)		# pin _dout is input only
-		self.select_channel(select_channel)	# call select channel function
-		self.set_gain_A(gain_channel_A) 	# init gain for channel A
+		if transport is None:			# a transport holds the pins itself
+			GPIO.setmode(GPIO.BCM) 			# set GPIO pin mode to BCM numbering
+			GPIO.setup(self._pd_sck, GPIO.OUT)	# pin _pd_sck is output only
+			GPIO.setup(self._dout, GPIO.IN)		# pin _dout is input only
+		self.set_gain_A(gain_channel_A) 	# init gain for channel A, no channel is selected yet
+		self.select_channel(select_channel)	# call select channel function, it switches to both at once
 			
 	############################################################
 	# select_channel function evaluates if the desired channel #
@@ -49,11 +78,7 @@ class HX711:
 		else:
 			raise ValueError('channel has to be "A" or "B".\nI have got: '\
 						+ str(channel))
-		# after changing channel or gain it has to wait 50 ms to allow adjustment.
-		# the data before is garbage and cannot be used.
-		self._read()
-		time.sleep(0.5)
-		return True
+		return self._switch()
 		
 	############################################################
 	# set_gain_A function sets gain for channel A. 		   #
@@ -63,17 +88,44 @@ class HX711:
 	############################################################
 	def set_gain_A(self, gain):
 		if gain == 128:
-			self._gain_channel_A = gain
+			self._wanted_gain_A = gain
 		elif gain == 64:
-			self._gain_channel_A = gain
+			self._wanted_gain_A = gain
 		else:
 			raise ValueError('gain has to be 128 or 64.\nI have got: '
 						+ str(gain))
-		# after changing channel or gain it has to wait 50 ms to allow adjustment.
-		# the data before is garbage and cannot be used.
-		self._read()
-		time.sleep(0.5)
-		return True
+		return self._switch()
+	
+	############################################################
+	# _switch function sets the wanted channel and gain.	   #
+	# The word read now was converted with the old ones, its   #
+	# trailing pulses select the new ones. The first	   #
+	# conversion with the new ones is still settling and is    #
+	# discarded, there is no need to wait any longer.	   #
+	# Nothing is read if the channel and gain do not change.   #
+	# It returns False if either word is not clocked out or    #
+	# the new ones are not set. An invalid word (0x7fffff or   #
+	# 0x800000) still switches, it does not count as a failure.#
+	# INPUTS: none						   #
+	# OUTPUTS: BOOL						   #
+	############################################################
+	def _switch(self):
+		if self._wanted_channel == '':		# no channel selected yet, the gain is kept for it
+			return True
+		if self._wanted_channel == 'B' and self._current_channel == 'B':
+			self._gain_channel_A = self._wanted_gain_A	# channel A is not converting, nothing settles
+			return True
+		if (self._wanted_channel == self._current_channel and 
+			self._wanted_gain_A == self._gain_channel_A):
+			return True
+		words_read = self._words_read
+		self._read()	# the old channel and gain, its trailing pulses set the new ones
+		if (self._words_read == words_read or self._current_channel != self._wanted_channel or
+			(self._wanted_channel == 'A' and self._gain_channel_A != self._wanted_gain_A)):
+			return False	# not ready, timing abort or the gain pulses failed
+		words_read = self._words_read
+		self._read()	# settling conversion, garbage whether it is valid or not
+		return self._words_read != words_read
 		
 	############################################################
 	# zero is function which sets the current data as 	   #
@@ -83,6 +135,7 @@ class HX711:
 	# INPUTS: times # how many times do reading and then mean  #
 	# OUTPUTS: BOOL 	# if True it is OK		   #
 	############################################################
+	@traced(category='hx711')
 	def zero(self, times=10):
 		if times > 0 and times < 100:
 			result = self.get_raw_data_mean(times)
@@ -100,13 +153,12 @@ class HX711:
 					return True
 				else:
 					if self._debug_mode:
-						print('Cannot zero() channel and gain mismatch.\n'\
-							+ 'current channel: ' + str(self._current_channel)\
-							+ 'gain A: ' + str(self._gain_channel_A) + '\n')
+						_log.debug('Cannot zero() channel and gain mismatch. current channel: {} gain A: {}',
+							self._current_channel, self._gain_channel_A)
 					return False
 			else:
 				if self._debug_mode:
-					print('zero() got False back.\n')
+					_log.debug('zero() got False back.')
 				return False
 		else:
 			raise ValueError('In function "zero" parameter "times" can be in range 1 up to 99. '\
@@ -182,17 +234,64 @@ class HX711:
 		if flag == False:
 			self._pstdev_filter = False
 			if self._debug_mode:
-				print('Population standard deviation filter DISABLED')
+				_log.debug('Population standard deviation filter DISABLED')
 			return True
 		elif flag == True:
 			self._pstdev_filter = True
 			if self._debug_mode:
-				print('Population standatd deviation filter ENABLED')
+				_log.debug('Population standard deviation filter ENABLED')
 			return True
 		else:
 			raise ValueError('In function "set_pstdev_filter" parameter "flag" can be only BOOL value.\n'
 					+ 'I have got: ' + str(flag) + '\n' )
 	
+	############################################################
+	# set_filter function sets an incremental filter chain	   #
+	# (see lib/filters.py) for particular channel and gain.	   #
+	# When set, every reading of that channel and gain is	   #
+	# passed through the chain instead of the pstdev filter.   #
+	# None removes the chain. By default for current channel.  #
+	# INPUTS: filter_chain, channel('A'|'B'|empty),		   #
+	# 		gain_A(128|64|empty)			   #
+	# OUTPUTS: BOOL 	# if True then it is executed ok   #
+	############################################################
+	def set_filter(self, filter_chain, channel='', gain_A=0):
+		if filter_chain is not None:
+			filter_chain.reset()
+		if channel == 'A' and gain_A == 128:
+			self._filter_A_128 = filter_chain
+		elif channel == 'A' and gain_A == 64:
+			self._filter_A_64 = filter_chain
+		elif channel == 'B':
+			self._filter_B = filter_chain
+		else:
+			if self._current_channel == 'A' and self._gain_channel_A == 128:
+				self._filter_A_128 = filter_chain
+			elif self._current_channel == 'A' and self._gain_channel_A == 64:
+				self._filter_A_64 = filter_chain
+			else:
+				self._filter_B = filter_chain
+		return True
+	
+	############################################################
+	# get_filter returns the filter chain for a channel and	   #
+	# gain or None if there is not any.			   #
+	# By default for currently chosen channel and gain.	   #
+	# INPUTS: channel('A'|'B'), gain_A(64|128)		   #
+	# OUTPUTS: filter chain | None				   #
+	############################################################
+	def get_filter(self, channel='', gain_A=0):
+		if channel == '':
+			channel = self._current_channel
+			gain_A = self._gain_channel_A
+		if channel == 'A' and gain_A == 128:
+			return self._filter_A_128
+		elif channel == 'A' and gain_A == 64:
+			return self._filter_A_64
+		elif channel == 'B':
+			return self._filter_B
+		return None
+	
 	############################################################
 	# set_debug_mode function is for turning on and off 	   #
 	# debug mode.						   #
@@ -206,12 +305,54 @@ class HX711:
 			return True
 		elif flag == True:
 			self._debug_mode = True
+			ring_log.LOG.set_level(ring_log.DEBUG, 'hx711')
+			if not ring_log.LOG.is_running():	# the debug output is written out by the flusher
+				ring_log.LOG.start()
 			print('Debug mode ENABLED')
 			return True
 		else:
 			raise ValueError('In function "set_debug_mode" parameter "flag" can be only BOOL value.\n'
 					+ 'I have got: ' + str(flag) + '\n' )
 	
+	############################################################
+	# set_capture function attaches a capture writer	   #
+	# (see lib/capture.py) that records every word read	   #
+	# from hx 711, valid or not. None detaches it.		   #
+	# INPUTS: writer (CaptureWriter|None)			   #
+	# OUTPUTS: BOOL						   #
+	############################################################
+	def set_capture(self, writer):
+		self._capture = writer
+		return True
+	
+	############################################################
+	# set_precision function turns on sequential sampling.	   #
+	# get_raw_data_mean, and with it zero, reset and the	   #
+	# weight and data means, then reads until the standard	   #
+	# error of the mean is below precision grams, instead of   #
+	# reading times times. At least min_samples and at most	   #
+	# max_samples readings are taken, and no more once	   #
+	# deadline seconds have passed. The noise of a reading is  #
+	# learned from the earlier means (see			   #
+	# lib/sequential_mean.py). None turns it off.		   #
+	# Set the scale ratio first, precision is in grams.	   #
+	# INPUTS: precision(FLOAT|None), min_samples(INT),	   #
+	# 		max_samples(INT), deadline(FLOAT|None)	   #
+	# OUTPUTS: BOOL						   #
+	############################################################
+	def set_precision(self, precision, min_samples=2, max_samples=20, deadline=None):
+		if precision is None:
+			self._precision = None
+			self._sequential = None
+			return True
+		if precision <= 0:
+			raise ValueError('precision has to be positive.\nI have got: ' + str(precision))
+		if not 0 < max_samples < 100:
+			raise ValueError('max_samples has to be in range 1 up to 99.\nI have got: ' + str(max_samples))
+		self._precision = precision
+		self._sequential = SequentialMean(min_samples, max_samples, deadline)
+		return True
+	
 	############################################################
 	# save last raw data does exactly how it looks.		   #
 	# If return False something is wrong. Try debug mode.	   #
@@ -256,9 +397,10 @@ class HX711:
 				end_counter = time.perf_counter() # stop timer
 				if end_counter-start_counter >= 0.00006: # check if hx 711 did not turn off...
 				# if pd_sck pin is HIGH for 60 us and more than output info in debug mode.
+					_gain_timing.inc()
 					if self._debug_mode:
-						print('Not enough fast while setting gain and channel')
-						print('Time elapsed: ' + str(end_counter - start_counter))
+						_log.debug('Not enough fast while setting gain and channel. Time elapsed: {}',
+							end_counter - start_counter)
 					# hx711 has turned off. First few readings are inaccurate.
 					# Still, they can be used because they will get filtered out.
 					result = self.get_raw_data_mean(6) # set for the next reading.
@@ -273,17 +415,24 @@ class HX711:
 	# INPUT: none						   #
 	# OUTPUTS: BOOL | INT 					   #
 	############################################################
+	@traced(category='hx711')
 	def _read(self):
+		if self._transport is not None:	# the transport waits for data ready and shifts the word out
+			return self._read_transport()
 		GPIO.output(self._pd_sck, False) # start by setting the pd_sck to false
 		ready_counter = 0		# init the counter to 0
 		while (not self._ready() and ready_counter <= 40): 
 			time.sleep(0.01)	# sleep for 10 ms because data is not ready
 			ready_counter += 1 	# increment counter
-			if ready_counter == 50: # if counter reached max value then return False
+			if ready_counter > 40: # if counter reached max value then return False
+				_not_ready.inc()
 				if self._debug_mode:
-					print('self._read() not ready after 40 trials\n')
+					_log.debug('self._read() not ready after 40 trials')
 				return False
 		
+		# the word coming now was converted with the channel and gain set by the previous read
+		channel = self._current_channel
+		gain = self._gain_channel_A if channel == 'A' else (32 if channel == 'B' else 0)
 		# read first 24 bits of data
 		data_in = 0	# 2's complement data from hx 711
 		for i in range(24):
@@ -293,21 +442,27 @@ class HX711:
 			end_counter = time.perf_counter()	# stop timer
 			if end_counter - start_counter >= 0.00006: # check if the hx 711 did not turn off...
 			# if pd_sck pin is HIGH for 60 us and more than the HX 711 enters power down mode.
+				_timing.inc()
 				if self._debug_mode:
-					print('Not enough fast while reading data')
-					print ('Time elapsed: ' + str(end_counter - start_counter))
+					_log.debug('Not enough fast while reading data. Time elapsed: {}',
+						end_counter - start_counter)
+				if self._capture is not None:	# the word is lost, record that it was
+					self._capture.record_sample(0, channel, gain, False)
+				self._restart()	# the hx 711 may still be half way through its word
 				return False
 			# Shift the bits as they come to data_in variable.
 			# Left shift by one bit then bitwise OR with the new bit. 
 			data_in = (data_in<<1) | GPIO.input(self._dout)
 			
-		if self._wanted_channel == 'A' and self._gain_channel_A == 128:
+		self._words_read += 1
+		_words.inc()
+		if self._wanted_channel == 'A' and self._wanted_gain_A == 128:
 			if not self._set_channel_gain(1):	# send only one bit which is 1
 				return False			# return False because channel was not set properly
 			else:
 				self._current_channel = 'A'	# else set current channel variable
 				self._gain_channel_A = 128	# and gain
-		elif self._wanted_channel == 'A' and self._gain_channel_A == 64:
+		elif self._wanted_channel == 'A' and self._wanted_gain_A == 64:
 			if not self._set_channel_gain(3):	# send three ones
 				return False			# return False because channel was not set properly
 			else:
@@ -318,74 +473,329 @@ class HX711:
 				return False			# return False because channel was not set properly
 			else:
 				self._current_channel = 'B'	# else set current channel variable
+				self._gain_channel_A = self._wanted_gain_A	# kept for channel A
 		
-		if self._debug_mode:	# print 2's complement value
-			print('Binary value as it has come: ' + str(bin(data_in)) + '\n')
+		return self._convert_read(data_in, channel, gain)
+	
+	############################################################
+	# _restart power cycles hx 711 after an aborted read. A    #
+	# stalled pulse may or may not have powered it down, after #
+	# the cycle it is on channel A, gain 128 either way and    #
+	# the next read sets the wanted channel and gain again.    #
+	# INPUT: none						   #
+	# OUTPUTS: none						   #
+	############################################################
+	def _restart(self):
+		self.power_down()
+		self.power_up()
+		self._current_channel = 'A'
+		self._gain_channel_A = 128
+	
+	############################################################
+	# _read_transport is _read through a transport, e.g.	   #
+	# GpiodTransport. It waits for the data ready edge, then   #
+	# the transport shifts out the word and the pulses for	   #
+	# the wanted channel and gain in one call.		   #
+	# If it returns int it is OK. If False something is wrong  #
+	# INPUT: none						   #
+	# OUTPUTS: BOOL | INT 					   #
+	############################################################
+	def _read_transport(self):
+		self._transport.set_clock(False)
+		if not self._transport.wait_ready(0.5):	# as long as the 40 polls of _read
+			_not_ready.inc()
+			if self._debug_mode:
+				_log.debug('self._read() not ready after 0.5 s')
+			return False
 		
+		# the word coming now was converted with the channel and gain set by the previous read
+		channel = self._current_channel
+		gain = self._gain_channel_A if channel == 'A' else (32 if channel == 'B' else 0)
+		if self._wanted_channel == 'A' and self._wanted_gain_A == 128:
+			pulses = 1	# send only one bit which is 1
+		elif self._wanted_channel == 'A' and self._wanted_gain_A == 64:
+			pulses = 3	# send three ones
+		else:
+			pulses = 2	# send two ones
+		data_in = self._transport.read_word(pulses)
+		if data_in is None:	# a clock pulse was too long, the hx 711 powered down
+			_timing.inc()
+			if self._debug_mode:
+				_log.debug('Not enough fast while reading data')
+			if self._capture is not None:	# the word is lost, record that it was
+				self._capture.record_sample(0, channel, gain, False)
+			# the transport has power cycled the hx 711, it restarts on channel A, gain 128
+			self._current_channel = 'A'
+			self._gain_channel_A = 128
+			return False
+		self._words_read += 1
+		_words.inc()
+		self._current_channel = 'B' if pulses == 2 else 'A'
+		self._gain_channel_A = self._wanted_gain_A
+		return self._convert_read(data_in, channel, gain)
+	
+	############################################################
+	# _convert_read converts a word read from hx 711, records  #
+	# it and validates it.					   #
+	# INPUT: data_in (int), channel and gain it was converted  #
+	# 	with						   #
+	# OUTPUTS: BOOL | INT 					   #
+	############################################################
+	def _convert_read(self, data_in, channel, gain):
+		if self._debug_mode:	# log 2's complement value, formatted only when written out
+			_log.debug('Binary value as it has come: {:#b}', data_in)
+		
+		signed_data = self.convert_data(data_in)
+		if self._capture is not None:
+			self._capture.record_sample(data_in, channel, gain, signed_data is not False)
+		if signed_data is False:
+			_invalid.inc()
+			if self._debug_mode:
+				_log.debug('Invalid data detected: {}', data_in)
+			return False			# rturn false because the data is invalid
+		
+		if self._debug_mode:
+			_log.debug('Converted 2\'s complement value: {}', signed_data)
+		
+		return signed_data
+	
+	############################################################
+	# convert_data converts the 24 bit word as it has come	   #
+	# from hx 711 to int. The highest and lowest possible	   #
+	# values are invalid and return False.			   #
+	# Replay of captured samples uses it as well.		   #
+	# INPUTS: data_in (int)					   #
+	# OUTPUTS: INT or BOOL					   #
+	############################################################
+	@staticmethod
+	def convert_data(data_in):
 		#check if data is valid
 		if (data_in == 0x7fffff or 		# 0x7fffff is the highest possible value from hx711
 			data_in == 0x800000):	# 0x800000 is the lowest possible value from hx711
-			if self._debug_mode:
-				print('Invalid data detected: ' + str(data_in) + '\n')
-			return False			# rturn false because the data is invalid
+			return False
 		
 		# calculate int from 2's complement 
-		signed_data = 0
 		if (data_in & 0x800000): # 0b1000 0000 0000 0000 0000 0000 check if the sign bit is 1. Negative number.
-			signed_data = -((data_in ^ 0xffffff) + 1) # convert from 2's complement to int
+			return -((data_in ^ 0xffffff) + 1) # convert from 2's complement to int
 		else:	# else do not do anything the value is positive number
-			signed_data = data_in
-		
-		if self._debug_mode:
-			print('Converted 2\'s complement value: ' + str(signed_data) + '\n')
-		
-		return signed_data
+			return data_in
 	
 	############################################################
 	# get_raw_data_mean returns mean value of readings.	   #
+	# With sequential sampling (see set_precision) times is	   #
+	# ignored, it reads until the mean is precise enough.	   #
 	# If return False something is wrong. Try debug mode.	   #
 	# INPUTS: times # how many times to read data. Default 1   #
 	# OUTPUTS: INT | BOOL					   #
 	############################################################
+	@traced(category='hx711')
 	def get_raw_data_mean(self, times=1):
 		backup_channel = self._current_channel 		# do backup of current channel befor reading for later use
 		backup_gain = self._gain_channel_A		# backup of gain channel A
 		if times > 0 and times < 100:		# check if times is in required range 
-			data_list = []			# create empty list
-			for i in range(times):		# for number of times read and add up all readings.
-				data_list.append(self._read())	# append every read value to the list
+			filter_chain = self.get_filter(backup_channel, backup_gain)
+			if filter_chain is not None:		# incremental filter replaces the pstdev filter
+				valid = 0
+				for i in range(times):
+					result = self._read()
+					if result is not False:
+						filter_chain.update(result)
+						valid += 1
+				if valid == 0:	# the value of the chain is of earlier calls, the chip is not delivering
+					return False
+				self._save_last_raw_data(backup_channel, backup_gain, filter_chain.value)
+				return filter_chain.value
+			if self._sequential is not None:	# read until the standard error is below the precision
+				data_list = self._read_sequential()
+				if len(data_list) == 0:
+					return False
+				times = len(data_list)
+			else:
+				data_list = []			# create empty list
+				for i in range(times):		# for number of times read and add up all readings.
+					data_list.append(self._read())	# append every read value to the list
 			if times > 2 and self._pstdev_filter:			# if times is > 2 filter the data
-				data_pstdev = stat.pstdev(data_list)	# calculate population standard deviation from the data
-				data_mean = stat.mean(data_list)	# calculate mean from the collected data
-				max_num = data_mean + data_pstdev	# calculate max number which is within pstdev
-				min_num = data_mean - data_pstdev	# calculate min number which is within pstdev
-				filtered_data = []			# create new list for filtered data
-				
-				if data_pstdev <=100:			# is pstdev is less than 100 it is ok
-					self._save_last_raw_data(backup_channel, backup_gain, data_mean)	# save last data
-					return data_mean		# just return the calculated mean
-
-				for index,num in enumerate(data_list):	# now I know that pstdev is greater then iterate through the list
-					if (num > min_num and num < max_num):	# check if the number is within pstdev
-						filtered_data.append(num)	# then append to the filtered data list
-				if self._debug_mode:
-					print('data_list: ' + str(data_list))
-					print('filtered_data lsit: ' + str(filtered_data))
-					print('pstdev data: ' + str(data_pstdev))
-					print('pstdev filtered data: ' + str(stat.pstdev(filtered_data)))
-					print('mean data_list: ' + str(stat.mean(data_list)))
-					print('mean filtered_data: ' + str(stat.mean(filtered_data)))
-				f_data_mean = stat.mean(filtered_data)		# calculate mean from filtered data
-				self._save_last_raw_data(backup_channel, backup_gain, f_data_mean)	# save last data
-				return f_data_mean		# return mean from filtered data
+				# mean of the readings within one pstdev of the mean, plain mean if pstdev is 100 or less
+				data_mean, filtered = fast_stats.filtered_mean(data_list, max_pstdev=100)
+				if self._debug_mode and filtered:
+					_log.debug('data_list: {} pstdev data: {} mean data_list: {} mean filtered_data: {}',
+						data_list, fast_stats.pstdev(data_list), fast_stats.mean(data_list), data_mean)
+				self._save_last_raw_data(backup_channel, backup_gain, data_mean)	# save last data
+				return data_mean
 			else: 
-				data_mean = stat.mean(data_list)		# calculate mean from the list
+				data_mean = fast_stats.mean(data_list)		# calculate mean from the list
 				self._save_last_raw_data(backup_channel, backup_gain, data_mean)	# save last data
 				return data_mean		# times was 2 or less just return mean
 		else:
 			raise ValueError('function "get_raw_data_mean" parameter "times" has to be in range 1 up to 99.\n I have got: '\
 						+ str(times))
 	
+	############################################################
+	# _read_sequential reads until the standard error of the   #
+	# mean of the valid readings is below the precision, in	   #
+	# raw units of the current scale ratio, or until the	   #
+	# deadline, empty if no reading was valid by then.	   #
+	# INPUTS: none						   #
+	# OUTPUTS: LIST of INT	# the valid readings		   #
+	############################################################
+	def _read_sequential(self):
+		sequential = self._sequential
+		tolerance = self._precision * abs(self.get_current_scale_ratio())
+		data_list = []
+		sequential.begin()
+		attempts = 0
+		while not sequential.done(tolerance) and attempts < 99:
+			attempts += 1
+			result = self._read()
+			if result is not False:
+				data_list.append(result)
+				sequential.add(result)
+		sequential.end()
+		if self._debug_mode:
+			_log.debug('sequential mean of {} readings, standard error: {}',
+				len(data_list), sequential.standard_error())
+		return data_list
+	
+	############################################################
+	# get_raw_data_filtered does one conversion, passes it	   #
+	# through the filter chain of the channel and gain it was  #
+	# read from and returns the filtered value. So a filtered  #
+	# value is available after every conversion.		   #
+	# If return False something is wrong. Try debug mode.	   #
+	# INPUTS: none						   #
+	# OUTPUTS: FLOAT | BOOL					   #
+	############################################################
+	@traced(category='hx711')
+	def get_raw_data_filtered(self):
+		backup_channel = self._current_channel
+		backup_gain = self._gain_channel_A
+		result = self._read()
+		if result is False:
+			return False
+		filter_chain = self.get_filter(backup_channel, backup_gain)
+		if filter_chain is not None:
+			result = filter_chain.update(result)
+		self._save_last_raw_data(backup_channel, backup_gain, result)
+		return result
+	
+	############################################################
+	# get_weight_filtered returns the filtered value of one	   #
+	# conversion minus offset divided by scale ratio.	   #
+	# If return False something is wrong. Try debug mode.	   #
+	# INPUTS: none						   #
+	# OUTPUTS: FLOAT | BOOL					   #
+	############################################################
+	def get_weight_filtered(self):
+		result = self.get_raw_data_filtered()
+		if result is not False:
+			return (result - self.get_current_offset()) / self.get_current_scale_ratio()
+		else:
+			return False
+	
+	############################################################
+	# set_schedule function interleaves the reads of several   #
+	# channels and gains. schedule is a list of		   #
+	# (channel, gain_A, reads), e.g. [('A', 128, 8),	   #
+	# ('B', 0, 2)] reads 8 conversions of channel A gain 128,  #
+	# then 2 of channel B, over and over (see read_scheduled). #
+	# The gain is ignored for channel B. The first conversion  #
+	# after a switch is discarded, so each entry of a schedule #
+	# of several needs at least 2 reads. The readings of each  #
+	# channel and gain are kept in their own stream of	   #
+	# stream_size readings. None ends the schedule.		   #
+	# INPUTS: schedule(LIST|None), stream_size(INT)		   #
+	# OUTPUTS: BOOL						   #
+	############################################################
+	def set_schedule(self, schedule, stream_size=64):
+		if schedule is None:
+			self._schedule = None
+			self._streams = {}
+			return True
+		cycle = []
+		for channel, gain_A, reads in schedule:
+			if channel == 'A' and gain_A in (128, 64):
+				mode = ('A', gain_A)
+			elif channel == 'B':
+				mode = ('B', 32)
+			else:
+				raise ValueError('schedule entries have to be ("A", 128|64, reads) or ("B", gain, reads).\n'\
+						+ 'I have got: ' + str((channel, gain_A, reads)))
+			if not isinstance(reads, int) or reads < 1:
+				raise ValueError('reads has to be a positive integer.\nI have got: ' + str(reads))
+			cycle.extend([mode] * reads)
+		if len(set(cycle)) > 1:
+			for channel, gain_A, reads in schedule:
+				if reads < 2:
+					raise ValueError('with several channels and gains every entry needs at least 2 reads, '\
+							+ 'the first after a switch is discarded.\nI have got: ' + str(schedule))
+		self._schedule = cycle
+		self._schedule_next = 0
+		self._settling = False
+		self._streams = {mode: deque(maxlen=stream_size) for mode in set(cycle)}
+		return True
+	
+	############################################################
+	# read_scheduled function does the next conversion of the  #
+	# schedule (see set_schedule). Its trailing pulses set the #
+	# channel and gain of the conversion after it, so	   #
+	# channels and gains switch without any waiting. The	   #
+	# reading is passed through the filter chain of its	   #
+	# channel and gain and appended to its stream.		   #
+	# Mind that current channel and gain, and with them the    #
+	# default offset and scale ratio, follow the schedule.	   #
+	# INPUTS: none						   #
+	# OUTPUTS: TUPLE(channel, gain_A, reading) | None if the   #
+	# 	conversion was settling | BOOL False if invalid	   #
+	############################################################
+	@traced(category='hx711')
+	def read_scheduled(self):
+		if self._schedule is None:
+			if self._debug_mode:
+				_log.debug('read_scheduled() without a schedule, call set_schedule first')
+			return False
+		# the word coming now was converted with the current channel and gain
+		if self._current_channel == 'A':
+			mode = ('A', self._gain_channel_A)
+		else:
+			mode = ('B', 32)
+		wanted = self._schedule[self._schedule_next]
+		self._wanted_channel = wanted[0]
+		if wanted[0] == 'A':
+			self._wanted_gain_A = wanted[1]
+		words_read = self._words_read
+		result = self._read()
+		if self._words_read == words_read:	# hx 711 was not ready, nothing was set
+			return False
+		self._schedule_next = (self._schedule_next + 1) % len(self._schedule)
+		settling = self._settling
+		self._settling = wanted != mode		# the next conversion is the first of a new channel or gain
+		if result is False:
+			return False
+		if settling:
+			return None
+		filter_chain = self.get_filter(mode[0], mode[1])
+		if filter_chain is not None:
+			result = filter_chain.update(result)
+		self._save_last_raw_data(mode[0], mode[1], result)
+		stream = self._streams.get(mode)
+		if stream is not None:		# before the schedule starts, the chip may be on another one
+			stream.append(result)
+		return (mode[0], mode[1], result)
+	
+	############################################################
+	# get_stream returns the readings of a channel and gain    #
+	# read by the schedule, oldest first. By default for	   #
+	# the currently chosen one.				   #
+	# INPUTS: channel('A'|'B'), gain_A(64|128)		   #
+	# OUTPUTS: LIST						   #
+	############################################################
+	def get_stream(self, channel='', gain_A=0):
+		if channel == '':
+			channel = self._current_channel
+			gain_A = self._gain_channel_A
+		mode = ('A', gain_A) if channel == 'A' else ('B', 32)
+		return list(self._streams.get(mode, ()))
+	
 	############################################################
 	# get_data_mean returns average value of readings minus    #
 	# offset for the particular channel which was read.	   #
@@ -522,8 +932,12 @@ class HX711:
 	# OUTPUTS: BOOL		# True then it is executed	   #
 	############################################################
 	def power_down(self):
-		GPIO.output(self._pd_sck, False)
-		GPIO.output(self._pd_sck, True)
+		if self._transport is not None:
+			self._transport.set_clock(False)
+			self._transport.set_clock(True)
+		else:
+			GPIO.output(self._pd_sck, False)
+			GPIO.output(self._pd_sck, True)
 		time.sleep(0.01)
 		return True
 
@@ -533,7 +947,10 @@ class HX711:
 	# OUTPUTS: BOOL 	# True then it is executed	   #
 	############################################################
 	def power_up(self):
-		GPIO.output(self._pd_sck, False)
+		if self._transport is not None:
+			self._transport.set_clock(False)
+		else:
+			GPIO.output(self._pd_sck, False)
 		time.sleep(0.01)
 		return True
 
@@ -543,6 +960,7 @@ class HX711:
 	# INPUTS: none						   #
 	# OUTPUTS: BOOL 	# True then it is executed	   #
 	############################################################
+	@traced(category='hx711')
 	def reset(self):
 		self.power_down()
 		self.power_up()
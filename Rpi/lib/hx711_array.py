@@ -0,0 +1,258 @@
+import time
+from .hal import GPIO
+from .hx711 import HX711
+from . import metrics
+from .load_cell_fusion import LoadCellFusion
+from .sequential_mean import SequentialMean
+from .tracing import traced
+
+MAX_PULSE = 0.00006  # seconds, PD_SCK high for 60 us or more powers the HX711s down
+# the same counters as HX711, a window counts once whichever of its chips failed
+_not_ready = metrics.counter('hx711_read_failures_total', 'HX711 reads that returned False', {'reason': 'not_ready'})
+_timing = metrics.counter('hx711_read_failures_total', 'HX711 reads that returned False', {'reason': 'timing'})
+_invalid = metrics.counter('hx711_read_failures_total', 'HX711 reads that returned False', {'reason': 'invalid'})
+_words = metrics.counter('hx711_words_total', 'Words shifted out of the HX711, valid or not')
+
+
+# HX711Array reads one HX711 per load cell, e.g. one per corner of a large platform. All chips share the PD_SCK
+# line, so one train of clock pulses shifts out every chip's word at once: the cells are read in the same
+# conversion window, at the rate of a single chip. Each cell has its own offset and scale ratio, and the loads
+# of a window are fused into the total weight, the load per cell and the centre of mass (lib/load_cell_fusion.py).
+# The array reads channel A, gain 128 only. For the ScaleSampler and the controller it stands in for a HX711
+# whose raw data is the fused total in grams, so its scale ratio is 1 and its offset is the tare in grams.
+class HX711Array:
+
+    def __init__(self, dout_pins, pd_sck_pin, scale_ratios, positions, transport=None):
+        """
+        :param dout_pins: [int] DOUT pin of each HX711
+        :param pd_sck_pin: int, PD_SCK pin shared by all HX711s
+        :param scale_ratios: [float] scale ratio of each cell, raw reading per gram
+        :param positions: [(x, y)] position of each cell, e.g. in mm from the centre of the platform
+        :param transport: GpiodTransport over all dout_pins, or None to bit-bang the pins with RPi.GPIO
+        """
+        if not len(dout_pins) == len(scale_ratios) == len(positions):
+            raise ValueError('dout_pins, scale_ratios and positions have to have one entry per cell')
+        self._douts = tuple(dout_pins)
+        self._pd_sck = pd_sck_pin
+        self._scale_ratios = [float(ratio) for ratio in scale_ratios]
+        self._cell_offsets = [0.0] * len(dout_pins)
+        self._offset = 0  # tare in grams, on top of the zeroed cells
+        self._fusion = LoadCellFusion(positions)
+        self._transport = transport
+        self._precision = None
+        self._sequential = None
+        self.last_fusion = None  # Fusion of the last valid conversion window
+        self.aborted_reads = 0
+
+        if transport is None:
+            GPIO.setmode(GPIO.BCM)
+            GPIO.setup(pd_sck_pin, GPIO.OUT)
+            for pin in self._douts:
+                GPIO.setup(pin, GPIO.IN)
+
+    def __len__(self):
+        return len(self._douts)
+
+    # Reading ###
+    def _set_clock(self, level):
+        if self._transport is not None:
+            self._transport.set_clock(level)
+        else:
+            GPIO.output(self._pd_sck, level)
+
+    def _wait_ready(self, timeout=0.5):
+        if self._transport is not None:
+            return self._transport.wait_ready(timeout)
+        deadline = time.monotonic() + timeout
+        while any(GPIO.input(pin) for pin in self._douts):  # every chip pulls its DOUT low when ready
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.001)
+        return True
+
+    def _read_words(self):
+        """
+        :return: [int] the 24 bit word of each chip, or None if a clock pulse was too long
+        """
+        if self._transport is not None:
+            return self._transport.read_words(1)  # 1 pulse: channel A, gain 128 next
+        words = [0] * len(self._douts)
+        douts = self._douts
+        for i in range(25):
+            start = time.perf_counter()
+            GPIO.output(self._pd_sck, True)
+            GPIO.output(self._pd_sck, False)
+            if time.perf_counter() - start >= MAX_PULSE:
+                self.aborted_reads += 1
+                self.power_down()  # every chip restarts, none waits half way through its word
+                self.power_up()
+                return None
+            if i < 24:
+                words = [(word << 1) | GPIO.input(pin) for word, pin in zip(words, douts)]
+        return words
+
+    @traced(category='hx711')
+    def _read_cells(self):
+        """
+        One conversion window.
+        :return: [int] raw reading of each cell, or False if a chip was not ready or any reading is invalid
+        """
+        self._set_clock(False)
+        if not self._wait_ready():
+            _not_ready.inc()
+            return False
+        words = self._read_words()
+        if words is None:
+            _timing.inc()
+            return False
+        _words.inc(len(words))
+        readings = [HX711.convert_data(word) for word in words]
+        if any(reading is False for reading in readings):
+            _invalid.inc()
+            return False
+        return readings
+
+    def _loads(self, readings):
+        return [(reading - offset) / ratio
+                for reading, offset, ratio in zip(readings, self._cell_offsets, self._scale_ratios)]
+
+    def get_raw_data_filtered(self):
+        """
+        Reads one conversion window and fuses it.
+        :return: float, grams on the zeroed cells, or False
+        """
+        readings = self._read_cells()
+        if readings is False:
+            return False
+        self.last_fusion = self._fusion.fuse(self._loads(readings))
+        return self.last_fusion.total
+
+    def _read_means(self, times):
+        """
+        :param times: int, conversion windows averaged, or the bound with sequential sampling (see set_precision)
+        :return: [float] mean raw reading of each cell, or False if no window was valid
+        """
+        sums = [0] * len(self._douts)
+        count = 0
+        sequential = self._sequential
+        if sequential is not None:
+            sequential.begin()
+        for _ in range(99 if sequential is not None else times):
+            if sequential is not None and sequential.done(self._precision):
+                break
+            readings = self._read_cells()
+            if readings is False:
+                continue
+            sums = [total + reading for total, reading in zip(sums, readings)]
+            count += 1
+            if sequential is not None:
+                sequential.add(sum(self._loads(readings)))
+        if sequential is not None:
+            sequential.end()
+        if count == 0:
+            return False
+        return [total / count for total in sums]
+
+    def get_raw_data_mean(self, times=1):
+        """
+        :return: float, grams on the zeroed cells averaged over times windows, or False
+        """
+        means = self._read_means(times)
+        if means is False:
+            return False
+        self.last_fusion = self._fusion.fuse(self._loads(means))
+        return self.last_fusion.total
+
+    def get_weight_mean(self, times=1):
+        result = self.get_raw_data_mean(times)
+        if result is False:
+            return False
+        return result - self._offset
+
+    # Calibration ###
+    @traced(category='hx711')
+    def zero(self, times=10):
+        """
+        Stores the mean reading of each cell as its offset.
+        :return: True if zeroed
+        """
+        means = self._read_means(times)
+        if means is False:
+            return False
+        self._cell_offsets = means
+        self._offset = 0
+        return True
+
+    def set_offset(self, offset, channel='', gain_A=0):
+        """
+        :param offset: int, grams, the tare on top of the zeroed cells
+        """
+        self._offset = offset
+        return True
+
+    def get_cell_offsets(self):
+        return list(self._cell_offsets)
+
+    def set_cell_offsets(self, offsets):
+        """
+        :param offsets: [float] raw reading of each empty cell, e.g. restored from a CalibrationStore
+        """
+        if len(offsets) != len(self._douts):
+            raise ValueError('expected {} offsets. I have got: {}'.format(len(self._douts), len(offsets)))
+        self._cell_offsets = [float(offset) for offset in offsets]
+        return True
+
+    def set_cell_scale_ratio(self, cell, scale_ratio):
+        self._scale_ratios[cell] = float(scale_ratio)
+        return True
+
+    def set_precision(self, precision, min_samples=2, max_samples=20, deadline=None):
+        """
+        Sequential sampling like HX711.set_precision, on the fused total.
+        :param precision: float, grams or None to average a fixed number of windows
+        """
+        if precision is None:
+            self._precision = None
+            self._sequential = None
+        else:
+            self._precision = precision
+            self._sequential = SequentialMean(min_samples, max_samples, deadline)
+        return True
+
+    def set_capture(self, writer):
+        # captures hold the words of a single chip, an array is not recorded
+        return False
+
+    def get_current_offset(self, channel='', gain_A=0):
+        return self._offset
+
+    def get_current_scale_ratio(self, channel='', gain_A=0):
+        return 1.0
+
+    def get_current_channel(self):
+        return 'A'
+
+    def get_current_gain_A(self):
+        return 128
+
+    def get_pstdev_filter_status(self):
+        # the estimates of the sampler average the fused totals within one pstdev, like those of a single HX711
+        return True
+
+    # Power ###
+    def power_down(self):
+        self._set_clock(False)
+        self._set_clock(True)
+        time.sleep(0.01)
+        return True
+
+    def power_up(self):
+        self._set_clock(False)
+        time.sleep(0.01)
+        return True
+
+    @traced(category='hx711')
+    def reset(self):
+        self.power_down()
+        self.power_up()
+        return self._read_means(6) is not False
@@ -0,0 +1,124 @@
+import math
+import threading
+from collections import namedtuple
+
+# State of a KalmanWeightEstimator after a sample
+#   weight   - float, grams
+#   variance - float, grams², of the weight
+#   rate     - float, grams per second
+#   settled  - bool, the weight is known to within settled_deviation and is not changing
+#   timestamp - float, seconds, of the last sample
+Estimate = namedtuple('Estimate', 'weight variance rate settled timestamp')
+
+
+# KalmanWeightEstimator tracks the weight on the scale and its rate of change with a constant velocity Kalman
+# filter, updated on every sample instead of every block of NUMBER_OF_READINGS samples.
+# A sample further than `gate` standard deviations from the prediction is taken as a step, i.e. a chair rolling
+# on or off. The uncertainty of both weight and rate is then reopened, so the estimate follows the step at once
+# instead of converging to it over several samples, and only counts as settled once the rate is pinned down again.
+# update() is called from the sampler thread while the controller reads the estimate, so the state is locked.
+class KalmanWeightEstimator:
+
+    def __init__(self, measurement_noise=20.0, process_noise=1000.0, settled_deviation=50.0, settled_rate=500.0,
+                 gate=4.0):
+        """
+        :param measurement_noise: float, grams, standard deviation of a single sample
+        :param process_noise: float, grams²/s³, spectral density of the changes of the rate (a person shifting)
+        :param settled_deviation: float, grams, largest standard deviation of a settled weight
+        :param settled_rate: float, grams per second, largest rate of a settled weight, including 2 standard
+        deviations of its uncertainty
+        :param gate: float, standard deviations of the prediction error beyond which a sample is a step
+        """
+        if measurement_noise <= 0:
+            raise ValueError('measurement_noise has to be positive. I have got: ' + str(measurement_noise))
+        self._r = measurement_noise * measurement_noise
+        self._q = process_noise
+        self._settled_variance = settled_deviation * settled_deviation
+        self._settled_rate = settled_rate
+        self._gate = gate * gate
+        self._lock = threading.Lock()
+        self.steps = 0  # number of samples taken as a step
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets the state, the next sample starts a new estimate. E.g. after a tare, which moves every weight
+        """
+        with self._lock:
+            self._weight = None
+            self._rate = 0.0
+            self._p00 = self._p01 = self._p11 = 0.0  # covariance of (weight, rate)
+            self._timestamp = None
+            self._settled = False
+
+    def update(self, weight, timestamp):
+        """
+        :param weight: float, grams, one sample converted with the offset and scale ratio in use
+        :param timestamp: float, seconds, e.g. time.monotonic() of the sample
+        :return: Estimate
+        """
+        with self._lock:
+            if self._weight is None:
+                self._weight = float(weight)
+                self._rate = 0.0
+                self._p00, self._p01, self._p11 = self._r, 0.0, self._settled_rate * self._settled_rate
+                self._timestamp = timestamp
+                self._settled = False
+                return self._estimate()
+
+            dt = max(timestamp - self._timestamp, 0.0)
+            self._timestamp = timestamp
+
+            # predict, the rate is a random walk
+            q = self._q
+            self._weight += dt * self._rate
+            self._p00 += dt * (2 * self._p01 + dt * self._p11) + q * dt * dt * dt / 3
+            self._p01 += dt * self._p11 + q * dt * dt / 2
+            self._p11 += q * dt
+
+            innovation = weight - self._weight
+            s = self._p00 + self._r
+            if innovation * innovation > self._gate * s:
+                self.steps += 1
+                self._p00 += innovation * innovation
+                if dt > 0:
+                    self._p11 += (innovation / dt) ** 2
+                s = self._p00 + self._r
+
+            # correct
+            k0 = self._p00 / s
+            k1 = self._p01 / s
+            self._weight += k0 * innovation
+            self._rate += k1 * innovation
+            self._p11 -= k1 * self._p01
+            self._p00 -= k0 * self._p00
+            self._p01 -= k0 * self._p01
+
+            self._settled = (self._p00 <= self._settled_variance and
+                             abs(self._rate) + 2 * math.sqrt(self._p11) <= self._settled_rate)
+            return self._estimate()
+
+    def _estimate(self):
+        return Estimate(self._weight, self._p00, self._rate, self._settled, self._timestamp)
+
+    def snapshot(self):
+        """
+        :return: Estimate or None before the first sample
+        """
+        with self._lock:
+            return None if self._weight is None else self._estimate()
+
+    @property
+    def estimate(self):
+        with self._lock:
+            return self._weight
+
+    @property
+    def variance(self):
+        with self._lock:
+            return self._p00
+
+    @property
+    def settled(self):
+        with self._lock:
+            return self._settled
@@ -4,8 +4,10 @@
 # See w8bh.net for more information.
 #
 ########################################################################
-import RPi.GPIO as GPIO
-from time import sleep
+from .hal import GPIO
+from . import metrics
+from .tracing import traced
+from time import sleep, perf_counter
 
 # HD44780 Controller Commands
 CLEAR_DISPLAY = 0x01
@@ -26,6 +28,9 @@ DOT = chr(0xA1)
 
 # Line Addresses.
 LINE = [0x00, 0x40, 0x14, 0x54]  # for 20x4 display
+ROWS = 4
+COLS = 20
+BLANK = 0x20
 
 # Max 8 custom char
 digits = [
@@ -63,6 +68,9 @@ bigDigit = [
     [0x00, 0x06, 0x01, 0x02, 0x04, 0x06, 0x20, 0x20, 0x06, 0x20, 0x20, 0x06]  # 9
 ]
 
+_flush_seconds = metrics.histogram('lcd_flush_seconds', 'Time to send the changed cells of a frame to the LCD')
+_cells_sent = metrics.counter('lcd_cells_sent_total', 'Cells sent to the LCD')
+
 negative_sign = [0x20, 0x20, 0x20, 0x04, 0x04, 0x04, 0x20, 0x20, 0x20, 0x20, 0x20, 0x20]
 
 
@@ -82,6 +90,10 @@ class LcdDisplay:
 
         self._show_indicator = False
 
+        # _frame is the screen we want, _shadow is what the LCD currently shows. flush() only sends the difference
+        self._frame = [bytearray([BLANK] * COLS) for _ in range(ROWS)]
+        self._shadow = [bytearray([BLANK] * COLS) for _ in range(ROWS)]
+
     ########################################################################
     #
     # Low-level routines for configuring the LCD module.
@@ -119,10 +131,14 @@ class LcdDisplay:
     #
     # Higher-level routines for diplaying data on the LCD.
     #
+    @traced(category='lcd')
     def clear_display(self):
         # This command requires 1.5mS processing time, so delay is needed
         self.send_byte(CLEAR_DISPLAY)
         sleep(0.0015)  # delay for 1.5mS
+        for row in range(ROWS):
+            self._shadow[row][:] = bytes([BLANK] * COLS)
+            self._frame[row][:] = bytes([BLANK] * COLS)
         if self._show_indicator:
             self.show_nfc_write_indicator()
 
@@ -156,6 +172,7 @@ class LcdDisplay:
         self.send_byte(0x28)  # 4-bit, 2 lines, 5x8 font
         self.send_byte(LEFT_TO_RIGHT)  # rightward moving cursor
         self.cursor_off()
+        self.load_symbol_block(digits)  # custom glyphs stay in CGRAM, so they are only loaded once
         self.clear_display()
         self.reset_display()
 
@@ -199,58 +216,110 @@ class LcdDisplay:
         for i in range(len(data)):
             self.load_custom_symbol(i, data[i])
 
-    def show_big_digit(self, symbol, startCol):
-        # displays a 4-row-high digit at specified column
+    ########################################################################
+    #
+    # Framebuffer routines. Drawing only changes the framebuffer,
+    # flush() then sends the cells that differ from what the LCD shows.
+    #
+    def put_cell(self, row, col, value):
+        # puts a character code (0x00-0x07 are the custom glyphs) into the framebuffer
+        self._frame[row][col] = value
+
+    def put_text(self, row, col, string):
+        for i, character in enumerate(string):
+            self._frame[row][col + i] = ord(character)
+
+    def clear_frame(self):
+        for row in self._frame:
+            row[:] = bytes([BLANK] * COLS)
+
+    @traced(category='lcd')
+    def flush(self):
+        # Sends the changed cells of every row. Consecutive cells are sent after a single SET_CURSOR,
+        # relying on the DDRAM address auto-increment. Runs separated by one unchanged cell are merged,
+        # since resending that cell costs the same as moving the cursor.
+        started = perf_counter()
+        sent = 0
+        for row in range(ROWS):
+            frame = self._frame[row]
+            shadow = self._shadow[row]
+            if frame == shadow:
+                continue
+            col = 0
+            while col < COLS:
+                if frame[col] == shadow[col]:
+                    col += 1
+                    continue
+                start = col
+                end = col + 1  # exclusive end of the run
+                while end < COLS and (frame[end] != shadow[end]
+                                      or (end + 1 < COLS and frame[end + 1] != shadow[end + 1])):
+                    end += 1
+                self.go_to_x_y(row, start)
+                for i in range(start, end):
+                    self.send_byte(frame[i], True)
+                shadow[start:end] = frame[start:end]
+                sent += end - start
+                col = end
+        if sent:  # an unchanged frame costs nothing worth measuring
+            _flush_seconds.observe(perf_counter() - started)
+            _cells_sent.inc(sent)
+        return sent
+
+    def _draw_big_digit(self, symbol, startCol):
         for row in range(4):
-            self.go_to_x_y(row, startCol)
             for col in range(3):
-                index = row * 3 + col
-                self.send_byte(symbol[index], True)
+                self._frame[row][startCol + col] = symbol[row * 3 + col]
+
+    def show_big_digit(self, symbol, startCol):
+        # displays a 4-row-high digit at specified column
+        self._draw_big_digit(symbol, startCol)
+        self.flush()
 
     def show_period(self, col):
         # displays a period '.' at specified column
-        self.go_to_x_y(3, col)
-        self.send_char(DOT)
+        self.put_text(3, col, DOT)
+        self.flush()
 
     def show_kg(self):
-        # displays 'kg' at specified column
-        pos = [18, 19]
-        self.go_to_x_y(0, pos[0])
-        self.send_char('k')
-        self.go_to_x_y(0, pos[1])
-        self.send_char('g')
+        # displays 'kg' at the top right corner
+        self.put_text(0, 18, 'kg')
+        self.flush()
 
     def set_show_nfc_write_indicator_on(self):
         self._show_indicator = True
 
     def show_nfc_write_indicator(self):
-        self.go_to_x_y(1, 19)
-        self.send_char('!')
+        self.put_text(1, 19, '!')
+        self.flush()
 
     def set_show_nfc_write_indicator_off(self):
         self._show_indicator = False
 
     def clear_nfc_write_indicator(self):
-        self.go_to_x_y(1, 19)
-        self.send_char(' ')
+        self.put_text(1, 19, ' ')
+        self.flush()
 
+    @traced(category='lcd')
     def display_weight(self, weight, isNegative):
         # displays large digit weight on 20x4 LCD
         # Note: format for weight is a string in kg without decimal point
-        self.load_symbol_block(digits)
+        # Only the cells that changed since the last call are sent to the LCD
         pos = [3, 6, 10, 14]
-        self.clear_display()
-        self.show_period(13)
+        self.clear_frame()
+        self.put_text(3, 13, DOT)
 
         if isNegative:
-            self.show_big_digit(negative_sign, 0)
+            self._draw_big_digit(negative_sign, 0)
 
         for i in range(len(weight)):
             if weight[i].isdigit():
                 value = int(weight[i])
                 symbols = bigDigit[value]
-                self.show_big_digit(symbols, pos[i])
+                self._draw_big_digit(symbols, pos[i])
             else:
                 continue
-        self.show_kg()
-
+        self.put_text(0, 18, 'kg')
+        if self._show_indicator:
+            self.put_text(1, 19, '!')
+        self.flush()
@@ -0,0 +1,50 @@
+import math
+from collections import namedtuple
+
+# Loads of the cells of one conversion window, fused
+#   total  - float, grams on the platform
+#   loads  - (float), grams on each cell
+#   centre - (x, y) centre of mass in the unit of the cell positions, None if the platform is (nearly) empty
+Fusion = namedtuple('Fusion', 'total loads centre')
+
+
+# LoadCellFusion combines the loads of the cells under a platform into its total weight and centre of mass.
+# A wheelchair rolling on loads the cells at the near edge first, so the centre of mass is close to that edge
+# until all wheels are on the platform and it moves to the middle.
+class LoadCellFusion:
+
+    def __init__(self, positions, min_load=800):
+        """
+        :param positions: [(x, y)] position of each cell, e.g. in mm from the centre of the platform
+        :param min_load: float, grams below which there is no centre of mass
+        """
+        if len(positions) == 0:
+            raise ValueError('positions has to have at least one cell')
+        self._positions = [(float(x), float(y)) for x, y in positions]
+        self._min_load = min_load
+
+    def __len__(self):
+        return len(self._positions)
+
+    def fuse(self, loads):
+        """
+        :param loads: [float] grams on each cell, in the order of the positions
+        :return: Fusion
+        """
+        if len(loads) != len(self._positions):
+            raise ValueError('expected {} loads. I have got: {}'.format(len(self._positions), len(loads)))
+        total = sum(loads)
+        centre = None
+        if total >= self._min_load:
+            centre = (sum(load * x for load, (x, _) in zip(loads, self._positions)) / total,
+                      sum(load * y for load, (_, y) in zip(loads, self._positions)) / total)
+        return Fusion(total, tuple(loads), centre)
+
+    @staticmethod
+    def is_centred(fusion, radius):
+        """
+        :param fusion: Fusion
+        :param radius: float, largest distance of the centre of mass from the centre of the platform
+        :return: True if the load is on the platform as a whole, e.g. all wheels of a wheelchair
+        """
+        return fusion.centre is not None and math.hypot(*fusion.centre) <= radius
@@ -0,0 +1,336 @@
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
+
+QUANTILES = (0.5, 0.9, 0.99)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _render_labels(labels):
+    """
+    :param labels: [(String, String)]
+    :return: String, e.g. '{reason="timing"}', or '' without labels
+    """
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                                           .replace('\n', '\\n')) for key, value in labels) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, int):
+        return str(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+# Counter only goes up, e.g. the reads of the HX711 that failed. inc is an attribute update and nothing else.
+# A metric is updated by one thread, the endpoint only reads it.
+class Counter:
+    TYPE = 'counter'
+    __slots__ = ('name', 'help', 'labels', 'value')
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        """
+        :return: [(String, String)] name and labels rendered, value
+        """
+        return [(self.name + _render_labels(self.labels), _format_value(self.value))]
+
+
+# Gauge goes up and down, e.g. the weight on the platform. With set_function its value is only computed when
+# the endpoint is read, which costs the hot path nothing.
+class Gauge:
+    TYPE = 'gauge'
+    __slots__ = ('name', 'help', 'labels', 'value', '_function')
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.value = 0
+        self._function = None
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set_function(self, function):
+        """
+        :param function: lambda: float, called on every read of the endpoint
+        :return: void
+        """
+        self._function = function
+
+    def samples(self):
+        value = self.value if self._function is None else self._function()
+        return [(self.name + _render_labels(self.labels), _format_value(value))]
+
+
+# P2Quantile estimates one quantile of a stream in constant memory with the P² algorithm (Jain and Chlamtac,
+# 1985): five markers hold the minimum, the maximum, the quantile and the quantiles half way to either end, and
+# are moved along a parabola as the observations come. Every list is allocated up front, observe only updates it.
+class P2Quantile:
+    __slots__ = ('p', 'count', '_heights', '_positions', '_desired', '_increments')
+
+    def __init__(self, p):
+        """
+        :param p: float (0..1), e.g. 0.99
+        """
+        if not 0 < p < 1:
+            raise ValueError('p has to be between 0 and 1. I have got: ' + str(p))
+        self.p = p
+        self.count = 0
+        self._heights = [0.0] * 5
+        self._positions = [1, 2, 3, 4, 5]
+        self._desired = [1.0, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5.0]
+        self._increments = [0.0, p / 2, p, (1 + p) / 2, 1.0]
+
+    def observe(self, x):
+        q = self._heights
+        if self.count < 5:  # the first five observations are the markers
+            q[self.count] = x
+            self.count += 1
+            if self.count == 5:
+                q.sort()
+            return
+        self.count += 1
+        n = self._positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        desired = self._desired
+        for i in range(5):
+            desired[i] += self._increments[i]
+        for i in (1, 2, 3):
+            d = desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < height < q[i + 1]:  # the parabola overshoots, moved linearly instead
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def value(self):
+        """
+        :return: float, the estimated quantile, NaN before the first observation
+        """
+        if self.count == 0:
+            return float('nan')
+        if self.count < 5:
+            first = sorted(self._heights[:self.count])
+            return first[int(round(self.p * (self.count - 1)))]
+        return self._heights[2]
+
+
+# Histogram keeps the count, the sum and streaming estimates of a few quantiles of what it observes, e.g. the
+# time a loop takes, in constant memory. It is exposed as a Prometheus summary.
+class Histogram:
+    TYPE = 'summary'
+    __slots__ = ('name', 'help', 'labels', 'count', 'sum', '_quantiles')
+
+    def __init__(self, name, help, labels=(), quantiles=QUANTILES):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.count = 0
+        self.sum = 0.0
+        self._quantiles = [P2Quantile(p) for p in quantiles]
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for quantile in self._quantiles:
+            quantile.observe(value)
+
+    def quantile(self, p):
+        """
+        :param p: float, one of the quantiles the histogram was made with
+        :return: float
+        """
+        for quantile in self._quantiles:
+            if quantile.p == p:
+                return quantile.value()
+        raise ValueError('quantile not estimated: ' + str(p))
+
+    def samples(self):
+        labels = _render_labels(self.labels)
+        samples = [(self.name + _render_labels(self.labels + (('quantile', str(quantile.p)),)),
+                    _format_value(quantile.value())) for quantile in self._quantiles]
+        samples.append((self.name + '_sum' + labels, _format_value(self.sum)))
+        samples.append((self.name + '_count' + labels, _format_value(self.count)))
+        return samples
+
+
+# _Server answers every request on a thread of its own, a slow route does not hold up a scrape
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+# MetricsRegistry holds the metrics of the process and serves them in the Prometheus text format. Metrics are
+# made once, e.g. at import, and kept; updating them never goes through the registry.
+class MetricsRegistry:
+
+    def __init__(self):
+        self._metrics = {}  # (name, labels) -> metric, in the order they were made
+        self._lock = threading.Lock()
+        self._routes = {}  # path -> lambda query: (content type, String), served next to /metrics
+        self._server = None
+        self._thread = None
+
+    def counter(self, name, help, labels=None):
+        """
+        :param name: String, e.g. 'hx711_read_failures_total'
+        :param help: String, one line
+        :param labels: dict or None, e.g. {'reason': 'timing'}
+        :return: Counter, the same one for every call with the same name and labels
+        """
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=None):
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help, labels=None, quantiles=QUANTILES):
+        return self._get(Histogram, name, help, labels, quantiles)
+
+    def _get(self, kind, name, help, labels, *args):
+        labels = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            metric = self._metrics.get((name, labels))
+            if metric is None:
+                for (other, _), existing in self._metrics.items():
+                    if other == name and type(existing) is not kind:
+                        raise ValueError('{} is a {} already'.format(name, existing.TYPE))
+                metric = kind(name, help, labels, *args)
+                self._metrics[(name, labels)] = metric
+            elif type(metric) is not kind:
+                raise ValueError('{} is a {} already'.format(name, metric.TYPE))
+            return metric
+
+    def expose(self):
+        """
+        :return: String, every metric in the Prometheus text format
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        families = {}  # name -> [metric], the samples of one name are written together
+        for metric in metrics:
+            families.setdefault(metric.name, []).append(metric)
+        lines = []
+        for name, family in families.items():
+            lines.append('# HELP {} {}'.format(name, family[0].help.replace('\\', '\\\\').replace('\n', '\\n')))
+            lines.append('# TYPE {} {}'.format(name, family[0].TYPE))
+            for metric in family:
+                lines.extend('{} {}'.format(sample, value) for sample, value in metric.samples())
+        return '\n'.join(lines) + '\n'
+
+    # Endpoint ###
+    def add_route(self, path, function):
+        """
+        Serves more than the metrics on the endpoint, e.g. a trace of the control loop
+        :param path: String, e.g. '/trace'
+        :param function: lambda query: (String, String), content type and body. query is a dict of the query
+        parameters, each a list of values
+        :return: void
+        """
+        self._routes[path] = function
+
+    def serve(self, port, host='127.0.0.1'):
+        """
+        Serves the metrics on http://host:port/metrics from a thread of its own
+        :param port: int, 0 for any free port
+        :param host: String, '127.0.0.1' keeps the endpoint local to the Pi
+        :return: int, the port served on
+        """
+        if self._server is not None:
+            return self._server.server_address[1]
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path, _, query = self.path.partition('?')
+                if path in ('/', '/metrics'):
+                    content_type, body = CONTENT_TYPE, registry.expose()
+                elif path in registry._routes:
+                    try:
+                        content_type, body = registry._routes[path](parse_qs(query))
+                    except ValueError as e:  # e.g. a query parameter that is not a number
+                        self.send_error(400, str(e))
+                        return
+                else:
+                    self.send_error(404)
+                    return
+                body = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # a scrape every few seconds is not worth a line
+                pass
+
+        self._server = _Server((host, port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, name='MetricsServer', daemon=True)
+        self._thread.start()
+        return self._server.server_address[1]
+
+    def shutdown(self):
+        """
+        Stops the endpoint, the metrics are kept
+        :return: void
+        """
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join(1.0)
+        self._server = None
+        self._thread = None
+
+
+REGISTRY = MetricsRegistry()  # the metrics of the whole process
+
+
+def counter(name, help, labels=None):
+    return REGISTRY.counter(name, help, labels)
+
+
+def gauge(name, help, labels=None):
+    return REGISTRY.gauge(name, help, labels)
+
+
+def histogram(name, help, labels=None, quantiles=QUANTILES):
+    return REGISTRY.histogram(name, help, labels, quantiles)
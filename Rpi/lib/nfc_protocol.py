@@ -0,0 +1,145 @@
+import struct
+from collections import namedtuple
+
+# Binary framed protocol between SerialNfc and the NFC_read_write sketch.
+#
+# Frame: SOF | version | type | seq | length | payload (length bytes) | CRC16-CCITT of version..payload, big endian
+# seq is chosen by the sender of a command, the answer carries the same seq so both can be matched.
+#
+# The link starts in the legacy text mode at LEGACY_BAUDRATE. The Pi sends the handshake line
+# b'\x16RPV<version> <baudrate>\n', which the legacy sketch ignores (it only reacts to '!' and '@').
+# A sketch that speaks the protocol answers with a HELLO_ACK frame carrying the baud rate it accepted,
+# then both sides switch to that baud rate and the Pi confirms with a HELLO frame, answered by another
+# HELLO_ACK. Without an answer in time, the Pi stays in (or goes back to) the legacy text mode and the sketch
+# falls back to it as well. Once switched, the Pi sends a HELLO every few seconds as keepalive, and the sketch
+# falls back to the legacy text mode when it has not had a frame for longer, e.g. after the Pi restarted.
+
+VERSION = 1
+SOF = 0xA5  # never part of the legacy ASCII lines
+HEADER_SIZE = 5
+CRC_SIZE = 2
+MAX_PAYLOAD = 200
+LEGACY_BAUDRATE = 9600
+
+# frame types, answers have the high bit set
+HELLO = 0x01  # Pi -> Arduino, payload: u32 baud rate
+HELLO_ACK = 0x81  # Arduino -> Pi, payload: u32 baud rate
+TAG = 0x02  # Arduino -> Pi, payload: the text records of the tag, as in a legacy tag line
+WRITE_WHEELCHAIR_WEIGHT = 0x03  # Pi -> Arduino, payload: i32 grams
+WRITE_PATIENT_WEIGHT = 0x04  # Pi -> Arduino, payload: i32 grams, u8 day, u8 month, u16 year
+WRITE_RESULT = 0x84  # Arduino -> Pi, payload: u8 status, seq of the write it answers
+
+RESULT_OK = 0
+RESULT_FAILED = 1
+
+Frame = namedtuple('Frame', 'type seq payload')
+
+
+def handshake_line(baudrate):
+    return '\x16RPV{} {}\n'.format(VERSION, baudrate).encode('ascii')
+
+
+def _crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else crc << 1
+        table.append(crc & 0xffff)
+    return table
+
+
+_CRC_TABLE = _crc_table()
+
+
+def crc16(data, crc=0xffff):
+    """
+    CRC16-CCITT (polynomial 0x1021, initial value 0xffff), the same as crc16_ccitt in the sketch
+    :param data: bytes-like
+    :return: int
+    """
+    table = _CRC_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xffff) ^ table[(crc >> 8) ^ byte]
+    return crc
+
+
+def encode_frame(frame_type, seq, payload=b''):
+    """
+    :return: bytes
+    """
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError('payload has to be at most {} bytes. I have got: {}'.format(MAX_PAYLOAD, len(payload)))
+    body = bytes([VERSION, frame_type, seq & 0xff, len(payload)]) + bytes(payload)
+    return bytes([SOF]) + body + struct.pack('>H', crc16(body))
+
+
+def encode_hello(seq, baudrate):
+    return encode_frame(HELLO, seq, struct.pack('<I', baudrate))
+
+
+def encode_wheelchair_weight(seq, weight):
+    return encode_frame(WRITE_WHEELCHAIR_WEIGHT, seq, struct.pack('<i', int(round(weight))))
+
+
+def encode_patient_weight(seq, weight, day):
+    """
+    :param day: datetime.date
+    """
+    return encode_frame(WRITE_PATIENT_WEIGHT, seq, struct.pack('<iBBH', int(round(weight)), day.day, day.month,
+                                                                day.year))
+
+
+def decode_baudrate(payload):
+    return struct.unpack('<I', payload)[0] if len(payload) == 4 else None
+
+
+# FrameDecoder splits a byte stream into frames. Bytes before a start of frame, frames of another version and
+# frames with a bad CRC are skipped, the decoder resynchronises on the next SOF.
+class FrameDecoder:
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.crc_errors = 0
+        self.skipped_bytes = 0
+
+    def reset(self):
+        del self._buffer[:]
+
+    def feed(self, data):
+        """
+        :param data: bytes-like, received bytes
+        :return: [Frame] complete frames, in the order they arrived
+        """
+        buffer = self._buffer
+        buffer.extend(data)
+        frames = []
+        start = 0
+        with memoryview(buffer) as view:
+            while True:
+                sof = buffer.find(SOF, start)
+                if sof < 0:
+                    self.skipped_bytes += len(buffer) - start
+                    start = len(buffer)
+                    break
+                self.skipped_bytes += sof - start
+                start = sof
+                if len(buffer) - start < HEADER_SIZE:
+                    break  # wait for the rest of the header
+                version, frame_type, seq, length = view[start + 1], view[start + 2], view[start + 3], view[start + 4]
+                if version != VERSION or length > MAX_PAYLOAD:
+                    start += 1  # not a frame start after all
+                    self.skipped_bytes += 1
+                    continue
+                end = start + HEADER_SIZE + length + CRC_SIZE
+                if len(buffer) < end:
+                    break  # wait for the rest of the frame
+                received_crc = (view[end - 2] << 8) | view[end - 1]
+                if crc16(view[start + 1:end - CRC_SIZE]) != received_crc:
+                    self.crc_errors += 1
+                    start += 1  # resynchronise on the next SOF
+                    continue
+                frames.append(Frame(frame_type, seq, view[start + HEADER_SIZE:end - CRC_SIZE].tobytes()))
+                start = end
+        del buffer[:start]
+        return frames
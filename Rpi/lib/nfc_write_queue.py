@@ -0,0 +1,310 @@
+import json
+import os
+import threading
+import time
+from datetime import date
+from . import atomic_file
+from .ring_log import get_logger
+
+_log = get_logger('nfc')
+
+PATIENT_WEIGHT = 'patient_weight'
+WHEELCHAIR_WEIGHT = 'wheelchair_weight'
+
+
+# NfcWriteQueue writes to the NFC tags behind the back of the control loop. Writes are queued per tag and kind,
+# a newer weight replaces the pending one (coalescing) and a weight the tag already holds is dropped (dedup).
+# A worker thread sends one write at a time, only while its tag is on the reader, and waits for the Arduino
+# to answer. Unanswered or failed writes are retried with a backoff. Pending writes are kept in a JSON file,
+# so they survive a restart. The file is written by the worker, never by a producer or the reader thread.
+class NfcWriteQueue:
+
+    def __init__(self, ser_nfc, path=None, ack_timeout=3.0, max_attempts=5, retry_delay=1.0, presence_timeout=2.0,
+                 clock=time.monotonic):
+        """
+        :param ser_nfc: SerialNfc
+        :param path: String, file the pending writes are persisted to, None to keep them in memory only
+        :param ack_timeout: float, seconds to wait for the Arduino to answer a write
+        :param max_attempts: int, writes sent for one entry before it is given up
+        :param retry_delay: float, seconds before the first retry, doubled on every further retry
+        :param presence_timeout: float, seconds a tag counts as present after its last frame was read
+        :param clock: lambda: float, seconds
+        """
+        self._ser_nfc = ser_nfc
+        self._path = path
+        self._ack_timeout = ack_timeout
+        self._max_attempts = max_attempts
+        self._retry_delay = retry_delay
+        self._presence_timeout = presence_timeout
+        self._clock = clock
+        self._condition = threading.Condition()
+        self._save_lock = threading.Lock()  # one write of the queue file at a time, the latest state last
+        self._thread = None
+        self._running = False
+
+        self._pending = {}  # (kind, tag_key) -> entry dict, at most one per tag and kind
+        self._last_written = {}  # (kind, tag_key) -> (value, day) acknowledged by the Arduino
+        self._in_flight = None  # entry sent and waiting for an answer
+        self._present_tag = None  # (tag_key, seen_at)
+        self._changed = False  # set whenever the worker has something new to look at
+        self._dirty = False  # the queue file is behind the pending writes
+
+        self.written = 0
+        self.failed = 0
+        self.retries = 0
+        self.coalesced = 0
+        self.deduplicated = 0
+        self._load()
+
+    # Persistence ###
+    def _load(self):
+        if self._path is None or not os.path.exists(self._path):
+            return
+        try:
+            with open(self._path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            _log.warning("NFC write queue file unreadable, starting empty")
+            return
+        today = date.today().strftime(self._ser_nfc.DATE_FORMAT)
+        for entry in state.get('pending', []):
+            # a registration goes to whichever tag is on the reader, after a restart that is anybody's. A patient
+            # weight of another day could end up on the tag of someone else with the same wheelchair weight
+            if entry['tag_key'] is None or (entry['kind'] == PATIENT_WEIGHT and entry['day'] != today):
+                _log.info("NFC write of {} {} dropped, it is out of date", entry['kind'], entry['value'])
+                continue
+            entry['attempts'] = 0  # every restart gets a fresh set of attempts
+            entry['next_attempt'] = 0
+            self._pending[(entry['kind'], entry['tag_key'])] = entry
+        for kind, tag_key, value, day in state.get('last_written', []):
+            if tag_key is not None:  # saved by an older version, see _complete
+                self._last_written[(kind, tag_key)] = (value, day)
+
+    def _save(self):
+        """
+        Writes the queue file if the pending writes changed since it was last written. Called without the
+        condition held, the disk I/O never blocks a producer.
+        :return: void
+        """
+        if self._path is None:
+            return
+        with self._save_lock:
+            with self._condition:
+                if not self._dirty:
+                    return
+                self._dirty = False
+                pending = list(self._pending.values())
+                if self._in_flight is not None:
+                    pending.append(self._in_flight)
+                state = {
+                    'pending': [{'kind': e['kind'], 'tag_key': e['tag_key'], 'value': e['value'], 'day': e['day']}
+                                for e in pending],
+                    'last_written': [[kind, tag_key, value, day]
+                                     for (kind, tag_key), (value, day) in self._last_written.items()],
+                }
+            try:
+                atomic_file.write_json(self._path, state)  # a power cut leaves either the old or the new file
+            except OSError as e:  # e.g. a read-only or full SD card, the writes are still sent
+                _log.error("NFC write queue not saved: {}", e)
+
+    # Producers ###
+    def tag_seen(self, tag_data):
+        """
+        Tells the queue which tag is on the reader. Call it for every tag frame read.
+        :param tag_data: TagData
+        """
+        with self._condition:
+            self._present_tag = (tag_data.wheelchair_weight, self._clock())
+            self._wake()
+
+    def enqueue_patient_weight(self, weight, tag_data):
+        """
+        :param weight: int, grams
+        :param tag_data: TagData of the tag to write to
+        :return: True if queued, False if the tag already holds this weight for today
+        """
+        day = date.today().strftime(self._ser_nfc.DATE_FORMAT)
+        if any(round(w) == weight and d is not None and d.strftime(self._ser_nfc.DATE_FORMAT) == day
+               for w, d in tag_data.past_weights):
+            with self._condition:
+                self.deduplicated += 1
+            return False
+        return self._enqueue(PATIENT_WEIGHT, tag_data.wheelchair_weight, weight, day)
+
+    def enqueue_wheelchair_weight(self, weight, tag_data=None):
+        """
+        :param weight: int, grams
+        :param tag_data: TagData of the tag to write to, None for whichever tag is on the reader
+        :return: True if queued, False if it is a duplicate
+        """
+        return self._enqueue(WHEELCHAIR_WEIGHT, None if tag_data is None else tag_data.wheelchair_weight, weight, None)
+
+    def _enqueue(self, kind, tag_key, value, day):
+        slot = (kind, tag_key)
+        with self._condition:
+            in_flight = self._in_flight
+            # a write to whichever tag is on the reader (tag_key None) is never a duplicate of an earlier one,
+            # the tag on the reader may be another one by now
+            if tag_key is not None and (
+                    self._last_written.get(slot) == (value, day) or
+                    (in_flight is not None and (in_flight['kind'], in_flight['tag_key']) == slot
+                     and in_flight['value'] == value and in_flight['day'] == day)):
+                self.deduplicated += 1
+                return False
+            previous = self._pending.get(slot)
+            if previous is not None:
+                if previous['value'] == value and previous['day'] == day:
+                    self.deduplicated += 1
+                    return False
+                self.coalesced += 1  # the newer weight replaces the one that was not written yet
+            self._pending[slot] = {'kind': kind, 'tag_key': tag_key, 'value': value, 'day': day,
+                                   'attempts': 0, 'next_attempt': 0}
+            self._dirty = True
+            self._wake()
+            return True
+
+    def acknowledge(self, success):
+        """
+        Answer of the Arduino to the last write, see SerialNfc.on_write_result
+        :param success: bool
+        """
+        with self._condition:
+            entry = self._in_flight
+            if entry is None:
+                return  # late answer to a write that already timed out
+            self._in_flight = None
+            if success:
+                self._complete(entry)
+            else:
+                self._retry(entry)
+            self._dirty = True
+            self._wake()
+
+    # State ###
+    def pending(self):
+        """
+        :return: [dict] writes waiting to be sent or acknowledged
+        """
+        with self._condition:
+            entries = list(self._pending.values())
+            if self._in_flight is not None:
+                entries.append(self._in_flight)
+            return [dict(entry) for entry in entries]
+
+    def _wake(self):
+        # called with the condition held
+        self._changed = True
+        self._condition.notify_all()
+
+    def _complete(self, entry):
+        slot = (entry['kind'], entry['tag_key'])
+        if entry['tag_key'] is not None:  # nothing is known about which tag got a write to the present one
+            self._last_written[slot] = (entry['value'], entry['day'])
+        self.written += 1
+        if entry['kind'] == WHEELCHAIR_WEIGHT:
+            # the tag is now known by its new wheelchair weight
+            self._present_tag = None
+        newer = self._pending.get(slot)
+        if newer is not None and newer['value'] == entry['value'] and newer['day'] == entry['day']:
+            del self._pending[slot]
+            self.deduplicated += 1
+
+    def _retry(self, entry):
+        slot = (entry['kind'], entry['tag_key'])
+        if entry['attempts'] >= self._max_attempts:
+            self.failed += 1
+            _log.warning("NFC write of {} {} given up after {} attempts", entry['kind'], entry['value'],
+                         entry['attempts'])
+            return
+        if slot in self._pending:
+            return  # a newer weight for the same tag replaces the failed one
+        self.retries += 1
+        entry['next_attempt'] = self._clock() + self._retry_delay * 2 ** (entry['attempts'] - 1)
+        self._pending[slot] = entry
+
+    def _is_present(self, tag_key, now):
+        if tag_key is None:
+            return True  # e.g. registering a new tag, which sends no frames. The Arduino only answers if it is there
+        if self._present_tag is None or now - self._present_tag[1] > self._presence_timeout:
+            return False
+        return tag_key == self._present_tag[0]
+
+    # Worker ###
+    def service(self):
+        """
+        Times out an unanswered write, sends the next due one and writes the queue file if it changed. The worker
+        thread calls it in a loop, without the thread it can be called directly, e.g. on a simulated clock.
+        :return: float, seconds until there may be something to do
+        """
+        wait = self._send_next()
+        self._save()
+        return wait
+
+    def _send_next(self):
+        with self._condition:
+            now = self._clock()
+            if self._in_flight is not None:
+                deadline = self._in_flight['sent_at'] + self._ack_timeout
+                if now < deadline:
+                    return deadline - now
+                entry = self._in_flight
+                self._in_flight = None
+                self._retry(entry)
+                self._dirty = True
+
+            due = [entry for entry in self._pending.values()
+                   if entry['next_attempt'] <= now and self._is_present(entry['tag_key'], now)]
+            if not due:
+                waits = [entry['next_attempt'] - now for entry in self._pending.values()
+                         if entry['next_attempt'] > now]
+                return min(waits + [self._presence_timeout])
+            entry = min(due, key=lambda e: e['next_attempt'])
+            del self._pending[(entry['kind'], entry['tag_key'])]
+            entry['attempts'] += 1
+            entry['sent_at'] = now
+            self._in_flight = entry
+
+        # the serial write happens outside the lock, producers never wait on tag I/O
+        if entry['kind'] == PATIENT_WEIGHT:
+            sent = self._ser_nfc.update_patient_weight_with_date(entry['value'], entry['day'])
+        else:
+            sent = self._ser_nfc.write_wheelchair_weight(entry['value'])
+        if not sent:
+            self.acknowledge(False)
+        return 0
+
+    def start(self):
+        """
+        Starts the worker thread.
+        :return: void
+        """
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='NfcWriteQueue', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        """
+        Stops the worker thread. Writes that were not acknowledged stay in the queue file.
+        :param timeout: float, seconds
+        :return: void
+        """
+        self._running = False
+        with self._condition:
+            self._wake()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self._save()  # e.g. an answer that came in after the last pass of the worker
+
+    def is_running(self):
+        return self._running
+
+    def _run(self):
+        while self._running:
+            wait = self.service()
+            with self._condition:
+                if wait > 0 and not self._changed:
+                    self._condition.wait(wait)
+                self._changed = False
@@ -0,0 +1,211 @@
+import sys
+import threading
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR}
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+
+
+# RingLog keeps log records in a ring buffer allocated up front, instead of printing them as they come. A record
+# is its timestamp, level, subsystem, message and arguments. The message is only formatted when the records are
+# written out: in batches by a flusher thread, or all at once by dump() for a post-mortem. A record below the
+# level of its subsystem costs one comparison in Logger and is never stored. Records that are overwritten
+# before they were flushed are counted in dropped.
+class RingLog:
+
+    def __init__(self, capacity=4096, level=INFO, clock=time.time):
+        """
+        :param capacity: int, records kept in memory
+        :param level: int, level of the subsystems without a level of their own
+        :param clock: lambda: float, seconds of the record timestamps
+        """
+        if capacity < 1:
+            raise ValueError('capacity has to be at least 1. I have got: ' + str(capacity))
+        self._capacity = capacity
+        self._records = [[0.0, 0, '', '', ()] for _ in range(capacity)]  # timestamp, level, subsystem, message, args
+        self._written = 0  # records ever written, the next one goes to _written % capacity
+        self._flushed = 0  # records ever written out by flush
+        self._lock = threading.Lock()
+        self._clock = clock
+        self._level = level
+        self._levels = {}  # subsystem -> level set for it
+        self._loggers = {}
+        self._sink = None
+        self._thread = None
+        self._running = False
+        self._wake = threading.Event()
+        self.dropped = 0
+
+    # Loggers and levels ###
+    def get_logger(self, subsystem):
+        """
+        :param subsystem: String, e.g. 'observer'
+        :return: Logger, the same one for every call with the same subsystem
+        """
+        logger = self._loggers.get(subsystem)
+        if logger is None:
+            logger = self._loggers.setdefault(subsystem, Logger(self, subsystem,
+                                                                self._levels.get(subsystem, self._level)))
+        return logger
+
+    def set_level(self, level, subsystem=None):
+        """
+        :param level: int or String, e.g. DEBUG or 'debug'
+        :param subsystem: String or None for every subsystem without a level of its own
+        :return: void
+        """
+        if not isinstance(level, int):
+            level = LEVELS[level]
+        if subsystem is None:
+            self._level = level
+        else:
+            self._levels[subsystem] = level
+        for name, logger in self._loggers.items():
+            logger.level = self._levels.get(name, self._level)
+
+    # Records ###
+    def record(self, level, subsystem, message, args):
+        """
+        Stores a record, Logger calls it only for records at or above the level of the subsystem
+        :return: void
+        """
+        with self._lock:
+            record = self._records[self._written % self._capacity]
+            record[0] = self._clock()
+            record[1] = level
+            record[2] = subsystem
+            record[3] = message
+            record[4] = args
+            self._written += 1
+            if self._written - self._flushed > self._capacity:
+                self._flushed += 1  # the oldest record not written out yet has just been overwritten
+                self.dropped += 1
+        if level >= WARNING:
+            self._wake.set()  # written out right away instead of with the next batch
+
+    def _copy(self, start):
+        # called with the lock held, copies the records from start on so they can be formatted outside of it
+        return [tuple(self._records[i % self._capacity]) for i in range(start, self._written)]
+
+    @staticmethod
+    def format(record):
+        """
+        :param record: (timestamp, level, subsystem, message, args)
+        :return: String, one line
+        """
+        timestamp, level, subsystem, message, args = record
+        if args:
+            try:
+                message = message.format(*args)
+            except (IndexError, KeyError, ValueError):
+                message = '{} {!r}'.format(message, args)
+        return '{:.3f} {} {}: {}'.format(timestamp, LEVEL_NAMES.get(level, level), subsystem, message)
+
+    # Output ###
+    def flush(self):
+        """
+        Writes out the records stored since the last flush, in one write
+        :return: int, number of records written
+        """
+        with self._lock:
+            records = self._copy(self._flushed)
+            self._flushed = self._written
+        if records:
+            sink = self._sink if self._sink is not None else sys.stdout
+            sink.write(''.join(RingLog.format(record) + '\n' for record in records))
+            sink.flush()
+        return len(records)
+
+    def dump(self, stream):
+        """
+        Writes every record still in the buffer, written out already or not, e.g. after a failure
+        :param stream: file like object
+        :return: int, number of records written
+        """
+        with self._lock:
+            records = self._copy(max(0, self._written - self._capacity))
+        stream.write(''.join(RingLog.format(record) + '\n' for record in records))
+        stream.flush()
+        return len(records)
+
+    def start(self, sink=None, interval=0.5):
+        """
+        Starts the flusher thread
+        :param sink: file like object the records are written to, None for stdout
+        :param interval: float, seconds between two batches
+        :return: void
+        """
+        self._sink = sink
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, args=(interval,), name='RingLog', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        """
+        Stops the flusher thread and writes out what is left
+        :return: void
+        """
+        self._running = False
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def is_running(self):
+        return self._running
+
+    def _run(self, interval):
+        while self._running:
+            self._wake.wait(interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except (OSError, ValueError):  # the sink went away, e.g. a closed file, the records stay in the dump
+                pass
+
+
+# Logger writes the records of one subsystem to a RingLog. Its level is checked before anything else happens,
+# a record below it costs a comparison and no formatting.
+class Logger:
+    __slots__ = ('_log', 'subsystem', 'level')
+
+    def __init__(self, log, subsystem, level):
+        self._log = log
+        self.subsystem = subsystem
+        self.level = level
+
+    def is_enabled_for(self, level):
+        return self.level <= level
+
+    def debug(self, message, *args):
+        """
+        :param message: String, formatted with str.format(*args) when written out
+        """
+        if self.level <= DEBUG:
+            self._log.record(DEBUG, self.subsystem, message, args)
+
+    def info(self, message, *args):
+        if self.level <= INFO:
+            self._log.record(INFO, self.subsystem, message, args)
+
+    def warning(self, message, *args):
+        if self.level <= WARNING:
+            self._log.record(WARNING, self.subsystem, message, args)
+
+    def error(self, message, *args):
+        if self.level <= ERROR:
+            self._log.record(ERROR, self.subsystem, message, args)
+
+
+LOG = RingLog()  # the log of the whole process
+
+
+def get_logger(subsystem):
+    return LOG.get_logger(subsystem)
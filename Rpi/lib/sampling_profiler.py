@@ -0,0 +1,71 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+# SamplingProfiler looks at the stack of every thread of the process at a fixed interval for a while and counts
+# how often each stack was seen, so a slow device can be profiled without restarting it and without slowing it
+# down the way a tracing profiler would. The stacks are written in the collapsed format of flamegraph.pl, which
+# https://www.speedscope.app reads as well.
+class SamplingProfiler:
+
+    def __init__(self, interval=0.005):
+        """
+        :param interval: float, seconds between two samples
+        """
+        self._interval = interval
+        self._lock = threading.Lock()  # one profile at a time
+
+    def is_running(self):
+        return self._lock.locked()
+
+    def profile(self, seconds):
+        """
+        Samples the other threads for seconds, blocking
+        :param seconds: float
+        :return: Counter of stacks, a stack being a tuple of the thread name and its frames outermost first, or
+        None if a profile is running already
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            stacks = Counter()
+            me = threading.get_ident()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for thread, frame in sys._current_frames().items():
+                    if thread != me:
+                        stacks[SamplingProfiler._stack(names.get(thread, str(thread)), frame)] += 1
+                time.sleep(self._interval)
+            return stacks
+        finally:
+            self._lock.release()
+
+    def profile_in_background(self, seconds, done):
+        """
+        Profiles on a thread of its own, e.g. from a signal handler that must not block
+        :param done: lambda stacks: void, called with the result of profile
+        :return: void
+        """
+        threading.Thread(target=lambda: done(self.profile(seconds)), name='SamplingProfiler', daemon=True).start()
+
+    @staticmethod
+    def _stack(thread_name, frame):
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        frames.append(thread_name)
+        return tuple(reversed(frames))
+
+    @staticmethod
+    def collapsed(stacks):
+        """
+        :param stacks: Counter from profile
+        :return: String, one 'thread;outer;...;inner count' line per stack, most frequent first
+        """
+        return ''.join('{} {}\n'.format(';'.join(stack), count) for stack, count in stacks.most_common())
@@ -1,10 +1,30 @@
-from collections import deque
+import time
+from . import metrics
+from .ring_log import get_logger
+from .stability_window import StabilityWindow
+from .tracing import traced
+
+_log = get_logger('observer')
+_weight = metrics.gauge('observer_weight_grams', 'Total weight on the platform')
+_person_on_scale = metrics.gauge('observer_person_on_scale', '1 while a person is on the platform')
+_mounts = metrics.counter('observer_mounts_total', 'Mounts of the platform')
+_dismounts = metrics.counter('observer_dismounts_total', 'Dismounts of the platform')
+_stable_weighings = metrics.counter('observer_weighings_total', 'Weighings of a person with a tag',
+                                    {'kind': 'stable'})
+_predicted_weighings = metrics.counter('observer_weighings_total', 'Weighings of a person with a tag',
+                                       {'kind': 'predicted'})
 
 
 # ScaleObserver is used to monitor changes in the weighing scale used, and trigger callbacks that are bound to it
 class ScaleObserver:
 
-    def __init__(self, threshold_weight=800, tolerance=3, history_size=5, stability_deviation=100):
+    def __init__(self, threshold_weight=800, tolerance=3, history_size=5, stability_deviation=100,
+                 history_duration=None, clock=time.monotonic):
+        """
+        :param history_size: int, number of weights that have to be stable
+        :param history_duration: float, seconds of weights that have to be stable. Overrides history_size
+        :param clock: lambda: float, time source of history_duration, e.g. the simulated clock of a replay
+        """
 
         # person_on_scale, scale_dismount
         self._person_on_scale = False
@@ -20,8 +40,15 @@ class ScaleObserver:
         self._stability_deviation = stability_deviation
         self._history_size = history_size
         self._is_stable = False
-        self._weight_history = deque()
+        self._weight_history = StabilityWindow(stability_deviation, size=history_size, duration=history_duration,
+                                               clock=clock)
         self._successful_weighing_callbacks = {}
+        self._settled = None  # stability decided by the caller of update, None uses the weight history
+        self._all_wheels_on = None  # the whole load is on the platform, None if the scale cannot tell
+
+        # predicted_weighing
+        self._predicted_weight = None
+        self._predicted_weighing_callbacks = {}
 
         self.total_weight = -1
         self.tag_data = None
@@ -35,11 +62,34 @@ class ScaleObserver:
     def is_stable(self, value):
 
         # A person on the scale has successfully taken his weight
-        if self.person_on_scale and (self.nfc_present is True) and (value is True):
+        if self.person_on_scale and (self.nfc_present is True) and (value is True) and \
+                self._all_wheels_on is not False:
+            if not self._is_stable:
+                _stable_weighings.inc()  # counted once per stable stretch, the callbacks run on every update
             self._exec_successful_weighing_callbacks()
 
         self._is_stable = value
 
+    @property
+    def predicted_weight(self):
+        return self._predicted_weight
+
+    @predicted_weight.setter
+    def predicted_weight(self, value):
+        """
+        :param value: float, grams the scale is predicted to settle at, or None if there is no confident prediction
+        :return: void
+        """
+        previous = self._predicted_weight
+        self._predicted_weight = value
+
+        # The weight of a person on the scale is known before it has settled
+        if self.person_on_scale and (self.nfc_present is True) and value is not None and \
+                self._all_wheels_on is not False:
+            if previous is None:
+                _predicted_weighings.inc()  # counted once per prediction, the callbacks run on every update
+            self._exec_predicted_weighing_callbacks()
+
     @property
     def person_on_scale(self):
         return self._person_on_scale
@@ -53,13 +103,16 @@ class ScaleObserver:
         """
         # if person has dismounted
         if value is False and self._person_on_scale is True:
+            _dismounts.inc()
             self._exec_on_scale_dismount_callbacks()
 
         # if person has mounted
         if value is True and self._person_on_scale is False:
+            _mounts.inc()
             self._exec_on_scale_mount_callbacks()
 
         self._person_on_scale = value
+        _person_on_scale.set(value)
 
     @property
     def total_weight(self):
@@ -84,24 +137,6 @@ class ScaleObserver:
 
             return tolerance_value <= 0
 
-        def add_to_history(weight):
-            def check_if_stable(history):
-                from functools import reduce
-                if history is None or len(history) is 0:
-                    return False
-                mean = reduce(lambda x, y: x + y, history, 0) / len(history)
-                return len([w for w in history if abs(w - mean) > self._stability_deviation]) == 0
-
-            self._weight_history.append(weight)
-
-            if len(self._weight_history) < self._history_size:
-                return False  # not enough readings in history
-
-            while len(self._weight_history) > self._history_size:
-                self._weight_history.popleft()
-
-            return check_if_stable(self._weight_history)
-
         # Checks to see if a person is on the scale
         if value > self._threshold_weight:
             if threshold_change(0):
@@ -110,7 +145,10 @@ class ScaleObserver:
             self.person_on_scale = False
 
         # Checks to see if weight readings are stable
-        if add_to_history(value):
+        stable = self._weight_history.add(value)
+        if self._settled is not None:
+            stable = self._settled
+        if stable:
             self.is_stable = True
         else:
             self.is_stable = False
@@ -150,14 +188,27 @@ class ScaleObserver:
         """
         self._bind_to_trigger(callback, self._successful_weighing_callbacks, lifetime)
 
+    def on_predicted_weighing(self, callback, lifetime=-1):
+        """
+        Binds callbacks the predicted weighing event, which comes ahead of the successful weighing event
+        once the final weight can be predicted while the scale is still settling.
+        Lifetime determines the maximum number of times the callback would be triggered by the event.
+        Lifetime of -1 means the callback would always be triggered.
+        :param callback: lambda: void
+        :param lifetime: int
+        :return: void
+        """
+        self._bind_to_trigger(callback, self._predicted_weighing_callbacks, lifetime)
+
     def _bind_to_trigger(self, callback, callbacks_dict, lifetime):
         callbacks_dict[callback] = lifetime  # OVERWRITES previous callback if any
 
+    @traced(category='observer')
     def _exec_successful_weighing_callbacks(self):
         callbacks = self._successful_weighing_callbacks
         wheelchair_weight = 0 if self.tag_data is None else self.tag_data.wheelchair_weight
         for callback, lifetime in callbacks.copy().items():
-            if lifetime is -1:
+            if lifetime == -1:
                 callback(self.total_weight)
             elif lifetime > 0:
                 callbacks[callback] -= 1
@@ -165,9 +216,23 @@ class ScaleObserver:
             else:  # lazy deletion, callbacks with lifetime of zero are expired
                 del callbacks[callback]
 
+    @traced(category='observer')
+    def _exec_predicted_weighing_callbacks(self):
+        callbacks = self._predicted_weighing_callbacks
+        wheelchair_weight = 0 if self.tag_data is None else self.tag_data.wheelchair_weight
+        for callback, lifetime in callbacks.copy().items():
+            if lifetime == -1:
+                callback(self.predicted_weight)
+            elif lifetime > 0:
+                callbacks[callback] -= 1
+                callback(self.predicted_weight, wheelchair_weight)
+            else:  # lazy deletion, callbacks with lifetime of zero are expired
+                del callbacks[callback]
+
+    @traced(category='observer')
     def _exec_on_scale_dismount_callbacks(self):
         for callback, lifetime in self._scale_dismount_callbacks.copy().items():
-            if lifetime is -1:
+            if lifetime == -1:
                 callback()
             elif lifetime > 0:
                 self._scale_dismount_callbacks[callback] -= 1
@@ -175,9 +240,10 @@ class ScaleObserver:
             else:  # lazy deletion, callbacks with lifetime of zero are expired
                 del self._scale_dismount_callbacks[callback]
 
+    @traced(category='observer')
     def _exec_on_scale_mount_callbacks(self):
         for callback, lifetime in self._scale_mount_callbacks.copy().items():
-            if lifetime is -1:
+            if lifetime == -1:
                 callback()
             elif lifetime > 0:
                 self._scale_mount_callbacks[callback] -= 1
@@ -185,12 +251,28 @@ class ScaleObserver:
             else:  # lazy deletion, callbacks with lifetime of zero are expired
                 del self._scale_mount_callbacks[callback]
 
-    def update(self, total_weight, tag_data, nfc_present):
+    @traced(category='observer')
+    def update(self, total_weight, tag_data, nfc_present, settled=None, predicted_weight=None, all_wheels_on=None):
+        """
+        :param total_weight: float, grams
+        :param tag_data: TagData or None
+        :param nfc_present: bool
+        :param settled: bool, whether the weight is stable, e.g. KalmanWeightEstimator.settled. None decides it
+        with the weight history of the last history_size weights
+        :param predicted_weight: float, grams the scale will settle at, e.g. SettlingPredictor.prediction
+        :param all_wheels_on: bool, whether the centre of mass is in the middle of the platform, e.g.
+        LoadCellFusion.is_centred. False holds back weighing events, None if the scale cannot tell
+        :return: void
+        """
         self.nfc_present = nfc_present
         self.tag_data = tag_data
+        self._settled = settled
+        self._all_wheels_on = all_wheels_on
         self.total_weight = total_weight
-        print("Weight:{} Nfc_present:{} is_stable:{} person_on_scale:{}".format(
-            self.total_weight,
-            self.nfc_present,
-            self.is_stable,
-            self.person_on_scale))
+        self.predicted_weight = predicted_weight
+        _weight.set(total_weight)
+        _log.debug("Weight:{} Nfc_present:{} is_stable:{} person_on_scale:{}",
+                   self.total_weight,
+                   self.nfc_present,
+                   self.is_stable,
+                   self.person_on_scale)
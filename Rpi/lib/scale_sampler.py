@@ -0,0 +1,263 @@
+import itertools
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError
+from . import fast_stats
+from . import metrics
+from .ring_log import get_logger
+
+_log = get_logger('sampler')
+_errors = metrics.counter('sampler_errors_total', 'Conversions or listeners of the sampler thread that raised')
+
+
+# ScaleSampler owns the HX711 conversions. It reads the chip continuously on its own thread and keeps the most
+# recent timestamped samples in a buffer, so every consumer shares one sample stream instead of blocking on reads.
+# Everything else that touches the HX711 (tare, registration, calibration, reads) is a command submitted to it.
+# Commands wait in a priority queue and run on the sampler thread between two conversions, so a button press
+# never lands in the middle of a read.
+class ScaleSampler:
+    # command priorities, lower runs first
+    TARE = 0
+    REGISTER = 1
+    CALIBRATE = 2
+    READ = 3
+    ERROR_BACKOFF = 0.1  # seconds to wait after a conversion or listener raised, so a dead transport does not spin
+
+    def __init__(self, scale, buffer_size=64):
+        """
+        :param scale: HX711
+        :param buffer_size: int, number of samples kept in the buffer
+        """
+        self._scale = scale
+        self._samples = deque(maxlen=buffer_size)  # (timestamp, raw_data)
+        self._sample_count = 0  # total number of valid samples ever acquired
+        self._condition = threading.Condition()
+        self._listeners = []
+        self._commands = queue.PriorityQueue()  # (priority, sequence, command, Future)
+        self._sequence = itertools.count()  # commands of the same priority run in the order they came
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        """
+        Starts the sampling thread. From this point on, nothing else should read the HX711 directly.
+        :return: void
+        """
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='ScaleSampler', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        """
+        Stops the sampling thread and waits for the current conversion to finish.
+        :param timeout: float, seconds
+        :return: void
+        """
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        with self._condition:
+            self._condition.notify_all()
+        while True:  # nobody is left to run the commands still waiting
+            try:
+                _, _, _, future = self._commands.get_nowait()
+            except queue.Empty:
+                break
+            future.cancel()
+
+    def is_running(self):
+        return self._running
+
+    def add_listener(self, callback):
+        """
+        Calls callback with every valid sample, on the sampler thread. It has to return quickly, the next
+        conversion waits for it.
+        :param callback: lambda timestamp, raw_data: void
+        :return: void
+        """
+        self._listeners.append(callback)
+
+    def submit(self, command, priority=READ):
+        """
+        Runs command on the sampler thread between two conversions, or once the sampler is started
+        :param command: lambda scale: result, scale is the HX711
+        :param priority: int, ScaleSampler.TARE, REGISTER, CALIBRATE or READ
+        :return: Future of the result of command
+        """
+        future = Future()
+        self._commands.put((priority, next(self._sequence), command, future))
+        return future
+
+    def _run_commands(self):
+        while True:
+            try:
+                _, _, command, future = self._commands.get_nowait()
+            except queue.Empty:
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(command(self._scale))
+            except Exception as e:  # handed over to whoever waits for the result
+                future.set_exception(e)
+
+    def _run(self):
+        while self._running:
+            self._run_commands()
+            try:
+                self._acquire()
+            except Exception as e:  # one failed conversion or listener must not end the thread the commands run on
+                _errors.inc()
+                _log.error("Sampler conversion failed: {!r}", e)
+                time.sleep(ScaleSampler.ERROR_BACKOFF)
+
+    def _acquire(self):
+        """
+        Performs one conversion and appends it to the buffer if it is valid. If the scale has a filter chain
+        for the current channel and gain, the filtered value is stored and passed to the listeners.
+        :return: True if a valid sample was stored
+        """
+        raw = self._scale.get_raw_data_filtered()
+        if raw is False:
+            return False
+        timestamp = time.monotonic()
+        with self._condition:
+            self._samples.append((timestamp, raw))
+            self._sample_count += 1
+        for listener in self._listeners:
+            listener(timestamp, raw)
+        with self._condition:  # whoever waits for the sample sees what the listeners made of it
+            self._condition.notify_all()
+        return True
+
+    def sample_count(self):
+        with self._condition:
+            return self._sample_count
+
+    def wait_for_samples(self, n=1, timeout=None):
+        """
+        Blocks until n new samples have been acquired since the call was made.
+        :param n: int
+        :param timeout: float, seconds or None to wait forever
+        :return: True if the samples arrived, False on timeout or if the sampler stopped
+        """
+        with self._condition:
+            target = self._sample_count + n
+            return self._condition.wait_for(
+                lambda: self._sample_count >= target or not self._running, timeout) and self._sample_count >= target
+
+    def get_samples(self, n=None, max_age=None):
+        """
+        :param n: int, maximum number of most recent samples to return. None returns every buffered sample
+        :param max_age: float, seconds. Samples older than this are ignored
+        :return: [(timestamp, raw_data)] oldest first
+        """
+        with self._condition:
+            samples = list(self._samples)
+        if max_age is not None:
+            oldest = time.monotonic() - max_age
+            samples = [s for s in samples if s[0] >= oldest]
+        if n is not None:
+            samples = samples[-n:] if n > 0 else []
+        return samples
+
+    def get_raw_estimate(self, n=None, max_age=None):
+        """
+        Non-blocking mean of the most recent raw samples. Of more than 2 samples, only those within one pstdev
+        of the mean are averaged, like HX711.get_raw_data_mean does, so a garbage word does not move it.
+        :return: float or None if no sample matches
+        """
+        samples = self.get_samples(n, max_age)
+        if len(samples) == 0:
+            return None
+        return self._mean([raw for _, raw in samples])
+
+    def _mean(self, data):
+        if len(data) > 2 and self._scale.get_pstdev_filter_status():
+            return fast_stats.filtered_mean(data, max_pstdev=100)[0]
+        return fast_stats.mean(data)
+
+    def get_weight_estimate(self, n=None, max_age=None):
+        """
+        Non-blocking weight estimate from the most recent samples, using the offset and scale ratio
+        of the current channel and gain.
+        :param n: int, number of most recent samples to average
+        :param max_age: float, seconds
+        :return: float (grams) or None if no sample matches
+        """
+        raw = self.get_raw_estimate(n, max_age)
+        if raw is None:
+            return None
+        return (raw - self._scale.get_current_offset()) / self._scale.get_current_scale_ratio()
+
+    def get_weight_sequential(self, sequential, precision, timeout=None):
+        """
+        Waits for new samples until the standard error of their mean is below precision, see SequentialMean.
+        :param sequential: SequentialMean
+        :param precision: float, grams
+        :param timeout: float, seconds to wait for each sample
+        :return: float (grams) or None if the samples did not arrive
+        """
+        ratio = self._scale.get_current_scale_ratio()
+        tolerance = precision * abs(ratio)
+        with self._condition:
+            seen = self._sample_count
+        sequential.begin()
+        while not sequential.done(tolerance):
+            with self._condition:
+                if not self._condition.wait_for(lambda: self._sample_count > seen or not self._running, timeout) \
+                        or self._sample_count <= seen:
+                    return None
+                new = min(self._sample_count - seen, len(self._samples))
+                samples = list(self._samples)[-new:]
+                seen = self._sample_count
+            for _, raw in samples:
+                sequential.add(raw)
+        raw = sequential.end()
+        if raw is None:  # the deadline passed before a sample arrived
+            return None
+        return (raw - self._scale.get_current_offset()) / ratio
+
+    def tare(self, n=10, timeout=None, max_age=None):
+        """
+        Stores the mean of n samples as the offset of the current channel and gain. With max_age, n buffered
+        samples as recent as that are used at once, else n fresh samples are read. Blocks until tared, use
+        submit(lambda scale: sampler.tare_now(n, max_age), ScaleSampler.TARE) not to.
+        :param n: int
+        :param timeout: float, seconds. A tare that has not started by then is cancelled, one that has is waited for
+        :param max_age: float, seconds or None to always read fresh samples
+        :return: True if tared, else False
+        """
+        if not self._running:  # nobody else reads the HX711
+            return self.tare_now(n, max_age)
+        future = self.submit(lambda scale: self.tare_now(n, max_age), ScaleSampler.TARE)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            if not future.cancel():  # the tare is running already, it is not left to land later
+                return future.result()
+            return False
+
+    def tare_now(self, n=10, max_age=None):
+        """
+        tare for commands, on the sampler thread. The fresh samples are read right here, between the conversions
+        of the sampler, and go to the buffer and listeners as usual.
+        :return: True if tared, else False
+        """
+        samples = self.get_samples(n, max_age) if max_age is not None else []
+        if len(samples) < n:
+            acquired = 0
+            for _ in range(n * 2):  # invalid readings are read again, within reason
+                acquired += self._acquire()
+                if acquired >= n:
+                    break
+            if acquired < n:
+                return False
+            samples = self.get_samples(n)
+        raw = self._mean([raw for _, raw in samples])  # filtered like get_raw_estimate, an outlier stays out
+        return self._scale.set_offset(int(round(raw)))
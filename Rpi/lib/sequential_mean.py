@@ -0,0 +1,96 @@
+import math
+import time
+
+
+# SequentialMean decides how many readings a mean needs. Readings are added one at a time (Welford's running
+# mean and variance) until the standard error of their mean falls below the tolerance, within min_samples and
+# max_samples readings and the deadline. The noise of a single reading is pooled with a prior learned from the
+# earlier means that reached the tolerance, so a steady scale stops after 1-2 readings while a swinging one keeps
+# reading. Means cut short by max_samples or the deadline are not learned, their spread is movement, not noise.
+class SequentialMean:
+
+    def __init__(self, min_samples=2, max_samples=20, deadline=None, prior_weight=4, prior_rate=0.25,
+                 clock=time.monotonic):
+        """
+        :param min_samples: int, readings taken at least
+        :param max_samples: int, readings taken at most
+        :param deadline: float, seconds after begin() when the mean is returned however precise it is, or given up
+        without a reading. None waits for max_samples
+        :param prior_weight: float, readings the prior noise is worth when pooled with the noise of a mean
+        :param prior_rate: float (0..1], weight of the noise of the newest mean in the prior
+        :param clock: lambda: float, time source of the deadline
+        """
+        if min_samples < 1:
+            raise ValueError('min_samples has to be at least 1. I have got: ' + str(min_samples))
+        if max_samples < min_samples:
+            raise ValueError('max_samples has to be at least min_samples. I have got: ' + str(max_samples))
+        self._min_samples = min_samples
+        self._max_samples = max_samples
+        self._deadline = deadline
+        self._prior_weight = prior_weight
+        self._prior_rate = prior_rate
+        self._clock = clock
+        self.prior_variance = None  # variance of a single reading, learned from the earlier means
+        self.begin()
+
+    def begin(self):
+        """
+        Starts a new mean
+        :return: void
+        """
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self._started = self._clock()
+        self._precise = False
+
+    def add(self, reading):
+        delta = reading - self.mean
+        self.count += 1
+        self.mean += delta / self.count
+        self._m2 += delta * (reading - self.mean)
+
+    def variance(self):
+        """
+        :return: float, variance of a single reading, the readings of this mean pooled with the prior,
+        or None if neither is known
+        """
+        dof = self.count - 1
+        if self.prior_variance is None:
+            return self._m2 / dof if dof > 0 else None
+        return (self._prior_weight * self.prior_variance + self._m2) / (self._prior_weight + max(dof, 0))
+
+    def standard_error(self):
+        """
+        :return: float, standard error of the mean, math.inf before it can be estimated
+        """
+        variance = self.variance()
+        if variance is None or self.count == 0:
+            return math.inf
+        return math.sqrt(variance / self.count)
+
+    def done(self, tolerance):
+        """
+        :param tolerance: float, largest standard error of the mean, in the unit of the readings
+        :return: True if no more readings are needed
+        """
+        self._precise = self.count >= self._min_samples and self.standard_error() <= tolerance
+        if self._precise or self.count >= self._max_samples:
+            return True
+        # past the deadline without a reading, e.g. the hx711 fails every read, the mean is given up (end is None)
+        return self._deadline is not None and self._clock() - self._started >= self._deadline
+
+    def end(self):
+        """
+        Finishes the mean and learns the noise of its readings into the prior, if it reached the tolerance
+        :return: float or None if no reading was added
+        """
+        if self.count == 0:
+            return None
+        if self._precise and self.count > 1:
+            variance = self._m2 / (self.count - 1)
+            if self.prior_variance is None:
+                self.prior_variance = variance
+            else:
+                self.prior_variance += self._prior_rate * (variance - self.prior_variance)
+        return self.mean
@@ -0,0 +1,90 @@
+import threading
+from collections import deque
+
+
+# SettlingPredictor predicts the weight the platform will settle at while it is still settling after a mount.
+# The samples are averaged in blocks, and the settling is fitted as a damped exponential over the last three
+# block means m0, m1, m2: the differences shrink by a constant ratio r = (m2 - m1) / (m1 - m0) per block, so
+# the final weight is m2 + (m2 - m1) * r / (1 - r) (Aitken extrapolation). A negative r fits a decaying
+# oscillation. The prediction is confident once `agreement` consecutive predictions lie within `tolerance`.
+# update() is called from the sampler thread while the controller reads the prediction, so the state is locked.
+class SettlingPredictor:
+
+    def __init__(self, block_size=3, tolerance=100.0, agreement=3, max_ratio=0.8):
+        """
+        :param block_size: int, samples averaged per block
+        :param tolerance: float, grams, largest spread of the agreeing predictions
+        :param agreement: int, number of consecutive predictions that have to agree
+        :param max_ratio: float, largest |r| extrapolated. Slower settling is only trusted once it is flat
+        """
+        if block_size < 1:
+            raise ValueError('block_size has to be at least 1. I have got: ' + str(block_size))
+        if agreement < 1:
+            raise ValueError('agreement has to be at least 1. I have got: ' + str(agreement))
+        self._block_size = block_size
+        self._tolerance = tolerance
+        self._agreement = agreement
+        self._max_ratio = max_ratio
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets the samples seen, e.g. after a tare
+        :return: void
+        """
+        with self._lock:
+            self._block_sum = 0.0
+            self._block_count = 0
+            self._means = deque(maxlen=3)
+            self._predictions = deque(maxlen=self._agreement)
+            self._prediction = None
+
+    def update(self, weight, timestamp=None):
+        """
+        :param weight: float, grams, one sample converted with the offset and scale ratio in use
+        :param timestamp: float, seconds. Unused, samples are taken to be evenly spaced
+        :return: float, grams, the predicted final weight or None if it is not confident yet
+        """
+        with self._lock:
+            self._block_sum += weight
+            self._block_count += 1
+            if self._block_count < self._block_size:
+                return self._prediction
+            self._means.append(self._block_sum / self._block_count)
+            self._block_sum = 0.0
+            self._block_count = 0
+
+            predicted = self._extrapolate()
+            if predicted is None:
+                self._predictions.clear()
+            else:
+                self._predictions.append(predicted)
+            if (len(self._predictions) == self._agreement and
+                    max(self._predictions) - min(self._predictions) <= self._tolerance):
+                self._prediction = predicted
+            else:
+                self._prediction = None
+            return self._prediction
+
+    def _extrapolate(self):
+        if len(self._means) < 3:
+            return None
+        m0, m1, m2 = self._means
+        d1 = m1 - m0
+        d2 = m2 - m1
+        if d1 != 0:
+            ratio = d2 / d1
+            if abs(ratio) <= self._max_ratio:
+                return m2 + d2 * ratio / (1 - ratio)
+        if abs(d2) <= self._tolerance / 4:
+            return m2  # flat, whatever is left of the settling is within the noise
+        return None  # still moving, e.g. a chair rolling on
+
+    @property
+    def prediction(self):
+        """
+        :return: float, grams or None if the prediction is not confident
+        """
+        with self._lock:
+            return self._prediction
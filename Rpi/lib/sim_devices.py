@@ -0,0 +1,456 @@
+import random
+import struct
+import threading
+import time
+from datetime import date
+from . import nfc_protocol
+
+# Simulated devices for the 'sim' backend of lib/hal.py. SimulatedHX711 and SimulatedLcd are attached to
+# SimulatedGpio pins, SimulatedArduino stands in for the serial port of the NFC reader.
+
+HX711_MAX = 0x7fffff  # 0x7fffff and 0x800000 are the saturated (invalid) readings
+HX711_MIN = -0x800000
+
+
+class SimulatedHX711:
+    # number of clock pulses per read -> (channel, gain) of the next conversion
+    PULSES_TO_MODE = {25: ('A', 128), 26: ('B', 32), 27: ('A', 64)}
+    POWER_DOWN_TIME = 0.00006  # PD_SCK high for 60 us or more powers the chip down
+
+    def __init__(self, dout_pin, pd_sck_pin, source=None, noise=50, sample_rate=10, channel_b_source=None,
+                 invalid_rate=0.0, seed=None, clock=time.monotonic, power_down_time=POWER_DOWN_TIME):
+        """
+        :param source: lambda: int, raw channel A / gain 128 reading without noise. Defaults to the raw_value attribute
+        :param noise: float, standard deviation of the gaussian noise added to every reading
+        :param sample_rate: float, conversions per second (the chip does 10 or 80). None makes every
+            conversion ready immediately, for running on simulated time
+        :param channel_b_source: lambda: int, raw channel B reading. Defaults to source at gain 32
+        :param invalid_rate: float (0..1), probability of a saturated (invalid) reading
+        :param clock: lambda: float, seconds
+        :param power_down_time: float, seconds PD_SCK has to stay high to power the chip down, measured on
+            time.perf_counter. None never powers it down, e.g. on simulated time
+        """
+        self._dout = dout_pin
+        self._pd_sck = pd_sck_pin
+        self.raw_value = 0
+        self.source = source if source is not None else (lambda: self.raw_value)
+        self._channel_b_source = channel_b_source
+        self.noise = noise
+        self.invalid_rate = invalid_rate
+        self._period = 1.0 / sample_rate if sample_rate else 0.0
+        self._random = random.Random(seed)
+        self._clock = clock
+        self.power_down_time = power_down_time
+
+        self._sck = 0
+        self._sck_rose_at = 0.0
+        self._shifting = False
+        self._selecting = False  # the word is shifted out, the pulses selecting the next mode may follow
+        self._word = 0
+        self._ready_word = None  # converted when DOUT is polled low, so no rising edge has to wait for it
+        self._pulses = 25  # the chip powers up on channel A, gain 128
+        self._dout_level = 1
+        self._next_ready = clock() + self._period
+        self.conversions = 0  # number of conversions shifted out
+
+    def set_sample_rate(self, sample_rate):
+        self._period = 1.0 / sample_rate if sample_rate else 0.0
+        self._next_ready = min(self._next_ready, self._clock() + self._period)
+
+    def listen_pins(self):
+        return [self._pd_sck]
+
+    def drive_pins(self):
+        return [self._dout]
+
+    def _convert(self):
+        channel, gain = SimulatedHX711.PULSES_TO_MODE.get(self._pulses, ('A', 128))
+        if self.invalid_rate and self._random.random() < self.invalid_rate:
+            return self._random.choice((HX711_MAX, HX711_MIN)) & 0xffffff
+        if channel == 'B' and self._channel_b_source is not None:
+            value = self._channel_b_source()
+        else:
+            value = self.source() * gain / 128
+        if self.noise:
+            value += self._random.gauss(0, self.noise)
+        value = int(round(value))
+        value = min(max(value, HX711_MIN + 1), HX711_MAX - 1)  # a real chip saturates instead of wrapping
+        return value & 0xffffff  # 24 bit two's complement
+
+    def on_output(self, pin, level):
+        rising = level and not self._sck
+        falling = self._sck and not level
+        self._sck = level
+        if falling and self.power_down_time is not None and \
+                time.perf_counter() - self._sck_rose_at >= self.power_down_time:
+            # powered down: the read in progress is lost and the chip restarts on channel A, gain 128
+            self._shifting = False
+            self._selecting = False
+            self._pulses = 25
+            self._dout_level = 1
+            self._ready_word = None
+            self._next_ready = self._clock() + self._period
+            return
+        if not rising:
+            return
+        self._rise()
+        # stamped after the work of the edge, the simulator's own time is not PD_SCK high time
+        self._sck_rose_at = time.perf_counter()
+
+    def _rise(self):
+        if self._shifting:
+            self._pulses += 1
+            if self._pulses <= 24:
+                self._dout_level = (self._word >> (24 - self._pulses)) & 1
+            else:
+                self._shifting = False
+                self._selecting = True
+                self._dout_level = 1  # DOUT goes high after the 25th pulse until the next conversion is ready
+                self._next_ready = self._clock() + self._period
+        elif self._selecting:
+            # trailing pulses that select the channel and gain of the next conversion, even if it is ready already
+            self._pulses += 1
+            self._selecting = self._pulses < 27
+        elif self._clock() >= self._next_ready:
+            # first pulse of a new read, the previous read's pulse count selected this conversion's mode
+            self._word = self._ready_word if self._ready_word is not None else self._convert()
+            self._ready_word = None
+            self._pulses = 1
+            self._shifting = True
+            self.conversions += 1
+            self._dout_level = (self._word >> 23) & 1
+
+    def read(self, pin):
+        if not self._shifting:
+            self._selecting = False  # DOUT is polled for the next conversion, the word and its pulses are complete
+        return self.level(pin)
+
+    def level(self, pin):
+        # DOUT as an edge detector sees it, which tells the chip nothing, unlike a read of the host
+        if self._shifting:
+            return self._dout_level
+        if self._clock() < self._next_ready:
+            return 1
+        if self._ready_word is None and self._pulses >= 25:
+            self._ready_word = self._convert()  # the conversion is done, the first clock pulse only shifts it out
+        return 0
+
+
+class SimulatedLcd:
+    LINE = [0x00, 0x40, 0x14, 0x54]
+
+    def __init__(self, rs, en, d4, d5, d6, d7, rows=4, cols=20):
+        """
+        Decodes the 4 bit HD44780 bus into a DDRAM screen that can be inspected with screen()
+        """
+        self._rs = rs
+        self._en = en
+        self._data_pins = [d4, d5, d6, d7]
+        self._levels = {pin: 0 for pin in [rs, en, d4, d5, d6, d7]}
+        self._rows = rows
+        self._cols = cols
+        self._high_nibble = None
+        self._address = 0
+        self._cgram_mode = False
+        self._ddram = bytearray([0x20] * 0x80)
+        self.cgram = bytearray(64)
+        self.bytes_received = 0
+        self.commands_received = 0
+
+    def listen_pins(self):
+        return list(self._levels)
+
+    def drive_pins(self):
+        return []
+
+    def on_output(self, pin, level):
+        falling = pin == self._en and self._levels[pin] and not level
+        self._levels[pin] = level
+        if not falling:
+            return
+        nibble = 0
+        for i, data_pin in enumerate(self._data_pins):
+            nibble |= self._levels[data_pin] << i
+        if self._high_nibble is None:
+            self._high_nibble = nibble
+            return
+        byte = (self._high_nibble << 4) | nibble
+        self._high_nibble = None
+        self._receive(byte, bool(self._levels[self._rs]))
+
+    def _receive(self, byte, char_mode):
+        self.bytes_received += 1
+        if char_mode:
+            if self._cgram_mode:
+                self.cgram[self._address & 0x3f] = byte
+            else:
+                self._ddram[self._address & 0x7f] = byte
+            self._address += 1
+            return
+        self.commands_received += 1
+        if byte & 0x80:  # set DDRAM address
+            self._address = byte & 0x7f
+            self._cgram_mode = False
+        elif byte & 0x40:  # set CGRAM address
+            self._address = byte & 0x3f
+            self._cgram_mode = True
+        elif byte == 0x01:  # clear display
+            self._ddram[:] = bytes([0x20] * 0x80)
+            self._address = 0
+            self._cgram_mode = False
+        elif byte == 0x02:  # return home
+            self._address = 0
+            self._cgram_mode = False
+
+    def screen(self):
+        """
+        :return: [bytes], one per row
+        """
+        return [bytes(self._ddram[line:line + self._cols]) for line in SimulatedLcd.LINE[:self._rows]]
+
+
+class SimulatedArduino:
+    DATE_FORMAT = "%d-%m-%Y"
+    RECORD_LIMIT = 4  # MIFARE_ULTRALIGHT_RECORD_LIMIT in the sketch
+
+    FALLBACK_TIME = 2.0  # seconds the sketch waits for the HELLO at the new baud rate before it falls back
+    LINK_TIMEOUT = 10.0  # seconds without a frame from the Pi after which the sketch falls back
+
+    def __init__(self, frame_period=1.0, clock=time.monotonic, protocol_version=nfc_protocol.VERSION):
+        """
+        Serial port of the NFC_read_write sketch. While a tag is present it sends a `:`/`@` tag frame
+        every frame_period seconds and it answers `!weight!` and `@weight,date@` writes. After a handshake
+        it speaks the binary protocol of lib/nfc_protocol.py instead.
+        :param frame_period: float, seconds between tag frames (the sketch loops with delay(1000))
+        :param clock: lambda: float, seconds
+        :param protocol_version: int, binary protocol version of the sketch, None for the legacy text only sketch
+        """
+        self._frame_period = frame_period
+        self.clock = clock
+        self._condition = threading.Condition()
+        self._out = bytearray()  # bytes waiting to be read by the Pi
+        self._in = bytearray()  # bytes written by the Pi, not yet handled
+        self._next_frame = clock()
+        self._tag = None  # [wheelchair_weight, [(weight, date)]]
+        self.is_open = False
+        self.baudrate = 9600
+        self.timeout = None
+        self.written = []  # every command received from the Pi, for inspection
+        self.protocol_version = protocol_version
+        self.link_baudrate = nfc_protocol.LEGACY_BAUDRATE  # baud rate the sketch is talking at
+        self._decoder = None  # FrameDecoder while the binary protocol is in use
+        self._confirmed = False  # the Pi has confirmed the switch with a HELLO
+        self._switched_at = None
+        self._last_frame_at = None  # last valid frame from the Pi in the binary protocol
+
+    # Simulation helpers ###
+    def place_tag(self, wheelchair_weight, history=()):
+        """
+        :param wheelchair_weight: int
+        :param history: [(int, datetime.date)]
+        """
+        with self._condition:
+            self._tag = [wheelchair_weight, list(history)]
+            self._next_frame = self.clock()
+
+    def remove_tag(self):
+        with self._condition:
+            self._tag = None
+
+    def tag_frame(self):
+        if self._tag is None:
+            return None
+        wheelchair_weight, history = self._tag
+        tokens = [':' + str(wheelchair_weight)]
+        tokens += ['@{},{}'.format(weight, day.strftime(SimulatedArduino.DATE_FORMAT)) for weight, day in history]
+        return (' ' + ' '.join(tokens) + '\r\n').encode('ascii')
+
+    def feed(self, data):
+        """
+        Queues raw bytes for the Pi to read, e.g. to inject corrupt lines.
+        """
+        with self._condition:
+            self._out.extend(data)
+            self._condition.notify_all()
+
+    def _pump(self):
+        # called with the condition held, emits the frames that are due
+        if self._tag is not None:
+            now = self.clock()
+            if now >= self._next_frame:
+                frame = self.tag_frame()
+                if self._decoder is not None:
+                    frame = nfc_protocol.encode_frame(nfc_protocol.TAG, 0, frame.rstrip(b'\r\n'))
+                self._send(frame)
+                self._next_frame = now + self._frame_period
+        if self._decoder is not None and not self._confirmed and \
+                self.clock() - self._switched_at > SimulatedArduino.FALLBACK_TIME:
+            self._fall_back()
+        if self._decoder is not None and self._confirmed and \
+                self.clock() - self._last_frame_at > SimulatedArduino.LINK_TIMEOUT:
+            self._fall_back()
+
+    def _send(self, data):
+        if self.baudrate != self.link_baudrate:
+            data = b'\xff' * len(data)  # what a UART makes of bytes sent at another baud rate
+        self._out.extend(data)
+
+    def _fall_back(self):
+        self._decoder = None
+        self._confirmed = False
+        self.link_baudrate = nfc_protocol.LEGACY_BAUDRATE
+
+    def _wait_for(self, predicate, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self._pump()
+            if predicate():
+                return True
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            step = 0.01 if remaining is None else min(0.01, remaining)
+            self._condition.wait(step)
+
+    # serial.Serial interface ###
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    @property
+    def in_waiting(self):
+        with self._condition:
+            self._pump()
+            return len(self._out)
+
+    def read(self, size=1):
+        with self._condition:
+            self._wait_for(lambda: len(self._out) >= size, self.timeout)
+            data = bytes(self._out[:size])
+            del self._out[:size]
+            return data
+
+    def readline(self):
+        with self._condition:
+            self._wait_for(lambda: b'\n' in self._out, self.timeout)
+            end = self._out.find(b'\n')
+            end = len(self._out) if end < 0 else end + 1
+            data = bytes(self._out[:end])
+            del self._out[:end]
+            return data
+
+    def write(self, data):
+        with self._condition:
+            self._in.extend(data)
+            self._handle_commands()
+            self._condition.notify_all()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        with self._condition:
+            del self._out[:]
+
+    def _handle_commands(self):
+        if self.baudrate != self.link_baudrate:
+            del self._in[:]  # garbage at this baud rate
+            return
+        if self._decoder is not None:
+            self._handle_frames()
+            return
+        while self._in:
+            if self._in[0] == 0x16 and self.protocol_version is not None:  # handshake line
+                end = self._in.find(b'\n')
+                if end < 0:
+                    return
+                line = self._in[1:end].decode('ascii', 'replace').split()
+                del self._in[:end + 1]
+                if len(line) == 2 and line[0] == 'RPV{}'.format(self.protocol_version) and line[1].isdigit():
+                    self._send(nfc_protocol.encode_frame(nfc_protocol.HELLO_ACK, 0,
+                                                         struct.pack('<I', int(line[1]))))
+                    self.link_baudrate = int(line[1])
+                    self._decoder = nfc_protocol.FrameDecoder()
+                    self._confirmed = False
+                    self._switched_at = self.clock()
+                    self._last_frame_at = self._switched_at
+                    return
+                continue
+            delimiter = chr(self._in[0])
+            if delimiter not in '!@':
+                del self._in[0]  # the sketch ignores anything else
+                continue
+            end = self._in.find(self._in[0:1], 1)
+            if end < 0:
+                return  # wait for the rest of the command
+            body = self._in[1:end].decode('ascii', 'replace')
+            del self._in[:end + 1]
+            self.written.append(delimiter + body + delimiter)
+            success = self._write_tag(delimiter, body)
+            if success is not None:
+                self._send(b'NFC tag successfully written!\r\n' if success else b'Write failed\r\n')
+
+    def _handle_frames(self):
+        frames = self._decoder.feed(self._in)
+        del self._in[:]
+        for frame in frames:
+            self._last_frame_at = self.clock()
+            if frame.type == nfc_protocol.HELLO:
+                self._confirmed = True
+                self._send(nfc_protocol.encode_frame(nfc_protocol.HELLO_ACK, frame.seq, frame.payload))
+                continue
+            if frame.type == nfc_protocol.WRITE_WHEELCHAIR_WEIGHT and len(frame.payload) == 4:
+                delimiter, body = '!', str(struct.unpack('<i', frame.payload)[0])
+            elif frame.type == nfc_protocol.WRITE_PATIENT_WEIGHT and len(frame.payload) == 8:
+                weight, day, month, year = struct.unpack('<iBBH', frame.payload)
+                delimiter, body = '@', '{},{:02}-{:02}-{}'.format(weight, day, month, year)
+            else:
+                continue
+            self.written.append(delimiter + body + delimiter)
+            success = self._write_tag(delimiter, body)
+            if success is not None:
+                status = nfc_protocol.RESULT_OK if success else nfc_protocol.RESULT_FAILED
+                self._send(nfc_protocol.encode_frame(nfc_protocol.WRITE_RESULT, frame.seq, bytes([status])))
+
+    def _write_tag(self, delimiter, body):
+        """
+        :return: True if written, False if the write failed, None if there is no tag to answer for
+        """
+        if self._tag is None:
+            return None  # the sketch only answers when a tag is present
+        success = True
+        try:
+            if delimiter == '!':
+                self._tag[0] = int(body)
+            elif len(self._tag[1]) + 1 >= SimulatedArduino.RECORD_LIMIT:
+                success = False
+            else:
+                weight, day = body.split(',')
+                self._tag[1].append((int(weight), date(*reversed([int(x) for x in day.split('-')]))))
+        except ValueError:
+            success = False
+        return success
+
+
+# SimulatedRig wires a full set of simulated devices for RolliePollie onto the 'sim' backend
+class SimulatedRig:
+
+    def __init__(self, data_pin, clock_pin, lcd_pins, nfc_port, noise=50, sample_rate=10, frame_period=1.0,
+                 array_data_pins=()):
+        """
+        :param lcd_pins: (rs, en, d4, d5, d6, d7)
+        :param array_data_pins: [int] DOUT pins of the HX711s of a load cell array, clocked by clock_pin
+        """
+        from . import hal
+        if hal.get_backend() != 'sim':
+            hal.select_backend('sim')
+        self.gpio = hal.get_gpio()
+        self.hx711 = self.gpio.attach(SimulatedHX711(data_pin, clock_pin, noise=noise, sample_rate=sample_rate))
+        self.cells = [self.gpio.attach(SimulatedHX711(pin, clock_pin, noise=noise, sample_rate=sample_rate))
+                      for pin in array_data_pins]
+        self.lcd = self.gpio.attach(SimulatedLcd(*lcd_pins))
+        self.arduino = SimulatedArduino(frame_period=frame_period)
+        hal.register_serial(nfc_port, self.arduino)
@@ -0,0 +1,225 @@
+import time
+from collections import namedtuple
+from enum import Enum
+from types import SimpleNamespace
+
+
+# SimulatedGpio implements the part of the RPi.GPIO interface used by this project. Simulated devices
+# (see lib/sim_devices.py) are attached to pins: they are told about every output change on their pins
+# and answer input reads on the pins they drive.
+class SimulatedGpio:
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        self._mode = None
+        self._levels = {}  # pin -> level last written or pulled to
+        self._listeners = {}  # pin -> [device], notified on output changes
+        self._drivers = {}  # pin -> device, answers input reads
+        self._event_callbacks = {}  # pin -> (edge, callback)
+        self.output_count = 0  # number of output calls, useful to measure GPIO traffic
+
+    def attach(self, device):
+        """
+        :param device: object with listen_pins(), drive_pins(), on_output(pin, level), read(pin) and, if it drives
+        pins, level(pin)
+        :return: device
+        """
+        for pin in device.listen_pins():
+            self._listeners.setdefault(pin, []).append(device)
+        for pin in device.drive_pins():
+            self._drivers[pin] = device
+        return device
+
+    def detach_all(self):
+        self._listeners.clear()
+        self._drivers.clear()
+
+    # RPi.GPIO interface ###
+    def setmode(self, mode):
+        self._mode = mode
+
+    def getmode(self):
+        return self._mode
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=PUD_OFF, initial=None):
+        if direction == SimulatedGpio.IN:
+            self._levels[pin] = 0 if pull_up_down == SimulatedGpio.PUD_DOWN else 1
+        else:
+            self._levels[pin] = 0 if initial is None else int(bool(initial))
+
+    def output(self, pin, value):
+        level = 1 if value else 0
+        self._levels[pin] = level
+        self.output_count += 1
+        listeners = self._listeners.get(pin)
+        if listeners:
+            for device in listeners:
+                device.on_output(pin, level)
+
+    def input(self, pin):
+        driver = self._drivers.get(pin)
+        if driver is not None:
+            return driver.read(pin)
+        return self._levels.get(pin, 0)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self._event_callbacks[pin] = (edge, callback)
+
+    def remove_event_detect(self, pin):
+        self._event_callbacks.pop(pin, None)
+
+    def cleanup(self, *pins):
+        if pins:
+            for pin in pins:
+                self._levels.pop(pin, None)
+                self._event_callbacks.pop(pin, None)
+        else:
+            self._levels.clear()
+            self._event_callbacks.clear()
+
+    # Simulation helpers ###
+    def level(self, pin):
+        """
+        Level of an input pin without reading it, e.g. for sampling edges
+        """
+        driver = self._drivers.get(pin)
+        if driver is not None:
+            return driver.level(pin)
+        return self._levels.get(pin, 0)
+
+    def press(self, pin):
+        """
+        Simulates a push button wired to ground: the pin falls, the callback fires, then it is released.
+        :return: True if a callback was bound to the pin
+        """
+        self._levels[pin] = 0
+        edge, callback = self._event_callbacks.get(pin, (None, None))
+        if callback is not None and edge in (SimulatedGpio.FALLING, SimulatedGpio.BOTH):
+            callback(pin)
+        self._levels[pin] = 1
+        return callback is not None
+
+
+# The part of the libgpiod 2 python bindings (gpiod.request_lines) used by lib/gpiod_transport.py, with the lines
+# of a request being the pins of a SimulatedGpio. The kernel timestamps edges as they happen, here the input
+# lines are sampled for edges whenever the request is used or waited on, which the simulated devices allow
+# since they only change their outputs on clock pulses or with time.
+class SimulatedGpiod:
+
+    class Direction(Enum):
+        AS_IS = 1
+        INPUT = 2
+        OUTPUT = 3
+
+    class Edge(Enum):
+        NONE = 1
+        RISING = 2
+        FALLING = 3
+        BOTH = 4
+
+    class Value(Enum):
+        INACTIVE = 0
+        ACTIVE = 1
+
+    EdgeEvent = namedtuple('EdgeEvent', 'event_type timestamp_ns line_offset')
+
+    class LineSettings:
+
+        def __init__(self, direction=None, edge_detection=None, output_value=None, **kwargs):
+            self.direction = direction
+            self.edge_detection = edge_detection
+            self.output_value = output_value
+
+    POLL_INTERVAL = 0.0005  # seconds between samples of the input lines while waiting for an edge
+
+    def __init__(self, gpio):
+        """
+        :param gpio: SimulatedGpio
+        """
+        self._gpio = gpio
+        self.line = SimpleNamespace(Direction=SimulatedGpiod.Direction, Edge=SimulatedGpiod.Edge,
+                                    Value=SimulatedGpiod.Value)
+
+    def request_lines(self, path, consumer=None, config=None, **kwargs):
+        """
+        :param path: String, e.g. '/dev/gpiochip0', all lines are simulated pins whatever the chip
+        :param config: {offset or tuple of offsets: LineSettings}
+        :return: SimulatedLineRequest
+        """
+        settings = {}
+        for offsets, line_settings in (config or {}).items():
+            for offset in (offsets if isinstance(offsets, tuple) else (offsets,)):
+                settings[offset] = line_settings
+        return SimulatedLineRequest(self._gpio, settings)
+
+
+class SimulatedLineRequest:
+
+    def __init__(self, gpio, settings):
+        self._gpio = gpio
+        self._edges = {}  # offset -> (edge, last sampled level)
+        self._events = []
+        for offset, line_settings in settings.items():
+            if line_settings.direction == SimulatedGpiod.Direction.OUTPUT:
+                gpio.setup(offset, SimulatedGpio.OUT, initial=line_settings.output_value == SimulatedGpiod.Value.ACTIVE)
+            else:
+                gpio.setup(offset, SimulatedGpio.IN)
+                if line_settings.edge_detection not in (None, SimulatedGpiod.Edge.NONE):
+                    self._edges[offset] = (line_settings.edge_detection, gpio.level(offset))
+
+    def _sample_edges(self):
+        for offset, (edge, last) in self._edges.items():
+            level = self._gpio.level(offset)
+            if level != last:
+                self._edges[offset] = (edge, level)
+                rising = SimulatedGpiod.Edge.RISING if level else SimulatedGpiod.Edge.FALLING
+                if edge in (rising, SimulatedGpiod.Edge.BOTH):
+                    self._events.append(SimulatedGpiod.EdgeEvent(rising, int(time.monotonic() * 1e9), offset))
+
+    def set_value(self, offset, value):
+        self._gpio.output(offset, value == SimulatedGpiod.Value.ACTIVE)
+        self._sample_edges()
+
+    def get_value(self, offset):
+        self._sample_edges()
+        return SimulatedGpiod.Value.ACTIVE if self._gpio.input(offset) else SimulatedGpiod.Value.INACTIVE
+
+    def get_values(self, offsets=None):
+        return [self.get_value(offset) for offset in (offsets if offsets is not None else self._edges)]
+
+    def wait_edge_events(self, timeout=None):
+        """
+        :param timeout: float, seconds or None to wait forever
+        :return: True if an edge event is waiting
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._sample_edges()
+        while not self._events:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(SimulatedGpiod.POLL_INTERVAL)
+            self._sample_edges()
+        return True
+
+    def read_edge_events(self, max_events=None):
+        events = self._events
+        self._events = []
+        return events
+
+    def release(self):
+        self._edges.clear()
+        self._events = []
@@ -0,0 +1,114 @@
+import time
+from collections import deque
+
+
+# StabilityWindow decides whether a stream of weights is stable, i.e. every weight in the window lies within
+# max_deviation of the window mean. It keeps a running sum and monotonic min/max deques, so each new weight
+# costs amortised O(1) regardless of the window size.
+class StabilityWindow:
+
+    def __init__(self, max_deviation, size=5, duration=None, clock=time.monotonic):
+        """
+        The window holds either the last `size` weights, or when duration is given, every weight from
+        the last `duration` seconds.
+        :param max_deviation: float, largest allowed distance of any weight from the window mean
+        :param size: int, number of weights in a count based window
+        :param duration: float, seconds covered by a time based window. Overrides size
+        :param clock: lambda: float, time source for time based windows
+        """
+        if duration is None and size < 1:
+            raise ValueError('size has to be at least 1. I have got: ' + str(size))
+        self._max_deviation = max_deviation
+        self._size = size
+        self._duration = duration
+        self._clock = clock
+        self.reset()
+
+    def reset(self):
+        self._window = deque()  # (sequence_number, timestamp, weight)
+        self._min_deque = deque()  # (sequence_number, weight), weights increasing
+        self._max_deque = deque()  # (sequence_number, weight), weights decreasing
+        self._sum = 0.0
+        self._sequence = 0
+
+    def __len__(self):
+        return len(self._window)
+
+    @property
+    def mean(self):
+        return self._sum / len(self._window) if self._window else None
+
+    @property
+    def minimum(self):
+        return self._min_deque[0][1] if self._min_deque else None
+
+    @property
+    def maximum(self):
+        return self._max_deque[0][1] if self._max_deque else None
+
+    def is_full(self):
+        """
+        The weights of a time based window are spread over its duration less one sample interval: n weights
+        from its oldest one on cover n intervals. After a gap in the weights only the fresh ones are counted.
+        :return: True once the window covers its whole size or duration
+        """
+        count = len(self._window)
+        if self._duration is None:
+            return count >= self._size
+        if count < 2:
+            return False
+        span = self._window[-1][1] - self._window[0][1]
+        return span * count / (count - 1) >= self._duration * (1 - 1e-9)  # 1e-9, timestamps are floats
+
+    def add(self, weight, timestamp=None):
+        """
+        Adds a weight to the window and evicts the weights that fall out of it.
+        :param weight: float
+        :param timestamp: float, defaults to the clock. Only used by time based windows
+        :return: True if the window is full and stable, else False
+        """
+        if self._duration is not None and timestamp is None:
+            timestamp = self._clock()
+
+        sequence = self._sequence
+        self._sequence += 1
+        self._window.append((sequence, timestamp, weight))
+        self._sum += weight
+
+        while self._min_deque and self._min_deque[-1][1] >= weight:
+            self._min_deque.pop()
+        self._min_deque.append((sequence, weight))
+        while self._max_deque and self._max_deque[-1][1] <= weight:
+            self._max_deque.pop()
+        self._max_deque.append((sequence, weight))
+
+        if self._duration is None:
+            while len(self._window) > self._size:
+                self._evict()
+        else:
+            oldest = timestamp - self._duration
+            while self._window[0][1] < oldest:
+                self._evict()
+
+        return self.is_stable()
+
+    def _evict(self):
+        sequence, _, weight = self._window.popleft()
+        self._sum -= weight
+        if self._min_deque[0][0] == sequence:
+            self._min_deque.popleft()
+        if self._max_deque[0][0] == sequence:
+            self._max_deque.popleft()
+        if not self._window:
+            self._sum = 0.0  # drops accumulated rounding error
+
+    def is_stable(self):
+        """
+        Equivalent to checking every weight against the mean, since only the extremes can be furthest from it.
+        :return: True if the window is full and every weight is within max_deviation of the mean
+        """
+        if not self.is_full():
+            return False
+        mean = self._sum / len(self._window)
+        return self._max_deque[0][1] - mean <= self._max_deviation and \
+            mean - self._min_deque[0][1] <= self._max_deviation
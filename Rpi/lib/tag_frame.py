@@ -0,0 +1,57 @@
+from datetime import date
+from functools import lru_cache
+from .tag_data import TagData
+
+# Parser of the tag frames sent by the NFC_read_write sketch, e.g. b'\x02 :15000 @70500,01-05-2024\r\n'
+#   :<wheelchair weight>            the first one counts
+#   @<patient weight>,<dd-mm-YYYY>  weight history, in the order it was written. The sketch stores it with
+#                                   PATIENT_WEIGHT_PREFIX ' @', tags written with '^' are read as well
+# Other tokens are ignored. The same frame is sent every second while a chair is parked on the reader,
+# so parsed frames are memoized on their raw bytes.
+
+FRAME_CACHE_SIZE = 64
+DATE_CACHE_SIZE = 256
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_date(text):
+    """
+    :param text: String, dd-mm-YYYY
+    :return: datetime.date
+    :raises ValueError: if text is not a valid date
+    """
+    day, month, year = text.split('-')
+    if len(day) > 2 or len(month) > 2 or len(year) != 4:
+        raise ValueError('date has to be dd-mm-YYYY. I have got: ' + text)
+    return date(int(year), int(month), int(day))
+
+
+@lru_cache(maxsize=FRAME_CACHE_SIZE)
+def parse_tag_frame(frame):
+    """
+    The returned TagData is shared by every caller parsing the same bytes, it must not be modified.
+    :param frame: Byte String, one line as it came from the serial port
+    :return: TagData or None if the frame is not a valid tag
+    """
+    try:
+        text = frame.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+
+    wheelchair_weight = None
+    weight_history = []
+    try:
+        for token in text.replace('\x02', '').split():  # \x02, start of line control character
+            prefix = token[0]
+            if prefix == ':':
+                if wheelchair_weight is None:
+                    wheelchair_weight = float(token[1:])
+            elif prefix == '@' or prefix == '^':
+                weight, history = token[1:].split(',')
+                weight_history.append((float(weight), parse_date(history)))
+    except ValueError:
+        return None  # a corrupt frame is rejected rather than mis-parsed
+
+    if wheelchair_weight is None:
+        return None
+    return TagData(wheelchair_weight, weight_history)
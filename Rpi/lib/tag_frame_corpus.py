@@ -0,0 +1,69 @@
+from datetime import datetime
+from .tag_data import TagData
+
+# Tag frames as the NFC_read_write sketch sends them, and malformed ones seen on the line.
+# VALID entries are (frame, expected), expected is (wheelchair_weight, [(weight, 'dd-mm-YYYY')]).
+# MALFORMED frames have to be rejected. parse_previous is the parser tag_frame replaced, the reference the fuzz
+# test and the benchmark compare it with.
+
+VALID = [
+    (b' :15000\r\n', (15000.0, [])),
+    (b'\x02 :15000\r\n', (15000.0, [])),
+    (b'\x02en :15000\r\n', (15000.0, [])),  # text record prefix of the NDEF library
+    (b' :15000 ^70500,01-05-2024\r\n', (15000.0, [(70500.0, '01-05-2024')])),
+    (b'\x02 :15000\x02 ^70500,01-05-2024\x02 ^70420,02-05-2024\r\n',
+     (15000.0, [(70500.0, '01-05-2024'), (70420.0, '02-05-2024')])),
+    (b' ^70500,01-05-2024 :15000\r\n', (15000.0, [(70500.0, '01-05-2024')])),  # history record written first
+    (b' :15000 ^70500,01-05-2024 ^70420,02-05-2024 ^69980,15-06-2024\r\n',
+     (15000.0, [(70500.0, '01-05-2024'), (70420.0, '02-05-2024'), (69980.0, '15-06-2024')])),
+    (b' :15000 :16000\r\n', (15000.0, [])),  # only the first wheelchair weight counts
+    (b' :18250.5\n', (18250.5, [])),
+    (b' :-120 ^0,31-12-2023\r\n', (-120.0, [(0.0, '31-12-2023')])),
+    (b' :15000 @70500,01-05-2024\r\n', (15000.0, [(70500.0, '01-05-2024')])),  # PATIENT_WEIGHT_PREFIX of the sketch
+    (b' :15000 @70500,01-05-2024 ^70420,02-05-2024\r\n',
+     (15000.0, [(70500.0, '01-05-2024'), (70420.0, '02-05-2024')])),
+    (b'\t:15000\t^70500,1-5-2024\r\n', (15000.0, [(70500.0, '01-05-2024')])),
+]
+
+MALFORMED = [
+    b'',
+    b'\r\n',
+    b'NFC tag successfully written!\r\n',
+    b'Write failed\r\n',
+    b'\x02\r\n',
+    b' ^70500,01-05-2024\r\n',  # no wheelchair weight
+    b' :\r\n',
+    b' :abc\r\n',
+    b' :15000 ^70500\r\n',
+    b' :15000 @70500\r\n',
+    b' :15000 @70500,01-13-2024\r\n',
+    b' :15000 ^70500,01-05\r\n',
+    b' :15000 ^70500,32-01-2024\r\n',
+    b' :15000 ^70500,01-13-2024\r\n',
+    b' :15000 ^70500,01-05-24\r\n',
+    b' :15000 ^,01-05-2024\r\n',
+    b' :15000 ^70500,01-05-2024,extra\r\n',
+    b' :15\xff000\r\n',
+    b'\xff\xfe corrupt\r\n',
+    b' :15000 ^70\x80500,01-05-2024\r\n',
+]
+
+
+def parse_previous(byte_string):
+    """
+    The previous SerialNfc._parse: two scans of the token list and strptime per history entry, with the strptime
+    arguments in the right order, without its print and reading the '@' history of the sketch like '^'
+    """
+    try:
+        string_arr = byte_string.decode("utf-8").replace("\x02", "").split()
+    except UnicodeDecodeError:
+        return None
+    wheelchair_weight = ([float(w.replace(':', '')) for w in string_arr if w[0] == ':'] + [None])[0]
+    weight_history = []
+    for w in string_arr:
+        if w[0] in '^@':
+            pair = w.replace('^', '').replace('@', '').split(',')
+            weight_history.append((float(pair[0]), datetime.strptime(pair[1], "%d-%m-%Y").date()))
+    if wheelchair_weight is None:
+        return None
+    return TagData(wheelchair_weight, weight_history)
@@ -0,0 +1,109 @@
+import functools
+import json
+import os
+import threading
+import time
+
+
+# Tracer records spans, a name, a category, when it started and how long it took on which thread, into a ring
+# buffer allocated up front. The oldest spans are overwritten, so it always holds the last few seconds of the
+# control loop and can be exported at any time in the Chrome trace event format, for chrome://tracing or
+# https://ui.perfetto.dev. While disabled a span costs one attribute check.
+class Tracer:
+
+    def __init__(self, capacity=8192, clock=time.perf_counter):
+        """
+        :param capacity: int, spans kept in memory
+        :param clock: lambda: float, seconds
+        """
+        if capacity < 1:
+            raise ValueError('capacity has to be at least 1. I have got: ' + str(capacity))
+        self._capacity = capacity
+        self._spans = [['', '', 0.0, 0.0, 0] for _ in range(capacity)]  # name, category, start, duration, thread
+        self._written = 0  # spans ever recorded, the next one goes to _written % capacity
+        self._lock = threading.Lock()
+        self.clock = clock
+        self.enabled = True
+
+    def begin(self):
+        """
+        :return: float, start of a span for end, None while disabled
+        """
+        return self.clock() if self.enabled else None
+
+    def end(self, name, category, start):
+        """
+        Records a span from start until now
+        :param name: String, e.g. 'next_weight'
+        :param category: String, e.g. 'loop'
+        :param start: float from begin, None records nothing
+        :return: void
+        """
+        if start is None:
+            return
+        duration = self.clock() - start
+        thread = threading.get_ident()
+        with self._lock:
+            span = self._spans[self._written % self._capacity]
+            span[0] = name
+            span[1] = category
+            span[2] = start
+            span[3] = duration
+            span[4] = thread
+            self._written += 1
+
+    def spans(self):
+        """
+        :return: [(name, category, start, duration, thread)] oldest first
+        """
+        with self._lock:
+            return [tuple(self._spans[i % self._capacity])
+                    for i in range(max(0, self._written - self._capacity), self._written)]
+
+    def clear(self):
+        with self._lock:
+            self._written = 0
+
+    def export_chrome(self, stream):
+        """
+        Writes the spans as complete ('X') events in the Chrome trace event format, with the names of the
+        threads that recorded them
+        :param stream: file like object
+        :return: int, number of spans written
+        """
+        spans = self.spans()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        pid = os.getpid()
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread,
+                   'args': {'name': names.get(thread, str(thread))}}
+                  for thread in sorted(set(span[4] for span in spans))]
+        events.extend({'name': name, 'cat': category, 'ph': 'X', 'ts': round(start * 1e6, 3),
+                       'dur': round(duration * 1e6, 3), 'pid': pid, 'tid': thread}
+                      for name, category, start, duration, thread in spans)
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, stream)
+        return len(spans)
+
+
+TRACER = Tracer()  # the spans of the whole process
+
+
+def traced(name=None, category='function'):
+    """
+    Decorator recording a span for every call of the decorated function, e.g. @traced(category='hx711')
+    :param name: String, the qualified name of the function if None
+    :param category: String
+    """
+    def decorate(function):
+        span = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return function(*args, **kwargs)
+            start = TRACER.clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                TRACER.end(span, category, start)
+        return wrapper
+    return decorate
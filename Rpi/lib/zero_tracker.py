@@ -0,0 +1,48 @@
+# ZeroTracker follows the slow drift of the empty scale, so an empty platform keeps reading 0.0 kg through a
+# clinic day without anyone pressing tare. Only stable weights of an empty platform within band of zero are drift,
+# they are smoothed and once the drift reaches step it is handed back as a correction of the zero. The corrections
+# since the last tare are limited, a load put on slowly enough is not zeroed away.
+class ZeroTracker:
+
+    def __init__(self, band=200, step=20, limit=2000, smoothing=0.2):
+        """
+        :param band: float, grams, largest weight of an empty platform that counts as drift
+        :param step: float, grams of drift before the zero is corrected
+        :param limit: float, grams the zero may be corrected by in total between two tares
+        :param smoothing: float (0..1], weight of the newest weight in the smoothed drift
+        """
+        self._band = band
+        self._step = step
+        self._limit = limit
+        self._smoothing = smoothing
+        self.reset()
+
+    def reset(self):
+        """
+        Starts over after a tare
+        :return: void
+        """
+        self._drift = None
+        self.correction = 0.0  # grams the zero has been corrected by since the last tare
+        self.corrections = 0
+
+    def update(self, weight, empty):
+        """
+        :param weight: float, grams
+        :param empty: bool, the platform is empty and the weight is stable
+        :return: float, grams to take off the zero, 0 if it stays
+        """
+        if not empty or abs(weight) > self._band:
+            self._drift = None  # drift is only smoothed over consecutive weights of an empty platform
+            return 0.0
+        if self._drift is None:
+            self._drift = weight
+        else:
+            self._drift += self._smoothing * (weight - self._drift)
+        if abs(self._drift) < self._step or abs(self.correction + self._drift) > self._limit:
+            return 0.0
+        drift = self._drift
+        self._drift = None  # the weights from here on are read against the corrected zero
+        self.correction += drift
+        self.corrections += 1
+        return drift
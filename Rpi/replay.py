@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# Replays a capture (see CAPTURE_PATH in config.py) through the HX711 conversion, the ScaleObserver and the
+# RolliePollie decision logic on a simulated clock, without any hardware. By default it runs as fast as it can,
+# so a day of clinic traffic is re-evaluated in seconds.
+# Usage: python3 replay.py capture.bin [--speed N] [--readings N | --precision G] [--estimator mean|kalman] [--predict]
+#                          [--verbose]
+import argparse
+import contextlib
+import io
+import time
+from collections import deque
+from lib.arduino_nfc import SerialNfc
+from lib.capture import CaptureReader, Sample, SerialLine, Calibration
+from lib.filters import make_chain
+from lib.hx711 import HX711
+from lib.kalman_estimator import KalmanWeightEstimator
+from lib.lcd_display import LcdDisplay
+from lib import fast_stats
+from lib import ring_log
+from lib.nfc_write_queue import NfcWriteQueue
+from lib.scale_observer import ScaleObserver
+from lib.sequential_mean import SequentialMean
+from lib.settling_predictor import SettlingPredictor
+from rollie_pollie import RolliePollie
+from config import (
+    NUMBER_OF_READINGS, SAMPLE_BUFFER_SIZE, WEIGHT_ESTIMATOR, CHANNEL, GAIN, HX711_FILTERS,
+    SAMPLE_PRECISION, SAMPLE_MIN_READINGS, SAMPLE_MAX_READINGS, SAMPLE_DEADLINE,
+    KALMAN_MEASUREMENT_NOISE, KALMAN_PROCESS_NOISE, KALMAN_SETTLED_DEVIATION, KALMAN_SETTLED_RATE,
+    SETTLING_PREDICTION, PREDICTION_BLOCK_SIZE, PREDICTION_TOLERANCE, PREDICTION_AGREEMENT,
+    RS_PIN, EN_PIN, D4_PIN, D5_PIN, D6_PIN, D7_PIN)
+
+
+# _ReplaySerial stands in for the Arduino. It hands out the captured lines once they are due and keeps the writes.
+class _ReplaySerial:
+
+    def __init__(self):
+        self.lines = deque()
+        self.written = []
+
+    @property
+    def in_waiting(self):
+        return len(self.lines[0]) if self.lines else 0
+
+    def readline(self):
+        return self.lines.popleft() if self.lines else b''
+
+    def write(self, data):
+        self.written.append(data)
+        return len(data)
+
+    def close(self):
+        pass
+
+
+# ReplayController is the RolliePollie controller without the hardware. The display is recorded instead of drawn.
+class ReplayController(RolliePollie):
+
+    def __init__(self, clock, estimator=None, predictor=None):
+        """
+        :param clock: lambda: float, simulated time of the replay
+        :param estimator: KalmanWeightEstimator or None to average NUMBER_OF_READINGS samples
+        :param predictor: SettlingPredictor or None
+        """
+        self._clock = clock
+        self._estimator = estimator
+        self._predictor = predictor
+        self._load_cells = None  # a capture holds the words of a single hx711
+        self._zero_tracker = None  # the corrections of the zero are recorded as calibrations in the capture
+        self._serial = _ReplaySerial()
+        self._ser_nfc = SerialNfc(None, ser=self._serial)
+        self._write_queue = NfcWriteQueue(self._ser_nfc, clock=clock)  # serviced by the engine, not a thread
+        self._ser_nfc.on_write_result(self._write_queue.acknowledge)
+        self._observer = ScaleObserver(clock=clock)
+        self._memoized_tag_data = None
+        self._capture = None
+        self.lcd = LcdDisplay(RS_PIN, EN_PIN, D4_PIN, D5_PIN, D6_PIN, D7_PIN)  # never initialised, keeps the flags
+        self.displayed = []  # (time, grams)
+        self._bind_observer_callbacks()
+
+    def output_weight_g_to_kg(self, weight, decimal_points=1):
+        self.displayed.append((self._clock(), weight))
+
+
+# ReplayEngine feeds the records of a capture to a ReplayController the way the control loop would have seen them.
+class ReplayEngine:
+
+    def __init__(self, path, readings=NUMBER_OF_READINGS, speed=None, estimator=WEIGHT_ESTIMATOR,
+                 predict=SETTLING_PREDICTION, precision=SAMPLE_PRECISION):
+        """
+        :param path: String, capture file
+        :param readings: int, samples averaged per weight, like NUMBER_OF_READINGS
+        :param precision: float, grams, averages samples to this precision instead, like SAMPLE_PRECISION
+        :param speed: float, times real speed or None to run as fast as possible
+        :param estimator: String, 'mean' or 'kalman', like WEIGHT_ESTIMATOR
+        :param predict: bool, predict the settled weight, like SETTLING_PREDICTION
+        """
+        self._reader = CaptureReader(path)
+        self._readings = readings
+        self._speed = speed
+        self.now = 0.0
+        self._precision = precision
+        self._sequential = None
+        if precision is not None:
+            self._sequential = SequentialMean(SAMPLE_MIN_READINGS, SAMPLE_MAX_READINGS, SAMPLE_DEADLINE,
+                                              clock=lambda: self.now)
+        self._estimator = None
+        if estimator == 'kalman':
+            self._estimator = KalmanWeightEstimator(KALMAN_MEASUREMENT_NOISE, KALMAN_PROCESS_NOISE,
+                                                    KALMAN_SETTLED_DEVIATION, KALMAN_SETTLED_RATE)
+        self._predictor = None
+        if predict:
+            self._predictor = SettlingPredictor(PREDICTION_BLOCK_SIZE, PREDICTION_TOLERANCE, PREDICTION_AGREEMENT)
+        self.controller = ReplayController(lambda: self.now, self._estimator, self._predictor)
+        self.weighings = []  # (time, total_weight, wheelchair_weight)
+        self.predicted_weighings = []  # (time, predicted_weight, wheelchair_weight)
+        self.mounts = []
+        self.dismounts = []
+        self.samples = 0
+        self.invalid_samples = 0
+        self.serial_lines = 0
+
+    def run(self):
+        """
+        :return: void
+        """
+        observer = self.controller._observer
+        # permanent callbacks only get the total weight, the wheelchair weight is the one of the observed tag
+        observer.on_successful_weighing(lambda total_weight: self.weighings.append(
+            (self.now, total_weight, 0 if observer.tag_data is None else observer.tag_data.wheelchair_weight)))
+        observer.on_predicted_weighing(lambda predicted_weight: self.predicted_weighings.append(
+            (self.now, predicted_weight, 0 if observer.tag_data is None else observer.tag_data.wheelchair_weight)))
+        observer.on_scale_mount(lambda: self.mounts.append(self.now))
+        observer.on_scale_dismount(lambda: self.dismounts.append(self.now))
+
+        calibrations = {}  # (channel, gain) -> (offset, scale_ratio)
+        window = deque(maxlen=SAMPLE_BUFFER_SIZE)  # raw samples of the current mode, like the sampler buffer
+        window_mode = None
+        new_samples = 0
+        # the samples of CHANNEL and GAIN went through the HX711_FILTERS chain before the sampler buffered them
+        filter_chain = make_chain(HX711_FILTERS) if HX711_FILTERS else None
+        filtered_mode = (CHANNEL, GAIN if CHANNEL == 'A' else 32)
+        if self._sequential is not None:
+            self._sequential.begin()
+        started = time.monotonic()
+        for record in self._reader:
+            self.now = record.timestamp
+            if self._speed:
+                delay = record.timestamp / self._speed - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+            if isinstance(record, SerialLine):
+                self.serial_lines += 1
+                self.controller._serial.lines.append(record.line)
+                self.controller._write_queue.service()
+            elif isinstance(record, Calibration):
+                calibrations[(record.channel, record.gain)] = (record.offset, record.scale_ratio)
+                if self._estimator is not None:
+                    self._estimator.reset()  # a tare, every weight moved with the offset
+                if self._predictor is not None:
+                    self._predictor.reset()
+            elif isinstance(record, Sample):
+                self.samples += 1
+                raw = HX711.convert_data(record.raw) if record.valid else False
+                if raw is False:
+                    self.invalid_samples += 1
+                    continue
+                mode = (record.channel, record.gain)
+                if mode not in calibrations:
+                    continue  # reset and zeroing at start up, the controller did not read these
+                if mode != window_mode:
+                    window.clear()
+                    window_mode = mode
+                    new_samples = 0
+                    if self._sequential is not None:
+                        self._sequential.begin()
+                if filter_chain is not None and mode == filtered_mode:
+                    raw = filter_chain.update(raw)
+                window.append(raw)
+                offset, scale_ratio = calibrations[mode]
+                if self._estimator is not None:
+                    self._estimator.update((raw - offset) / scale_ratio, record.timestamp)
+                if self._predictor is not None:
+                    self._predictor.update((raw - offset) / scale_ratio, record.timestamp)
+                new_samples += 1
+                # the weight is updated when RolliePollie.next_weight would have returned
+                total_weight = None
+                if self._estimator is not None:
+                    estimate = self._estimator.snapshot()
+                    total_weight, settled = estimate.weight, estimate.settled
+                elif self._sequential is not None:
+                    self._sequential.add(raw)
+                    if self._sequential.done(self._precision * abs(scale_ratio)):
+                        total_weight, settled = (self._sequential.end() - offset) / scale_ratio, None
+                        self._sequential.begin()
+                elif new_samples >= self._readings:
+                    new_samples = 0
+                    recent = list(window)[-self._readings:]
+                    # averaged within one pstdev like ScaleSampler.get_raw_estimate, the pstdev filter is on by default
+                    mean = fast_stats.filtered_mean(recent, max_pstdev=100)[0] if len(recent) > 2 \
+                        else fast_stats.mean(recent)
+                    total_weight, settled = (mean - offset) / scale_ratio, None
+                if total_weight is not None:
+                    tag_data = self.controller._ser_nfc.get_weight()
+                    weight_in_grams = self.controller.process_reading(total_weight, tag_data, settled)
+                    self.controller.output_weight_g_to_kg(weight_in_grams)
+                    self.controller._write_queue.service()
+
+    def report(self):
+        """
+        :return: String, summary of the replay
+        """
+        lines = ['{:.1f}s replayed: {} samples ({} invalid), {} serial lines, {} weights displayed'.format(
+            self.now, self.samples, self.invalid_samples, self.serial_lines, len(self.controller.displayed))]
+        events = [(at, 'mount') for at in self.mounts] + [(at, 'dismount') for at in self.dismounts]
+        events += [(at, 'weighing total {:.0f}g wheelchair {:.0f}g patient {:.0f}g'.format(
+            total_weight, wheelchair_weight, total_weight - wheelchair_weight))
+            for at, total_weight, wheelchair_weight in self.weighings]
+        events += [(at, 'predicted weighing total {:.0f}g wheelchair {:.0f}g patient {:.0f}g'.format(
+            predicted_weight, wheelchair_weight, predicted_weight - wheelchair_weight))
+            for at, predicted_weight, wheelchair_weight in self.predicted_weighings]
+        for at, event in sorted(events):
+            lines.append('{:10.3f}s {}'.format(at, event))
+        for data in self.controller._serial.written:
+            lines.append('           tag write {}'.format(data.decode('utf-8', 'replace')))
+        return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a RolliePollie capture on a simulated clock')
+    parser.add_argument('capture', help='file recorded with CAPTURE_PATH set in config.py')
+    parser.add_argument('--speed', type=float, help='times real speed. Default: as fast as possible')
+    parser.add_argument('--readings', type=int, default=NUMBER_OF_READINGS, help='samples averaged per weight')
+    parser.add_argument('--precision', type=float, default=SAMPLE_PRECISION,
+                        help='grams, averages as many samples as this precision takes, like SAMPLE_PRECISION')
+    parser.add_argument('--estimator', choices=('mean', 'kalman'), default=WEIGHT_ESTIMATOR,
+                        help='weight estimator, like WEIGHT_ESTIMATOR in config.py')
+    parser.add_argument('--predict', action='store_true', default=SETTLING_PREDICTION,
+                        help='predict the settled weight, like SETTLING_PREDICTION in config.py')
+    parser.add_argument('--verbose', action='store_true', help='show the output of the controller')
+    args = parser.parse_args()
+
+    engine = ReplayEngine(args.capture, readings=args.readings, speed=args.speed, estimator=args.estimator,
+                          predict=args.predict, precision=args.precision)
+    started = time.perf_counter()
+    if args.verbose:
+        ring_log.LOG.set_level(ring_log.DEBUG)
+        ring_log.LOG.start()
+        engine.run()
+        ring_log.LOG.stop()
+    else:
+        with contextlib.redirect_stdout(io.StringIO()):
+            engine.run()
+    elapsed = time.perf_counter() - started
+    print(engine.report())
+    print('replayed in {:.2f}s, {:.0f}x real time'.format(elapsed, engine.now / elapsed if elapsed > 0 else 0))
+
+
+if __name__ == '__main__':
+    main()
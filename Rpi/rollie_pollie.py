@@ -1,100 +1,334 @@
 #!/usr/bin/env python3
+import io
+import queue
+import signal
+import time
 from lib.hx711 import HX711  # import the class HX711
-import RPi.GPIO as GPIO  # import GPIO
+from lib import hal
+from lib import metrics
+from lib import ring_log
+from lib import tracing
+from lib.hal import GPIO  # RPi.GPIO, or the simulated backend
 from lib.arduino_nfc import SerialNfc
+from lib.boot_timer import BootTimer
+from lib.calibration_store import CalibrationStore
+from lib.capture import CaptureWriter
+from lib.filters import make_chain
+from lib.gpiod_transport import GpiodTransport
+from lib.hx711_array import HX711Array
+from lib.kalman_estimator import KalmanWeightEstimator
+from lib.load_cell_fusion import LoadCellFusion
+from lib.nfc_write_queue import NfcWriteQueue
+from lib.sampling_profiler import SamplingProfiler
 from lib.scale_observer import ScaleObserver
+from lib.scale_sampler import ScaleSampler
+from lib.sequential_mean import SequentialMean
+from lib.settling_predictor import SettlingPredictor
 from lib.state import State
 from time import sleep
 # from Adafruit_CharLCD import Adafruit_CharLCD
 import lib.lcd_display as LcdDisplay
 from lib.tag_data import TagData
+from lib.zero_tracker import ZeroTracker
 from config import (
-    NUMBER_OF_READINGS, CHANNEL, GAIN, SCALE,
-    NFC_PORT,
+    HARDWARE_BACKEND, HX711_TRANSPORT, HX711_GPIO_CHIP,
+    HX711_ARRAY_DATA_PINS, HX711_ARRAY_SCALES, HX711_ARRAY_POSITIONS, ALL_WHEELS_ON_RADIUS,
+    NUMBER_OF_READINGS, CHANNEL, GAIN, SCALE, SAMPLE_BUFFER_SIZE, SAMPLE_MAX_AGE, HX711_FILTERS,
+    SAMPLE_PRECISION, SAMPLE_MIN_READINGS, SAMPLE_MAX_READINGS, SAMPLE_DEADLINE,
+    WEIGHT_ESTIMATOR, KALMAN_MEASUREMENT_NOISE, KALMAN_PROCESS_NOISE, KALMAN_SETTLED_DEVIATION, KALMAN_SETTLED_RATE,
+    SETTLING_PREDICTION, PREDICTION_BLOCK_SIZE, PREDICTION_TOLERANCE, PREDICTION_AGREEMENT,
+    NFC_PORT, NFC_PROTOCOL, NFC_BAUDRATE, TAG_MAX_AGE, NFC_WRITE_QUEUE_PATH, NFC_ACK_TIMEOUT,
+    ZERO_TRACKING, ZERO_TRACKING_BAND, ZERO_TRACKING_STEP, ZERO_TRACKING_LIMIT, TARE_READINGS, TARE_MAX_AGE,
+    LOG_LEVEL, LOG_LEVELS, LOG_PATH, LOG_FLUSH_INTERVAL, LOG_DUMP_PATH, METRICS_PORT, METRICS_HOST, LOOP_BUDGET,
+    TRACING, TRACE_PATH, PROFILE_SECONDS, PROFILE_INTERVAL, PROFILE_PATH, PROFILE_MAX_SECONDS,
+    CAPTURE_PATH, CALIBRATION_PATH, CALIBRATION_MAX_DRIFT, CALIBRATION_CHECK_READINGS, STARTUP_DEADLINE,
     CLOCK_PIN, DATA_PIN, TARE_BTN_PIN, REGISTRATION_BTN_PIN,
     RS_PIN, EN_PIN, D4_PIN, D5_PIN, D6_PIN, D7_PIN)
 
 
+_log = ring_log.get_logger('controller')
+_tracer = tracing.TRACER
+_profiler = SamplingProfiler(PROFILE_INTERVAL)
+_loop_seconds = metrics.histogram('loop_seconds', 'One pass of the controller loop, waiting for the samples included')
+_handling_seconds = metrics.histogram('loop_handling_seconds', 'Handling a weight: observer, tag and display')
+_overruns = metrics.counter('loop_overruns_total', 'Weights that took longer than LOOP_BUDGET to handle')
+_missed = metrics.counter('loop_missed_weights_total', 'Passes of the loop the hx711 delivered no weight in time')
+
+
 # RolliePollie integrates both the weighing scale and NFC reader. It acts as the controller.
 class RolliePollie:
     EMPTY_TAG = TagData(0, [])
 
     def __init__(self):
+        boot = BootTimer()
+        setup_logging()
+        setup_tracing()
 
         # Create an object hx which represents your real hx711 chip
         # Required input parameters are only 'dout_pin' and 'pd_sck_pin'
         # If you do not pass any argument 'gain_channel_A' then the default value is 128
         # If you do not pass any argument 'set_channel' then the default value is 'A'
         # you can set a gain for channel A even though you want to currently select channel B
-        self._scale = HX711(dout_pin=DATA_PIN, pd_sck_pin=CLOCK_PIN, gain_channel_A=GAIN, select_channel=CHANNEL)
+        # With HX711_TRANSPORT = 'gpiod' the hx711 is read through the GPIO character device instead of RPi.GPIO
+        # With HX711_ARRAY_DATA_PINS the scale is an array of hx711s, one per load cell, sharing CLOCK_PIN
+        self._load_cells = None
+        if HX711_ARRAY_DATA_PINS:
+            transport = None
+            if HX711_TRANSPORT == 'gpiod':
+                transport = GpiodTransport(tuple(HX711_ARRAY_DATA_PINS), CLOCK_PIN, HX711_GPIO_CHIP)
+            scales = HX711_ARRAY_SCALES or [SCALE] * len(HX711_ARRAY_DATA_PINS)
+            self._load_cells = HX711Array(HX711_ARRAY_DATA_PINS, CLOCK_PIN, scales, HX711_ARRAY_POSITIONS,
+                                          transport=transport)
+            self._scale = self._load_cells
+        else:
+            transport = GpiodTransport(DATA_PIN, CLOCK_PIN, HX711_GPIO_CHIP) if HX711_TRANSPORT == 'gpiod' else None
+            self._scale = HX711(dout_pin=DATA_PIN, pd_sck_pin=CLOCK_PIN, gain_channel_A=GAIN, select_channel=CHANNEL,
+                                transport=transport)
+        boot.lap('hx711')
+        self._sampler = ScaleSampler(self._scale, buffer_size=SAMPLE_BUFFER_SIZE)
+        self._sequential = None
+        if SAMPLE_PRECISION is not None:
+            self._sequential = SequentialMean(SAMPLE_MIN_READINGS, SAMPLE_MAX_READINGS, SAMPLE_DEADLINE)
+        self._estimator = None
+        if WEIGHT_ESTIMATOR == 'kalman':
+            self._estimator = KalmanWeightEstimator(KALMAN_MEASUREMENT_NOISE, KALMAN_PROCESS_NOISE,
+                                                    KALMAN_SETTLED_DEVIATION, KALMAN_SETTLED_RATE)
+        self._predictor = None
+        if SETTLING_PREDICTION:
+            self._predictor = SettlingPredictor(PREDICTION_BLOCK_SIZE, PREDICTION_TOLERANCE, PREDICTION_AGREEMENT)
+        if self._estimator is not None or self._predictor is not None:
+            self._sampler.add_listener(self._on_sample)
+        self._zero_tracker = None
+        self._zero_corrected = False  # the zero tracker has moved the offset since the calibration was saved
+        if ZERO_TRACKING:
+            self._zero_tracker = ZeroTracker(ZERO_TRACKING_BAND, ZERO_TRACKING_STEP, ZERO_TRACKING_LIMIT)
         self._ser_nfc = SerialNfc(NFC_PORT, baudrate=9600)
+        if NFC_PROTOCOL == 'auto':
+            self._ser_nfc.negotiate(NFC_BAUDRATE)  # stays in the legacy text mode with an older sketch
+        # tag writes are slow, they are sent by the write queue's own thread
+        self._write_queue = NfcWriteQueue(self._ser_nfc, path=NFC_WRITE_QUEUE_PATH, ack_timeout=NFC_ACK_TIMEOUT,
+                                          presence_timeout=TAG_MAX_AGE)
+        self._ser_nfc.on_write_result(self._write_queue.acknowledge)
+        boot.lap('nfc')
         self._observer = ScaleObserver()
         self._memoized_tag_data = None
+        self._registered_weights = queue.Queue()  # registered on the sampler thread, drawn by the control loop
         self._state = State.DEFAULT
+        self._capture = None
+        if CAPTURE_PATH:
+            self._capture = CaptureWriter(CAPTURE_PATH)
+            self._scale.set_capture(self._capture)
+            self._ser_nfc.set_capture(self._capture)
+        self._calibration_store = CalibrationStore(CALIBRATION_PATH) if CALIBRATION_PATH else None
 
         # instantiate lcd and specify pins
         self.lcd = LcdDisplay.LcdDisplay(RS_PIN, EN_PIN, D4_PIN, D5_PIN, D6_PIN, D7_PIN)
         self.lcd.init_io()
         self.lcd.init_lcd()
+        boot.lap('lcd')
 
         # setup
         self.setup_gpio()
-        self.setup_scale()
+        self.setup_scale(boot)
+        self._bind_observer_callbacks()
+        self.boot_phases = boot.phases
+        print(boot.report())
+
+    def _bind_observer_callbacks(self):
         self._observer.on_scale_dismount(self.flush_tag_data_callback)
         self._observer.on_scale_dismount(self.write_patient_weight_callback_clearer)
         self._observer.on_scale_dismount(self.lcd.set_show_nfc_write_indicator_off)
         self._observer.on_scale_mount(self.write_patient_weight_callback_adder)
 
+    def _record_calibration(self):
+        """
+        Records the offset and scale ratio in use, so a replay converts the captured samples the same way
+        """
+        if self._capture is not None:
+            self._capture.record_calibration(self._scale.get_current_channel(), self._scale.get_current_gain_A(),
+                                             self._scale.get_current_offset(),
+                                             self._scale.get_current_scale_ratio())
+
+    def _save_zero_corrections(self):
+        # called once the sampler has stopped
+        if self._zero_corrected:
+            self._save_calibration(tared=False)
+            self._zero_corrected = False
+
+    def _save_calibration(self, tared=True):
+        if self._calibration_store is None:
+            return
+        try:
+            self._calibration_store.save(self._scale, SCALE, tared)
+        except OSError as e:
+            print("Calibration not saved: {}".format(e))
+
+    def _restore_calibration(self):
+        """
+        Restores the saved calibration and checks it with a few readings of the empty platform
+        :return: True if restored, False if the scale has to be zeroed
+        """
+        if self._calibration_store is None:
+            return False
+        calibration = self._calibration_store.load(SCALE)
+        if calibration is None:
+            return False
+        CalibrationStore.apply(self._scale, calibration)
+        # the median of single readings, a garbage reading of the hx711 does not fail the check
+        readings = sorted(reading for reading in
+                          (self._scale.get_weight_mean(1) for _ in range(CALIBRATION_CHECK_READINGS))
+                          if reading is not False)
+        drift = readings[len(readings) // 2] if readings else False
+        if drift is False or abs(drift) > CALIBRATION_MAX_DRIFT:
+            print("Saved calibration is off by {}g, zeroing".format(drift))
+            return False
+        print("Calibration restored, tared {}".format(time.ctime(calibration['tared_at'])))
+        return True
+
+    @staticmethod
+    def _retry(step, message, deadline=STARTUP_DEADLINE):
+        """
+        :param step: lambda: bool, retried until it returns True
+        :param deadline: float, seconds to retry for
+        :return: True if the step succeeded in time
+        """
+        give_up = time.monotonic() + deadline
+        while not step():
+            print(message)
+            if time.monotonic() >= give_up:
+                return False
+        return True
+
+    def _on_sample(self, timestamp, raw):
+        # called on the sampler thread with every sample
+        weight = (raw - self._scale.get_current_offset()) / self._scale.get_current_scale_ratio()
+        if self._estimator is not None:
+            self._estimator.update(weight, timestamp)
+        if self._predictor is not None:
+            self._predictor.update(weight, timestamp)
+
     # Callbacks ###
     def test_callback(self):
         print("Tested")
 
     def write_patient_weight_callback_clearer(self):
         print("Callbacks cleared")
-        self._observer.on_successful_weighing(self.write_patient_weight_callback, lifetime=0)
-        self._observer.on_successful_weighing(self.indicate_nfc_write_callback, lifetime=0)
+        self._expire_write_patient_weight_callback()
 
     def write_patient_weight_callback_adder(self):
         print("Callbacks added")
+        # with a settling predictor, the predicted weight is written without waiting for the scale to settle.
+        # The settled weight is still written if no prediction becomes confident, whichever comes first expires both
         self._observer.on_successful_weighing(self.write_patient_weight_callback, lifetime=1)
-        self._observer.on_successful_weighing(self.indicate_nfc_write_callback, lifetime=1)
+        if self._predictor is not None:
+            self._observer.on_predicted_weighing(self.write_patient_weight_callback, lifetime=1)
+
+    def _expire_write_patient_weight_callback(self):
+        self._observer.on_successful_weighing(self.write_patient_weight_callback, lifetime=0)
+        self._observer.on_predicted_weighing(self.write_patient_weight_callback, lifetime=0)
 
     def indicate_nfc_write_callback(self, total_weight, wheelchair_weight):
         self.lcd.set_show_nfc_write_indicator_on()
 
     def write_patient_weight_callback(self, total_weight, wheelchair_weight):
+        self._expire_write_patient_weight_callback()  # a weighing is written once, predicted or settled
+        self.indicate_nfc_write_callback(total_weight, wheelchair_weight)
         patient_weight = round(total_weight - wheelchair_weight)
-        self._ser_nfc.update_patient_weight_with_date(patient_weight)
-        print("Attempt to write {} to tag".format(patient_weight))
+        if self._write_queue.enqueue_patient_weight(patient_weight, self._memoized_tag_data):
+            print("Queued {} to be written to tag".format(patient_weight))
 
     def flush_tag_data_callback(self):
         self._memoized_tag_data = RolliePollie.EMPTY_TAG
 
+    # The button callbacks run on the RPi.GPIO thread. The sampler owns the HX711, so they only submit their
+    # command to it, which runs it between two conversions
     def tare_callback(self, channel):
-        total_weight = self._scale.get_weight_mean(NUMBER_OF_READINGS)
-        self.output_weight_g_to_kg(total_weight)
-        self._scale.zero(times=10)
-        print("Tared")
+        self._sampler.submit(self._tare, ScaleSampler.TARE)
 
     def register_callback(self, channel):
-        total_weight = self._scale.get_weight_mean(NUMBER_OF_READINGS)
-        self.output_weight_g_to_kg(total_weight)
-        wheelchair_weight = self._scale.get_weight_mean(NUMBER_OF_READINGS)
-        self._ser_nfc.write_wheelchair_weight(wheelchair_weight)
+        self._sampler.submit(self._register, ScaleSampler.REGISTER)
+
+    def recalibrate(self):
+        """
+        Zeroes the scale with fresh readings, on the sampler thread
+        :return: Future, True if zeroed
+        """
+        return self._sampler.submit(self._recalibrate, ScaleSampler.CALIBRATE)
+
+    # Scale commands, run on the sampler thread ###
+    def _tare(self, scale):
+        # A stable weight is tared at once from the buffered samples, else fresh ones are read
+        max_age = TARE_MAX_AGE if self._observer.is_stable else None
+        if self._sampler.tare_now(n=TARE_READINGS, max_age=max_age):
+            self._offset_changed()
+            print("Tared")
+        else:
+            print("Tare failed")
+
+    def _register(self, scale):
+        wheelchair_weight = self._sampler.get_weight_estimate(NUMBER_OF_READINGS, max_age=SAMPLE_MAX_AGE)
+        if wheelchair_weight is None:
+            print("No recent reading, wheelchair weight not updated")
+            return
+        self._registered_weights.put(wheelchair_weight)  # the control loop is the only one drawing the LCD
+        self._write_queue.enqueue_wheelchair_weight(round(wheelchair_weight))
         print("updated wheelchair weight to {}".format(wheelchair_weight))
 
+    def _recalibrate(self, scale):
+        if not scale.zero(times=10):
+            print("Zeroing failed")
+            return False
+        self._offset_changed()
+        print("Zeroed")
+        return True
+
+    def _correct_zero(self, correction):
+        offset = self._scale.get_current_offset() + correction * self._scale.get_current_scale_ratio()
+        self._scale.set_offset(int(round(offset)))
+        self._record_calibration()
+        self._zero_corrected = True  # saved with the next tare or at shutdown, not with every small step
+
+    def _offset_changed(self):
+        if self._estimator is not None:
+            self._estimator.reset()  # every weight moved with the offset
+        if self._predictor is not None:
+            self._predictor.reset()
+        if self._zero_tracker is not None:
+            self._zero_tracker.reset()
+        self._record_calibration()
+        self._save_calibration()
+        self._zero_corrected = False
+
     # Setups ###
-    def setup_scale(self):
-        # Keeps resetting until scale is ready
-        while not self._scale.reset():
-            print("resetting")
-            pass
-        # measure tare and save the value as offset for current channel and gain selected.
-        # keeps looping until properly zeroed
-        while not self._scale.zero(times=10):
-            print("zeroing")
-            pass
-        self._scale.set_scale_ratio(scale_ratio=SCALE)  # set ratio for current channel
+    def setup_scale(self, boot=None):
+        """
+        :param boot: BootTimer the reset and calibration phases are lapped on
+        """
+        boot = boot or BootTimer()
+        # the ratio comes first, the precision of sequential sampling is in grams
+        if self._load_cells is None:  # the cells of an array have their own ratios and read grams
+            self._scale.set_scale_ratio(scale_ratio=SCALE)  # set ratio for current channel
+        self._scale.set_precision(SAMPLE_PRECISION, SAMPLE_MIN_READINGS, SAMPLE_MAX_READINGS, SAMPLE_DEADLINE)
+        # Keeps resetting until scale is ready, for at most STARTUP_DEADLINE
+        self._scale_ready = self._retry(self._scale.reset, "resetting")
+        if not self._scale_ready:
+            print("hx711 not ready after {}s".format(STARTUP_DEADLINE))
+        boot.lap('reset')
+        # a saved calibration that still fits the empty platform spares the full zeroing
+        self._scale_zeroed = self._restore_calibration()
+        if not self._scale_zeroed:
+            # measure tare and save the value as offset for current channel and gain selected.
+            # keeps looping until properly zeroed, for at most STARTUP_DEADLINE
+            self._scale_zeroed = self._retry(lambda: self._scale.zero(times=10), "zeroing")
+            if self._scale_zeroed:
+                self._save_calibration()
+            else:
+                print("Zeroing failed after {}s, retried once sampling starts".format(STARTUP_DEADLINE))
+        self._record_calibration()
+        # set once zeroed, the zeroing averages the raw readings. The cells of an array are read unfiltered
+        if HX711_FILTERS and self._load_cells is None:
+            self._scale.set_filter(make_chain(HX711_FILTERS), CHANNEL, GAIN)
+        boot.lap('calibration')
 
     def setup_gpio(self):
         """
@@ -118,54 +352,179 @@ class RolliePollie:
                               callback=self.register_callback,
                               bouncetime=300)
 
+    def start_sampling(self):
+        # setup_scale has just reset the hx711, resetting it again would only cost another 6 readings
+        if self._scale_ready:
+            print('Ready to use')
+        else:
+            print('not ready')
+
+        # be aware that HX711 sometimes return invalid or wrong data.
+        # From here on the sampler thread owns the hx711, everything else reads its sample stream or submits
+        # commands to it
+        if not self._scale_zeroed:
+            self.recalibrate()
+        self._sampler.start()
+        self._write_queue.start()
+
+    @tracing.traced(category='loop')
+    def next_weight(self, timeout=None):
+        """
+        Waits for the samples of the next weight: one sample with the Kalman estimator, as many as it takes to
+        reach SAMPLE_PRECISION with sequential sampling, else NUMBER_OF_READINGS.
+        :param timeout: float, seconds
+        :return: (float, bool) total weight in grams and whether the estimator considers it settled, None without
+        an estimator as the observer decides stability. None if the hx711 did not deliver in time
+        """
+        if self._estimator is not None:
+            if not self._sampler.wait_for_samples(1, timeout):
+                return None
+            estimate = self._estimator.snapshot()
+            if estimate is None:  # reset by a tare or zero correction since the sample, a missed weight
+                return None
+            return estimate.weight, estimate.settled
+        if self._sequential is not None:
+            total_weight = self._sampler.get_weight_sequential(self._sequential, SAMPLE_PRECISION, timeout)
+            return None if total_weight is None else (total_weight, None)
+        if not self._sampler.wait_for_samples(NUMBER_OF_READINGS, timeout):
+            return None
+        return self._sampler.get_weight_estimate(NUMBER_OF_READINGS), None
+
+    @tracing.traced(category='loop')
+    def process_reading(self, total_weight, tag_data, settled=None):
+        """
+        Deducts the wheelchair weight of the current (or last memoized) tag and updates the observer
+        :param total_weight: float, grams
+        :param tag_data: TagData or None if no tag was read
+        :param settled: bool, stability of total_weight given by the estimator, None lets the observer decide
+        :return: float, weight to display in grams
+        """
+        predicted_weight = None if self._predictor is None else self._predictor.prediction
+        all_wheels_on = None
+        if self._load_cells is not None and self._load_cells.last_fusion is not None:
+            all_wheels_on = LoadCellFusion.is_centred(self._load_cells.last_fusion, ALL_WHEELS_ON_RADIUS)
+        is_nfc_present = not (tag_data is None)
+
+        if tag_data:  # Memoizes a new tag data if presented with one
+            self._memoized_tag_data = tag_data
+            self._write_queue.tag_seen(tag_data)
+            weight_in_grams = total_weight - self._memoized_tag_data.wheelchair_weight
+
+        elif self._memoized_tag_data:  # In the absence of tag data, use last memoized tag data
+            weight_in_grams = total_weight - self._memoized_tag_data.wheelchair_weight
+
+        else:  # If there is no available tag data, perform as a normal weighing scale
+            weight_in_grams = total_weight
+
+        self._observer.update(total_weight, self._memoized_tag_data, is_nfc_present, settled, predicted_weight,
+                              all_wheels_on)
+        if self._zero_tracker is not None:
+            self._track_zero(total_weight)
+        return weight_in_grams
+
+    def _track_zero(self, total_weight):
+        """
+        Takes the drift of the empty scale off the offset of the current channel and gain
+        :param total_weight: float, grams
+        """
+        empty = not self._observer.person_on_scale and self._observer.is_stable
+        correction = self._zero_tracker.update(total_weight, empty)
+        if correction != 0:
+            self._sampler.submit(lambda scale: self._correct_zero(correction), ScaleSampler.CALIBRATE)
+
+    def start_metrics(self):
+        """
+        Serves the metrics on METRICS_PORT, see lib/metrics.py
+        """
+        if METRICS_PORT is None:
+            return
+        metrics.gauge('nfc_write_queue_pending', 'Tag writes waiting to be sent or acknowledged').set_function(
+            lambda: len(self._write_queue.pending()))
+        metrics.gauge('sampler_samples', 'Valid samples acquired by the sampler thread').set_function(
+            self._sampler.sample_count)
+        if self._zero_tracker is not None:
+            metrics.gauge('zero_tracking_correction_grams', 'Drift taken off the zero since the last tare') \
+                .set_function(lambda: self._zero_tracker.correction)
+        metrics.REGISTRY.add_route('/trace', lambda query: ('application/json', export_trace()))
+        metrics.REGISTRY.add_route('/profile', lambda query: ('text/plain; charset=utf-8', profile(
+            min(float(query.get('seconds', [PROFILE_SECONDS])[0]), PROFILE_MAX_SECONDS))))
+        try:
+            port = metrics.REGISTRY.serve(METRICS_PORT, METRICS_HOST)
+            print("Metrics on http://{}:{}/metrics".format(METRICS_HOST, port))
+        except OSError as e:  # e.g. the port is taken, the scale works without
+            print("Metrics not served: {}".format(e))
+
     def run(self):
         """
         Main logic for RolliePollie weighing scale
         """
         try:
-            result = self._scale.reset()  # Before we start, reset the hx711 ( not necessary)
-            if result:  # you can check if the reset was successful
-                print('Ready to use')
+            self.start_sampling()
+            self.start_metrics()
+            self._ser_nfc.start_reader()  # the serial port is read on its own thread from here on
+
+            if self._estimator is not None:
+                print('Weight estimated on every reading:')
+            elif self._sequential is not None:
+                print('Weight taking the average of readings to within {}g:'.format(SAMPLE_PRECISION))
             else:
-                print('not ready')
-
-            # if you need the data fast without doing average or filtering them.
-            # do some kind of loop and do not pass any argument. Default 'times' is 1
-            # be aware that HX711 sometimes return invalid or wrong data.
-            # you can probably see it now
-            print('Weight taking the average of {} reading(s):'.format(NUMBER_OF_READINGS))
+                print('Weight taking the average of {} reading(s):'.format(NUMBER_OF_READINGS))
+            started = time.perf_counter()
             while True:
-                # the value will vary because it is only one immediate reading.
                 # the default speed for hx711 is 10 samples per second
-                tag_data = self._ser_nfc.get_weight()
-                is_nfc_present = not (tag_data is None)
-                total_weight = self._scale.get_weight_mean(NUMBER_OF_READINGS)
-
-                if tag_data:  # Memoizes a new tag data if presented with one
-                    self._memoized_tag_data = tag_data
-                    weight_in_grams = total_weight - self._memoized_tag_data.wheelchair_weight
-
-                elif self._memoized_tag_data:  # In the absence of tag data, use last memoized tag data
-                    weight_in_grams = total_weight - self._memoized_tag_data.wheelchair_weight
-
-                else:  # If there is no available tag data, perform as a normal weighing scale
-                    weight_in_grams = total_weight
-
-                self._observer.update(total_weight, self._memoized_tag_data, is_nfc_present)
-                self.output_weight_g_to_kg(weight_in_grams)
-                print("{:.1f}kg".format(weight_in_grams / 1000))  # for debugging
+                # a pass is a span of the trace, with a span of each stage in it, see lib/tracing.py
+                span = _tracer.begin()
+                tag_data = self._ser_nfc.poll_tag()
+                weight = self.next_weight(timeout=SAMPLE_MAX_AGE * 5)
+                if weight is None:
+                    _missed.inc()
+                    _tracer.end('loop', 'loop', span)
+                    continue  # the hx711 is not delivering valid readings
+                total_weight, settled = weight
+
+                handling = time.perf_counter()
+                weight_in_grams = self.process_reading(total_weight, tag_data, settled)
+                self.output_weight_g_to_kg(self._weight_to_display(weight_in_grams))
+                _log.debug("{:.1f}kg", weight_in_grams / 1000)  # for debugging
+                finished = time.perf_counter()
+                _tracer.end('loop', 'loop', span)
+                if finished - handling > LOOP_BUDGET:
+                    _overruns.inc()
+                _handling_seconds.observe(finished - handling)
+                _loop_seconds.observe(finished - started)
+                started = finished
 
         except (KeyboardInterrupt, SystemExit):
             print('\nGPIO cleaned up, serial closed(if opened)\n Bye (:')
 
+        except Exception:
+            dump_log()  # the records leading up to the failure
+            raise
+
         finally:
+            self._sampler.stop()
+            self._save_zero_corrections()
+            self._write_queue.stop()
             self._ser_nfc.close()
+            if self._capture is not None:
+                self._capture.close()
             self.lcd.display_off()
             GPIO.cleanup()
+            metrics.REGISTRY.shutdown()
+            ring_log.LOG.stop()
 
-    def output_weight_g_to_kg(self, weight, decimal_points=1):
-        self.lcd.clear_display()
+    def _weight_to_display(self, weight_in_grams):
+        """
+        :param weight_in_grams: float, weight just processed
+        :return: float, a wheelchair weight registered since the last pass instead, if there is one
+        """
+        try:
+            return self._registered_weights.get_nowait()
+        except queue.Empty:
+            return weight_in_grams
 
+    @tracing.traced(category='loop')
+    def output_weight_g_to_kg(self, weight, decimal_points=1):
         weight_in_kg = int(round(weight / 1000, decimal_points) * 10)
         weight_in_kg = weight_in_kg if weight_in_kg != 0 else abs(0)  # converts -0 to 0
         isNegative = True if weight_in_kg < 0 else False
@@ -181,5 +540,97 @@ class RolliePollie:
         self.lcd.display_weight(w_str, isNegative)
 
 
+def setup_logging():
+    """
+    Sets the log levels and starts writing out the ring log. kill -USR1 dumps it to LOG_DUMP_PATH
+    """
+    ring_log.LOG.set_level(LOG_LEVEL)
+    for subsystem, level in LOG_LEVELS.items():
+        ring_log.LOG.set_level(level, subsystem)
+    if not ring_log.LOG.is_running():
+        ring_log.LOG.start(open(LOG_PATH, 'a') if LOG_PATH else None, LOG_FLUSH_INTERVAL)
+    if hasattr(signal, 'SIGUSR1'):
+        try:
+            signal.signal(signal.SIGUSR1, lambda signum, frame: dump_log())
+        except ValueError:  # signal handlers can only be set from the main thread
+            pass
+
+
+def dump_log():
+    """
+    Writes every log record still in memory to LOG_DUMP_PATH
+    """
+    try:
+        with open(LOG_DUMP_PATH, 'w') as f:
+            ring_log.LOG.dump(f)
+    except OSError as e:
+        print("Log not dumped: {}".format(e))
+
+
+def setup_tracing():
+    """
+    Turns the spans on or off. kill -USR2 profiles the process for PROFILE_SECONDS and writes the profile to
+    PROFILE_PATH and the spans to TRACE_PATH
+    """
+    _tracer.enabled = TRACING
+    if hasattr(signal, 'SIGUSR2'):
+        try:
+            signal.signal(signal.SIGUSR2, lambda signum, frame: _profiler.profile_in_background(
+                PROFILE_SECONDS, write_profile))
+        except ValueError:  # signal handlers can only be set from the main thread
+            pass
+
+
+def export_trace():
+    """
+    :return: String, the spans in memory in the Chrome trace event format
+    """
+    trace = io.StringIO()
+    _tracer.export_chrome(trace)
+    return trace.getvalue()
+
+
+def profile(seconds):
+    """
+    Profiles every thread for seconds, blocking
+    :return: String, the collapsed stacks
+    """
+    stacks = _profiler.profile(seconds)
+    if stacks is None:
+        raise ValueError('a profile is running already')
+    return SamplingProfiler.collapsed(stacks)
+
+
+def write_profile(stacks):
+    """
+    Writes a profile to PROFILE_PATH and the spans it covers to TRACE_PATH
+    :param stacks: Counter from SamplingProfiler.profile, None if a profile was running already
+    """
+    if stacks is None:
+        return
+    try:
+        with open(PROFILE_PATH, 'w') as f:
+            f.write(SamplingProfiler.collapsed(stacks))
+        with open(TRACE_PATH, 'w') as f:
+            _tracer.export_chrome(f)
+        _log.warning("Profile written to {}, trace to {}", PROFILE_PATH, TRACE_PATH)
+    except OSError as e:
+        _log.error("Profile not written: {}", e)
+
+
+def select_hardware(backend=HARDWARE_BACKEND):
+    """
+    Selects the hardware backend. With 'sim', simulated devices are wired onto the configured pins and port.
+    :return: SimulatedRig or None
+    """
+    hal.select_backend(backend)
+    if backend == 'sim':
+        from lib.sim_devices import SimulatedRig
+        return SimulatedRig(DATA_PIN, CLOCK_PIN, (RS_PIN, EN_PIN, D4_PIN, D5_PIN, D6_PIN, D7_PIN), NFC_PORT,
+                            array_data_pins=HX711_ARRAY_DATA_PINS or ())
+    return None
+
+
 if __name__ == '__main__':
+    select_hardware()
     RolliePollie().run()
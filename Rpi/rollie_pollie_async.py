@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+import asyncio
+import time
+from lib.hal import GPIO
+from lib.async_serial import AsyncSerialNfc
+from lib import metrics
+from lib import ring_log
+from rollie_pollie import RolliePollie, select_hardware, dump_log
+from config import SAMPLE_MAX_AGE, TAG_MAX_AGE, LOOP_BUDGET
+
+_handling_seconds = metrics.histogram('loop_handling_seconds', 'Handling a weight: observer, tag and display')
+_overruns = metrics.counter('loop_overruns_total', 'Weights that took longer than LOOP_BUDGET to handle')
+_missed = metrics.counter('loop_missed_weights_total', 'Passes of the loop the hx711 delivered no weight in time')
+_weights_dropped = metrics.counter('loop_weights_dropped_total',
+                                   'Weights or displays replaced in a full queue before they were handled')
+
+
+# AsyncRolliePollie is the asyncio edition of the RolliePollie controller. Scale acquisition, NFC reading,
+# observer evaluation and the display each run as their own task, joined by bounded queues, so a slow or
+# stalled stage does not hold up the others.
+class AsyncRolliePollie(RolliePollie):
+    QUEUE_SIZE = 4
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._weight_queue = None
+        self._display_queue = None
+        self._async_nfc = None
+        self._latest_tag = None  # (received_at, TagData)
+        super().__init__()
+
+    @staticmethod
+    def _put_latest(queue, item):
+        # bounded queues only ever hold the most recent items, the oldest one is dropped when full
+        if queue.full():
+            queue.get_nowait()
+            _weights_dropped.inc()
+        queue.put_nowait(item)
+
+    def output_weight_g_to_kg(self, weight, decimal_points=1):
+        # The display task is the only writer of the LCD. Button callbacks run on the RPi.GPIO thread,
+        # so they hand their weight over to the event loop instead of drawing directly.
+        if self._display_queue is None:
+            super().output_weight_g_to_kg(weight, decimal_points)
+        else:
+            self._loop.call_soon_threadsafe(self._put_latest, self._display_queue, weight)
+
+    # Tasks ###
+    async def _scale_task(self):
+        while True:
+            # the sampler thread does the reading, this only waits for it without blocking the loop
+            weight = await self._loop.run_in_executor(None, self.next_weight, SAMPLE_MAX_AGE * 5)
+            if weight is None:
+                _missed.inc()
+                continue  # the hx711 is not delivering valid readings
+            self._put_latest(self._weight_queue, weight)
+
+    async def _nfc_task(self):
+        while True:
+            try:
+                tag_data = await self._async_nfc.read_tag()
+            except ConnectionError:
+                return  # the scale keeps weighing without tags, the disconnect is in the log
+            self._latest_tag = (time.monotonic(), tag_data)
+
+    async def _observer_task(self):
+        while True:
+            total_weight, settled = await self._weight_queue.get()
+            handling = time.perf_counter()
+            tag_data = None
+            if self._latest_tag is not None:
+                received_at, latest = self._latest_tag
+                self._latest_tag = None  # every tag frame is consumed once, like SerialNfc.get_weight
+                if time.monotonic() - received_at <= TAG_MAX_AGE:
+                    tag_data = latest
+            weight_in_grams = self.process_reading(total_weight, tag_data, settled)
+            self._put_latest(self._display_queue, self._weight_to_display(weight_in_grams))
+            elapsed = time.perf_counter() - handling  # the display is drawn by its own task
+            if elapsed > LOOP_BUDGET:
+                _overruns.inc()
+            _handling_seconds.observe(elapsed)
+
+    async def _display_task(self):
+        while True:
+            weight_in_grams = await self._display_queue.get()
+            RolliePollie.output_weight_g_to_kg(self, weight_in_grams)
+
+    async def _main(self):
+        self._weight_queue = asyncio.Queue(maxsize=AsyncRolliePollie.QUEUE_SIZE)
+        self._display_queue = asyncio.Queue(maxsize=AsyncRolliePollie.QUEUE_SIZE)
+        self._async_nfc = AsyncSerialNfc(self._ser_nfc, self._loop)
+        self._async_nfc.start()
+        tasks = [self._loop.create_task(task) for task in
+                 (self._scale_task(), self._nfc_task(), self._observer_task(), self._display_task())]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            self._async_nfc.close()
+
+    def run(self):
+        """
+        Main logic for RolliePollie weighing scale, asyncio edition
+        """
+        asyncio.set_event_loop(self._loop)
+        try:
+            self.start_sampling()
+            self.start_metrics()
+            self._loop.run_until_complete(self._main())
+
+        except (KeyboardInterrupt, SystemExit):
+            print('\nGPIO cleaned up, serial closed(if opened)\n Bye (:')
+
+        except Exception:
+            dump_log()  # the records leading up to the failure
+            raise
+
+        finally:
+            # KeyboardInterrupt leaves run_until_complete without running the finally of _main, so the tasks
+            # still pending are cancelled and run to their end here, before the loop is closed
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            if self._async_nfc is not None:
+                self._async_nfc.close()
+            self._display_queue = None
+            self._sampler.stop()  # wakes the executor threads waiting in next_weight
+            self._loop.run_until_complete(self._loop.shutdown_default_executor())
+            self._save_zero_corrections()
+            self._write_queue.stop()
+            self._ser_nfc.close()
+            if self._capture is not None:
+                self._capture.close()
+            self.lcd.display_off()
+            GPIO.cleanup()
+            metrics.REGISTRY.shutdown()
+            ring_log.LOG.stop()
+            self._loop.close()
+
+
+if __name__ == '__main__':
+    select_hardware()
+    AsyncRolliePollie().run()
@@ -0,0 +1,80 @@
+import time
+import unittest
+from lib import gpiod_transport
+from lib import hal
+from lib.gpiod_transport import GpiodTransport
+from lib.hx711 import HX711
+from lib.sim_devices import SimulatedHX711
+
+DATA_PIN = 5
+CLOCK_PIN = 6
+RAW_A = 100000  # channel A, gain 128
+RAW_B = -5000
+MAX_PULSE = 0.01  # seconds, far above a pulse of the simulation, so only the stretched pulse powers down
+
+
+# HX711 read through GpiodTransport, with SimulatedGpiod standing in for the GPIO character device
+class GpiodTransportTest(unittest.TestCase):
+
+    def setUp(self):
+        hal.select_backend('sim')
+        self._max_pulse = gpiod_transport.MAX_PULSE
+        gpiod_transport.MAX_PULSE = MAX_PULSE
+        self.chip = hal.get_gpio().attach(SimulatedHX711(DATA_PIN, CLOCK_PIN, noise=0, sample_rate=80,
+                                                         channel_b_source=lambda: RAW_B,
+                                                         power_down_time=MAX_PULSE))
+        self.chip.raw_value = RAW_A
+        self.transport = GpiodTransport(DATA_PIN, CLOCK_PIN)
+        self.hx = HX711(DATA_PIN, CLOCK_PIN, transport=self.transport)
+
+    def tearDown(self):
+        self.transport.close()
+        gpiod_transport.MAX_PULSE = self._max_pulse
+        hal.select_backend('rpi')
+
+    def read(self):
+        channel = self.hx.get_current_channel()
+        return channel, self.hx._read()
+
+    def test_reads_channel_a(self):
+        self.assertEqual(self.read(), ('A', RAW_A))
+
+    def test_switches_to_channel_b(self):
+        self.assertTrue(self.hx.select_channel('B'))
+        self.assertEqual(self.read(), ('B', RAW_B))
+        self.assertEqual(self.read(), ('B', RAW_B))
+
+    def test_switches_after_an_invalid_word(self):
+        self.chip.invalid_rate = 1.0  # the words are invalid, their trailing pulses still switch
+        self.assertTrue(self.hx.select_channel('B'))
+        self.chip.invalid_rate = 0.0
+        self.assertEqual(self.read(), ('B', RAW_B))
+
+    def test_recovers_from_a_timeout(self):
+        self.assertTrue(self.hx.select_channel('B'))
+        self.assertEqual(self.read(), ('B', RAW_B))
+        request = self.transport._request
+        set_value = request.set_value
+        calls = [0]
+
+        def stretched(offset, value):
+            calls[0] += 1
+            set_value(offset, value)
+            if calls[0] == 10:  # PD_SCK high half way through the word, for long enough to power down
+                time.sleep(MAX_PULSE * 2)
+
+        request.set_value = stretched
+        try:
+            self.assertIs(self.hx._read(), False)
+        finally:
+            request.set_value = set_value
+        self.assertEqual(self.transport.aborted_reads, 1)
+        # the chip restarted on channel A, gain 128, and the next word is labelled with them
+        self.assertEqual(self.hx.get_current_channel(), 'A')
+        self.assertEqual(self.hx.get_current_gain_A(), 128)
+        self.assertEqual(self.read(), ('A', RAW_A))
+        self.assertEqual(self.read(), ('B', RAW_B))
+
+
+if __name__ == '__main__':
+    unittest.main()
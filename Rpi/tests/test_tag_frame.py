@@ -0,0 +1,68 @@
+import random
+import unittest
+from lib.tag_frame import parse_tag_frame
+from lib.tag_frame_corpus import VALID, MALFORMED, parse_previous
+
+MUTATIONS = 20000
+MUTATION_ALPHABET = b' :^@,-.0123456789\x02\xff\r\n'
+
+
+def as_tuple(tag_data):
+    if tag_data is None:
+        return None
+    return tag_data.wheelchair_weight, [(weight, day.strftime('%d-%m-%Y')) for weight, day in tag_data.past_weights]
+
+
+def mutate(rng, frame, other):
+    frame = bytearray(frame)
+    for _ in range(rng.randint(1, 3)):
+        operation = rng.randrange(5)
+        position = rng.randint(0, len(frame))
+        if operation == 0 and frame:
+            frame[min(position, len(frame) - 1)] = rng.choice(MUTATION_ALPHABET)
+        elif operation == 1 and frame:
+            del frame[min(position, len(frame) - 1)]
+        elif operation == 2:
+            frame.insert(position, rng.choice(MUTATION_ALPHABET))
+        elif operation == 3:
+            del frame[position:]  # frame cut short
+        else:
+            frame[position:position] = other[rng.randint(0, len(other)):]  # two frames run together
+    return bytes(frame)
+
+
+# parse_tag_frame on the corpus, and fuzzed with mutations of its valid frames
+class TagFrameTest(unittest.TestCase):
+
+    def setUp(self):
+        parse_tag_frame.cache_clear()
+
+    def test_parses_valid_frames(self):
+        for frame, expected in VALID:
+            with self.subTest(frame=frame):
+                self.assertEqual(as_tuple(parse_tag_frame(frame)), expected)
+
+    def test_rejects_malformed_frames(self):
+        for frame in MALFORMED:
+            with self.subTest(frame=frame):
+                self.assertIsNone(parse_tag_frame(frame))
+
+    def test_mutated_frames(self):
+        # Mutated frames never raise and agree with the previous parser whenever that one does not raise.
+        # The previous parser dropped every ':' and '^' in a token, so frames it read as a weight
+        # (e.g. b' :150:0') may be rejected now.
+        rng = random.Random(1)
+        frames = [frame for frame, _ in VALID]
+        for _ in range(MUTATIONS):
+            frame = mutate(rng, rng.choice(frames), rng.choice(frames))
+            result = parse_tag_frame(frame)
+            if result is not None:
+                self.assertIsInstance(result.wheelchair_weight, float, frame)
+                for weight, _ in result.past_weights:
+                    self.assertIsInstance(weight, float, frame)
+            try:
+                previous = parse_previous(frame)
+            except (ValueError, IndexError):
+                continue  # the previous parser raised, the new one rejects or parses the frame
+            if result is not None:
+                self.assertEqual(as_tuple(result), as_tuple(previous), frame)